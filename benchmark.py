@@ -0,0 +1,567 @@
+# -*- coding: utf-8 -*-
+
+"""
+Module Description: 基准测试, 使用进程内模拟collection(或本地mongod)端到端运行三种比对方式, 并对摘要/拉取/快照做微基准, 与保存的基线对比
+Date: 2026/10/18
+Author: HuYuanCheng
+"""
+import asyncio
+import bisect
+import contextlib
+import getopt
+import hashlib
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import bson
+from bson.raw_bson import RawBSONDocument
+
+import comparison
+from comparison import AsyncDbCompare, AsyncDbLoadCompare, AsyncDbWrite
+from digest import DigestEngine, ALGO_BLAKE2B, ALGO_MD5, ALGO_MD5_STR, ALGO_XXH3, xxhash
+from follow import doc_key
+from hashing import DigestExecutor, EXECUTOR_INLINE, HASH_EXECUTOR, HASH_WORKERS
+from connection import PoolWaitListener
+from logsink import LogSink
+from ranges import id_sort_key
+from snapshot import DigestTable, SnapshotReader, SnapshotWriter
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+BENCH_DB = "bench_db"
+BENCH_COLL = "bench_coll"
+BENCH_BASELINE = "benchmark_baseline.json"
+
+MODES = ("sample", "full", "merkle")
+STAGES = ("src_fetch", "dst_fetch", "hash", "compare", "unit")
+
+
+def baseline_params(params):
+    """
+    决定结果是否可比的参数, suite只影响运行哪些基准
+    """
+    return dict((key, value) for key, value in params.items() if key != "suite")
+
+
+def peak_rss_mb():
+    """
+    进程峰值常驻内存(MB), 不支持resource模块的平台返回None
+    """
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024.0 * 1024 if sys.platform == 'darwin' else 1024.0), 1)
+
+
+def make_docs(count, size, diff_rate, seed=0):
+    """
+    生成src/dst文档, 约diff_rate比例的文档在dst中不一致: 1/2字段不同, 1/4缺失, 1/4为dst多出的文档
+    返回(src文档列表, dst文档列表, 预期差异数)
+    """
+    rng = random.Random(seed)
+    src, dst = [], []
+    diffs = 0
+    base_size = len(bson.encode({"_id": count, "name": "user_{}".format(count), "level": 0, "score": 0.0,
+                                 "tags": ["a", "b", "c"], "payload": ""}))
+    payload = "x" * max(0, size - base_size)
+    for i in range(count):
+        doc = {"_id": i, "name": "user_{}".format(i), "level": rng.randint(1, 100), "score": rng.random(),
+               "tags": rng.sample(["a", "b", "c", "d", "e"], 3), "payload": payload}
+        src.append(doc)
+        if rng.random() >= diff_rate:
+            dst.append(doc)
+            continue
+        diffs += 1
+        kind = rng.random()
+        if kind < 0.5:
+            changed = dict(doc)
+            changed["level"] += 1
+            dst.append(changed)
+        elif kind >= 0.75:
+            dst.append(doc)
+            extra = dict(doc)
+            extra["_id"] = count + i
+            dst.append(extra)
+    return src, dst, diffs
+
+
+class FakeCursor:
+    """
+    模拟motor游标, 结果按_id升序, 每拉取batch_size个文档等待一次latency模拟网络往返
+    """
+    def __init__(self, docs, latency, raw):
+        self.docs = docs
+        self.latency = latency
+        self.raw = raw
+        self.batch = 101
+        self.pos = 0
+        self.fetched = 0
+
+    def sort(self, key, direction=1):
+        return self
+
+    def batch_size(self, batch):
+        self.batch = max(batch, 1)
+        return self
+
+    @property
+    def alive(self):
+        return self.pos < len(self.docs)
+
+    def _doc(self, data):
+        if isinstance(data, dict):
+            return data
+        return RawBSONDocument(data) if self.raw else bson.decode(data)
+
+    async def _fetch(self):
+        await asyncio.sleep(self.latency)
+        self.fetched = min(len(self.docs), self.fetched + self.batch)
+
+    async def next(self):
+        if self.pos >= len(self.docs):
+            raise StopAsyncIteration
+        if self.pos >= self.fetched:
+            await self._fetch()
+        doc = self.docs[self.pos]
+        self.pos += 1
+        return self._doc(doc)
+
+    async def to_list(self, length=None):
+        end = len(self.docs) if length is None else min(len(self.docs), self.pos + length)
+        while self.fetched < end:
+            await self._fetch()
+        docs = [self._doc(data) for data in self.docs[self.pos:end]]
+        self.pos = end
+        return docs
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.next()
+
+
+def hashed_index_key(value):
+    """
+    模拟$toHashedIndexKey, 结果为稳定的有符号int64, 与mongodb的哈希值不同
+    """
+    return int.from_bytes(hashlib.md5(bson.encode({"": value})).digest()[:8], 'little', signed=True)
+
+
+class FakeCollection:
+    """
+    进程内模拟的motor collection, 文档以BSON字节按_id排序保存, 支持比对用到的find查询与聚合
+    """
+    def __init__(self, docs, latency=0.0, raw=False, _data=None):
+        self.latency = latency
+        self.raw = raw
+        if _data is None:
+            docs = sorted(docs, key=lambda doc: id_sort_key(doc["_id"]))
+            _data = ([id_sort_key(doc["_id"]) for doc in docs], [doc["_id"] for doc in docs],
+                     [bson.encode(doc) for doc in docs])
+        self.keys, self.ids, self.data = _data
+        self.positions = dict((doc_key(doc_id), pos) for pos, doc_id in enumerate(self.ids))
+
+    def with_options(self, codec_options=None):
+        return FakeCollection(None, self.latency, raw=True, _data=(self.keys, self.ids, self.data))
+
+    async def estimated_document_count(self):
+        return len(self.ids)
+
+    async def count_documents(self, query, **kwargs):
+        return len(self._select(query))
+
+    def _select(self, query):
+        cond = (query or {}).get("_id")
+        if not cond:
+            return range(len(self.ids))
+        if "$in" in cond:
+            keys = set(doc_key(doc_id) for doc_id in cond["$in"])
+            return sorted(self.positions[key] for key in keys if key in self.positions)
+        start = bisect.bisect_left(self.keys, id_sort_key(cond["$gte"])) if "$gte" in cond else 0
+        end = bisect.bisect_left(self.keys, id_sort_key(cond["$lt"])) if "$lt" in cond else len(self.keys)
+        return range(start, end)
+
+    def find(self, query=None, projection=None):
+        docs = [self.data[pos] for pos in self._select(query)]
+        if projection:
+            include = any(projection.values())
+            projected = []
+            for data in docs:
+                doc = bson.decode(data)
+                if include:
+                    doc = dict((k, v) for k, v in doc.items() if k == "_id" or k in projection)
+                else:
+                    doc = dict((k, v) for k, v in doc.items() if k not in projection)
+                projected.append(bson.encode(doc))
+            docs = projected
+        return FakeCursor(docs, self.latency, self.raw)
+
+    def aggregate(self, pipeline, **kwargs):
+        stages = [list(stage)[0] for stage in pipeline]
+        if stages == ["$sample", "$project", "$sort"]:
+            size = min(pipeline[0]["$sample"]["size"], len(self.ids))
+            positions = sorted(random.sample(range(len(self.ids)), size))
+            return FakeCursor([{"_id": self.ids[pos]} for pos in positions], self.latency, self.raw)
+        if stages == ["$match", "$project", "$bucketAuto"]:
+            positions = list(self._select(pipeline[0]["$match"]))
+            parts = pipeline[2]["$bucketAuto"]["buckets"]
+            buckets = []
+            for i in range(parts):
+                part = positions[i * len(positions) // parts:(i + 1) * len(positions) // parts]
+                if part:
+                    buckets.append({"_id": {"min": self.ids[part[0]], "max": self.ids[part[-1]]}, "count": len(part)})
+            return FakeCursor(buckets, self.latency, self.raw)
+        if stages == ["$project"] or (stages == ["$match", "$project"] and "$expr" in pipeline[0]["$match"]):
+            # hash抽样: $toHashedIndexKey(_id)小于阈值
+            threshold = pipeline[0]["$match"]["$expr"]["$lt"][1] if len(stages) > 1 else None
+            return FakeCursor([{"_id": doc_id} for doc_id in self.ids
+                               if threshold is None or hashed_index_key(doc_id) < threshold], self.latency, self.raw)
+        raise NotImplementedError("fake collection does not support pipeline {}".format(stages))
+
+
+class FakeCluster:
+    """
+    替换comparison.AsyncMongoCluster, url中包含src的连接返回src数据集, 其余返回dst数据集
+    """
+    datasets = {}
+
+    def __init__(self, url, options=None, on_wait=None):
+        self.url = url
+        self.conn = None
+        self.pool_listener = PoolWaitListener(on_wait)
+
+    def connect(self):
+        collections = self.datasets["src" if "src" in self.url else "dst"]
+        self.conn = {BENCH_DB: collections}
+
+    def close(self):
+        pass
+
+
+@contextlib.contextmanager
+def fake_cluster(src_docs, dst_docs, latency):
+    FakeCluster.datasets = {"src": {BENCH_COLL: FakeCollection(src_docs, latency)},
+                            "dst": {BENCH_COLL: FakeCollection(dst_docs, latency)}}
+    cluster, comparison.AsyncMongoCluster = comparison.AsyncMongoCluster, FakeCluster
+    try:
+        yield
+    finally:
+        comparison.AsyncMongoCluster = cluster
+        FakeCluster.datasets = {}
+
+
+def seed_mongo(url, docs):
+    """
+    写入本地mongod的bench_db.bench_coll, 会先删除该collection
+    """
+    import pymongo
+    client = pymongo.MongoClient(url)
+    try:
+        coll = client[BENCH_DB][BENCH_COLL]
+        coll.drop()
+        for start in range(0, len(docs), 1000):
+            coll.insert_many(docs[start:start + 1000], ordered=False)
+    finally:
+        client.close()
+
+
+def stage_summary(metrics):
+    stages = {}
+    for name in STAGES:
+        histogram = metrics["histograms"].get(name)
+        if histogram:
+            stages[name] = {"count": histogram["count"], "p50": histogram["p50"], "p95": histogram["p95"],
+                            "p99": histogram["p99"]}
+    return stages
+
+
+def result_of(name, docs, seconds, bytes_count, metrics=None, **extra):
+    result = {"name": name, "docs": docs, "seconds": round(seconds, 4),
+              "docs_per_sec": round(docs / seconds, 1) if seconds else 0.0,
+              "bytes_per_sec": round(bytes_count / seconds, 1) if seconds else 0.0,
+              "peak_rss_mb": peak_rss_mb(),
+              "stages": stage_summary(metrics) if metrics else {}}
+    result.update(extra)
+    return result
+
+
+class Benchmark:
+    def __init__(self, params):
+        self.params = params
+        self.work_dir = None
+        self.src_docs, self.dst_docs, self.expected_diffs = make_docs(params["docs"], params["size"],
+                                                                      params["diff_rate"], params["seed"])
+        self.avg_size = sum(len(bson.encode(doc)) for doc in self.src_docs[:1000]) / max(1, min(1000, len(self.src_docs)))
+        self.results = []
+
+    def configure(self, mode):
+        params = self.params
+        return {"compare_dbs": [BENCH_DB], "compare_colls": [BENCH_COLL],
+                "src_url": params["src_url"] or "mongodb://src", "dst_url": params["dst_url"] or "mongodb://dst",
+                "sample_file_name": os.path.join(self.work_dir, "sample_ids.txt"),
+                "query_batch": params["batch"], "sample_start_idx": 0, "sample_count": len(self.src_docs),
+                "task_count": params["task_count"], "comparison_mode": mode,
+                "digest_algo": params["digest_algo"], "diff_limit": 0,
+                HASH_EXECUTOR: params["hash_executor"], HASH_WORKERS: params["hash_workers"]}
+
+    async def run_runner(self, name, runner_cls, entry, configure, sides):
+        runner = runner_cls(configure)
+        start = time.time()
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            try:
+                ok = await getattr(runner, entry)()
+            finally:
+                runner.quit()
+        seconds = time.time() - start
+        metrics = runner.log.metrics.snapshot()
+        result = result_of(name, runner.process_count, seconds, runner.process_count * self.avg_size * sides,
+                           metrics, ok=bool(ok), diffs=metrics["counters"].get("diffs", 0),
+                           expected_diffs=self.expected_diffs)
+        self.results.append(result)
+
+    async def end_to_end(self):
+        for mode in self.params["modes"]:
+            await self.run_runner("compare.{}".format(mode), AsyncDbCompare, "do_compare", self.configure(mode), 2)
+            if mode != "merkle":
+                # period 1的sample/full写入同一个快照文件, merkle与full共用full快照
+                await self.run_runner("write.{}".format(mode), AsyncDbWrite, "do_write", self.configure(mode), 1)
+            await self.run_runner("load.{}".format(mode), AsyncDbLoadCompare, "do_load_compare",
+                                  self.configure(mode), 1)
+
+    def micro_digest(self):
+        raws = [RawBSONDocument(bson.encode(doc)) for doc in self.src_docs]
+        bytes_count = sum(len(doc.raw) for doc in raws)
+        algos = [(ALGO_BLAKE2B, False), (ALGO_BLAKE2B, True), (ALGO_MD5, False), (ALGO_MD5_STR, False)]
+        if xxhash is not None:
+            algos.append((ALGO_XXH3, False))
+        for algo, canonical in algos:
+            engine = DigestEngine(algo, canonical)
+            docs = self.src_docs if algo == ALGO_MD5_STR else raws
+            start = time.time()
+            for doc in docs:
+                engine.digest(doc)
+            self.results.append(result_of("digest.{}{}".format(algo, "+c" if canonical else ""), len(docs),
+                                          time.time() - start, bytes_count))
+
+    async def micro_cursor(self):
+        """
+        单协程按批次调用get_src_cursor_data, 衡量拉取+摘要路径本身的开销
+        """
+        runner = AsyncDbCompare(self.configure("sample"))
+        runner.log = LogSink(os.path.join(self.work_dir, "micro_log.txt"), console=False)
+        runner.hasher = DigestExecutor.from_configure(runner.configure)
+        coll = FakeCollection(self.src_docs, self.params["latency"]).with_options()
+        batch = self.params["batch"]
+        ids = [doc["_id"] for doc in self.src_docs]
+        start = time.time()
+        for start_idx in range(0, len(ids), batch):
+            await runner.get_src_cursor_data(coll, ids[start_idx:start_idx + batch], start_idx)
+        seconds = time.time() - start
+        runner.hasher.close()
+        runner.log.close()
+        self.results.append(result_of("get_src_cursor_data", len(ids), seconds, len(ids) * self.avg_size,
+                                      runner.log.metrics.snapshot()))
+
+    def micro_snapshot(self):
+        engine = DigestEngine()
+        items = [(doc["_id"], engine.digest(RawBSONDocument(bson.encode(doc)))) for doc in self.src_docs]
+        random.Random(self.params["seed"]).shuffle(items)
+        path = os.path.join(self.work_dir, "micro.snap")
+        record_bytes = len(items) * (8 + 16)
+
+        start = time.time()
+        writer = SnapshotWriter(path, engine.tag)
+        writer.add(items)
+        writer.close()
+        self.results.append(result_of("snapshot.write", len(items), time.time() - start, record_bytes))
+
+        start = time.time()
+        reader = SnapshotReader(path)
+        for doc_id, _ in items:
+            reader.get(doc_id)
+        reader.close()
+        self.results.append(result_of("snapshot.load", len(items), time.time() - start, record_bytes))
+
+        ids = [doc_id for doc_id, _ in items]
+        batch = self.params["batch"]
+        start = time.time()
+        reader = SnapshotReader(path)
+        for pos in range(0, len(ids), batch):
+            reader.lookup(ids[pos:pos + batch])
+        reader.close()
+        self.results.append(result_of("snapshot.lookup", len(items), time.time() - start, record_bytes))
+
+        start = time.time()
+        table = DigestTable.build(items)
+        self.results.append(result_of("digest_table.build", len(items), time.time() - start, record_bytes,
+                                      table_bytes=table.nbytes))
+
+        start = time.time()
+        for pos in range(0, len(ids), batch):
+            table.lookup(ids[pos:pos + batch])
+        self.results.append(result_of("digest_table.lookup", len(items), time.time() - start, record_bytes))
+
+    def run(self):
+        params = self.params
+        self.work_dir = tempfile.mkdtemp(prefix="mcbench_")
+        base_dir = comparison._base_dir
+        # comparison的导出路径为_base_dir + '\\cmp_export\\...', 指向临时目录下的run
+        comparison._base_dir = os.path.join(self.work_dir, "run")
+        try:
+            ids = [doc["_id"] for doc in self.src_docs]
+            random.Random(params["seed"]).shuffle(ids)
+            with open(os.path.join(self.work_dir, "sample_ids.txt"), 'w') as f:
+                f.write('\n'.join(str(doc_id) for doc_id in ids) + '\n')
+
+            if params["suite"] in ("all", "micro"):
+                self.micro_digest()
+                self.micro_snapshot()
+                asyncio.run(self.micro_cursor())
+            if params["suite"] in ("all", "e2e"):
+                if params["src_url"]:
+                    seed_mongo(params["src_url"], self.src_docs)
+                    seed_mongo(params["dst_url"], self.dst_docs)
+                    asyncio.run(self.end_to_end())
+                else:
+                    with fake_cluster(self.src_docs, self.dst_docs, params["latency"]):
+                        asyncio.run(self.end_to_end())
+        finally:
+            comparison._base_dir = base_dir
+            shutil.rmtree(self.work_dir, ignore_errors=True)
+        return self.results
+
+
+def compare_baseline(results, params, path, threshold):
+    """
+    与基线的docs/sec对比, 低于基线(1 - threshold)倍记为退化; 基线参数不同时不对比
+    """
+    if not os.path.exists(path):
+        print("baseline {} not found, use --save_baseline to create".format(path))
+        return []
+    with open(path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    if baseline.get("params") != baseline_params(params):
+        print("baseline {} was recorded with different params {}, comparison skipped".format(
+            path, baseline.get("params")))
+        return []
+    regressions = []
+    for result in results:
+        base = baseline["results"].get(result["name"])
+        if not base or not base["docs_per_sec"]:
+            continue
+        result["vs_baseline"] = round(result["docs_per_sec"] / base["docs_per_sec"], 3)
+        if result["vs_baseline"] < 1 - threshold:
+            regressions.append(result["name"])
+    return regressions
+
+
+def save_baseline(results, params, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({"params": baseline_params(params), "results": dict((r["name"], r) for r in results)}, f, indent=1)
+    print("baseline saved to {}".format(path))
+
+
+def print_results(results):
+    print("{:<24}{:>9}{:>10}{:>12}{:>10}{:>10}{:>10}{:>10}{:>8}".format(
+        "name", "docs", "seconds", "docs/s", "MB/s", "p50(s)", "p99(s)", "rss(MB)", "vs base"))
+    for r in results:
+        unit = r["stages"].get("unit") or r["stages"].get("src_fetch", {})
+        print("{:<24}{:>9}{:>10}{:>12}{:>10}{:>10}{:>10}{:>10}{:>8}".format(
+            r["name"], r["docs"], r["seconds"], r["docs_per_sec"], round(r["bytes_per_sec"] / 1048576.0, 2),
+            unit.get("p50", "-"), unit.get("p99", "-"), r["peak_rss_mb"] or "-", r.get("vs_baseline", "-")))
+
+
+def usage():
+    print("usage")
+    print(
+        '|------------------------------------------------------------------------------------------------------------------|')
+    print(
+        '| Like : python3 benchmark.py -n 20000 -s 512 -d 0.01 -l 1 -b 100 -t 4')
+    print(
+        '| Or: python3 benchmark.py --docs=20000 --size=512 --diff_rate=0.01 --latency=1 --suite=e2e --modes=full,merkle')
+    print(
+        '| Baseline: python3 benchmark.py --save_baseline / python3 benchmark.py --baseline=benchmark_baseline.json')
+    print(
+        '| Mongod: python3 benchmark.py --src_url=mongodb://127.0.0.1:27017 --dst_url=mongodb://127.0.0.1:27018')
+    print(
+        '|------------------------------------------------------------------------------------------------------------------|')
+    exit(0)
+
+
+if __name__ == '__main__':
+    opts, args = getopt.getopt(sys.argv[1:], "hn:s:d:l:b:t:",
+                               ["help", "docs=", "size=", "diff_rate=", "latency=", "batch=", "task_count=", "suite=",
+                                "modes=", "digest_algo=", "seed=", "baseline=", "save_baseline", "threshold=",
+                                "output=", "src_url=", "dst_url=", "hash_executor=", "hash_workers="])
+    bench_params = {"docs": 20000, "size": 512, "diff_rate": 0.01, "latency": 0.0, "batch": 100, "task_count": 4,
+                    "suite": "all", "modes": list(MODES), "digest_algo": ALGO_BLAKE2B, "seed": 0,
+                    "hash_executor": EXECUTOR_INLINE, "hash_workers": 0, "src_url": "", "dst_url": ""}
+    baseline_path = BENCH_BASELINE
+    save = False
+    threshold = 0.2
+    output = None
+    for opt_name, opt_value in opts:
+        if opt_name in ('-h', '--help'):
+            usage()
+        elif opt_name in ('-n', '--docs'):
+            bench_params["docs"] = int(opt_value)
+        elif opt_name in ('-s', '--size'):
+            bench_params["size"] = int(opt_value)
+        elif opt_name in ('-d', '--diff_rate'):
+            bench_params["diff_rate"] = float(opt_value)
+        elif opt_name in ('-l', '--latency'):
+            # 模拟每次往返的网络延迟, 毫秒
+            bench_params["latency"] = float(opt_value) / 1000.0
+        elif opt_name in ('-b', '--batch'):
+            bench_params["batch"] = int(opt_value)
+        elif opt_name in ('-t', '--task_count'):
+            bench_params["task_count"] = opt_value if opt_value == "auto" else int(opt_value)
+        elif opt_name == '--suite':
+            bench_params["suite"] = opt_value
+        elif opt_name == '--modes':
+            bench_params["modes"] = [mode for mode in opt_value.split(',') if mode in MODES]
+        elif opt_name == '--digest_algo':
+            bench_params["digest_algo"] = opt_value
+        elif opt_name == '--seed':
+            bench_params["seed"] = int(opt_value)
+        elif opt_name == '--baseline':
+            baseline_path = opt_value
+        elif opt_name == '--save_baseline':
+            save = True
+        elif opt_name == '--threshold':
+            threshold = float(opt_value)
+        elif opt_name == '--output':
+            output = opt_value
+        elif opt_name == '--hash_executor':
+            bench_params["hash_executor"] = opt_value
+        elif opt_name == '--hash_workers':
+            bench_params["hash_workers"] = int(opt_value)
+        elif opt_name == '--src_url':
+            bench_params["src_url"] = opt_value
+        elif opt_name == '--dst_url':
+            bench_params["dst_url"] = opt_value
+
+    if bool(bench_params["src_url"]) != bool(bench_params["dst_url"]):
+        print("--src_url and --dst_url must be set together")
+        sys.exit(2)
+
+    bench_results = Benchmark(bench_params).run()
+    bench_regressions = [] if save else compare_baseline(bench_results, bench_params, baseline_path, threshold)
+    print_results(bench_results)
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(bench_results, f, indent=1)
+    if save:
+        save_baseline(bench_results, bench_params, baseline_path)
+    if bench_regressions:
+        print("REGRESSION => docs/sec below {:.0%} of baseline: {}".format(1 - threshold, bench_regressions))
+        sys.exit(1)
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+"""
+Module Description: 进度日志, 记录已完成的批次/区间及其结果, 用于中断后--resume续跑
+Date: 2026/10/18
+Author: HuYuanCheng
+"""
+import os
+import time
+
+from bson import json_util
+
+CHECKPOINT_INTERVAL = "checkpoint_interval"
+RESUME = "resume"
+
+UNIT_PLAN = "plan"
+UNIT_COLLECTION = "collection"
+
+
+class ProgressJournal:
+    """
+    每完成一个单元追加一行JSON: {"scope": "db.coll", "unit": "b:0", "ok": true, "docs": 20}
+    写入先进入文件缓冲, 每flush_interval秒或flush_count条flush并fsync一次, 进程崩溃最多丢失一个间隔的进度
+    """
+    def __init__(self, path, resume=False, flush_interval=5, flush_count=200):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.flush_count = flush_count
+        self.records = {}
+        self.unflushed = 0
+        self.last_flush = time.time()
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        partial_line = False
+        if resume and os.path.exists(path):
+            partial_line = self._load()
+        self.file = open(path, 'a' if resume else 'w', encoding='utf-8')
+        if partial_line:
+            self.file.write('\n')
+
+    def _load(self):
+        """
+        加载已有记录, 返回最后一行是否不完整(崩溃时写入中断)
+        """
+        line = ''
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json_util.loads(line)
+                except ValueError:
+                    continue
+                self.records[(record['scope'], record['unit'])] = record
+        return bool(line) and not line.endswith('\n')
+
+    def __len__(self):
+        return len(self.records)
+
+    def get(self, scope, unit):
+        return self.records.get((scope, unit))
+
+    def is_done(self, scope, unit):
+        return (scope, unit) in self.records
+
+    def ranges(self, scope):
+        """
+        续跑时沿用上次保存的_id区间切分, 保证区间编号一致
+        """
+        record = self.get(scope, UNIT_PLAN)
+        if record is None:
+            return None
+        return [tuple(r) for r in record['ranges']]
+
+    def save_ranges(self, scope, ranges):
+        self.mark(scope, UNIT_PLAN, ranges=[list(r) for r in ranges])
+        self.flush()
+
+    def mark(self, scope, unit, ok=True, **extra):
+        record = {"scope": scope, "unit": unit, "ok": ok}
+        record.update(extra)
+        self.records[(scope, unit)] = record
+        self.file.write(json_util.dumps(record) + '\n')
+        self.unflushed += 1
+        if self.unflushed >= self.flush_count or time.time() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        if self.file.closed:
+            return
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.unflushed = 0
+        self.last_flush = time.time()
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
@@ -5,263 +5,962 @@ Module Description:
 Date: 2023/4/13
 Author: HuYuanCheng
 """
-import ast
 import contextvars
 import getopt
-import hashlib
 import json
 import sys
 import time
 import os
-import itertools
+import shutil
+import multiprocessing
 import motor.motor_asyncio
 import asyncio
 
+from digest import SERVER_DIGEST_WARNING, DigestEngine
+from merkle import CollectionDigestSource, MerkleVerifier, SnapshotDigestSource, MERKLE_FANOUT, MERKLE_LEAF_SIZE
+from ranges import id_range_query, split_id_ranges, diff_kind, merge_step, DIFF_CHANGED, DIFF_MISSING_DST, \
+    DIFF_MISSING_SRC
+from snapshot import SnapshotReader, SnapshotWriter, SNAPSHOT_KEY_WIDTH
+from checkpoint import ProgressJournal, CHECKPOINT_INTERVAL, RESUME, UNIT_COLLECTION
+from workers import run_workers, WORKERS, WORKER_CHUNK, WORKER_CHUNK_SIZE
+from distributed import run_joiners, serve_chunks, COORDINATOR, COORDINATOR_TOKEN, LEASE_SECONDS
+from concurrency import AdaptiveLimiter, ConcurrencyBudget, task_count_of, TASK_COUNT_AUTO
+from samples import SampleSource, parse_id, write_sample_index, SAMPLE_ID_TYPE, SAMPLE_INDEX_SUFFIX, ID_TYPE_AUTO
+from sampling import divergence_summary, sample_ids, SAMPLE_CONFIDENCE, SAMPLE_STRATEGY, STRATEGY_FILE
+from diffreport import DiffReport, DIFF_LIMIT
+from logsink import LogSink, METRICS_PORT
+from hashing import DigestExecutor
+from connection import PoolWaitListener, client_options
+from dumpsource import DumpCluster, DUMP_PREFIX
+from recheck import RecheckQueue, RECHECK_INTERVALS
+from scheduler import CollectionField, CollectionState, count_collection, estimate_count, result_table, \
+    run_collections, run_in, COLLECTION_CONCURRENCY
+from follow import FollowScope, cluster_time, doc_key, watch_changes, FOLLOW, FOLLOW_DEBOUNCE, FOLLOW_DURATION, \
+    FOLLOW_REPORT_INTERVAL
+
 _base_dir = os.getcwd()
 
 COMPARISION_SAMPLES = "sample_list"
 COMPARISION_MODE = "comparison_mode"
 COMPARE_DBS = "compare_dbs"
 COMPARE_COLLS = "compare_colls"
+RANGE_COUNT = "range_count"
+ID_RANGES = "id_ranges"
+PRECHECK = "precheck"
+
+MODE_SAMPLE = "sample"
+MODE_FULL = "full"
+MODE_MERKLE = "merkle"
+
+PRECHECK_ON = "on"
+PRECHECK_OFF = "off"
+PRECHECK_ONLY = "only"
 
 process_id = contextvars.ContextVar('Id of process')
+unit_result = contextvars.ContextVar('Result of process unit')
+
+
+def range_count_of(configure):
+    return configure.get(RANGE_COUNT, 0) or task_count_of(configure) * 8
+
+
+def export_suffix(configure):
+    """
+    日志文件名后缀, 多进程按_id区间分片时追加分片编号
+    """
+    file_start = configure['sample_start_idx']
+    file_end = configure['sample_start_idx'] + configure["sample_count"]
+    chunk = configure.get(WORKER_CHUNK)
+    if chunk is None:
+        return "{}_{}".format(file_start, file_end)
+    return "{}_{}_{}".format(file_start, file_end, chunk)
+
+
+def configured_ranges(configure):
+    """
+    多进程分片指定的_id区间, 未指定时返回None
+    """
+    ranges = configure.get(ID_RANGES)
+    if ranges is None:
+        return None
+    return [tuple(r) for r in ranges]
+
+
+def open_journal(path, configure):
+    return ProgressJournal(path, configure.get(RESUME, False), configure.get(CHECKPOINT_INTERVAL, 30))
+
+
+def merkle_verifier(configure, src, dst, fingerprints=True):
+    return MerkleVerifier(src, dst, configure.get(MERKLE_FANOUT, 16), configure.get(MERKLE_LEAF_SIZE, 1000),
+                          fingerprints)
+
+
+def open_samples(configure):
+    return SampleSource.open(configure["sample_file_name"], configure.get(SAMPLE_ID_TYPE, ID_TYPE_AUTO))
+
+
+def count_samples(configure):
+    samples = configure.get(COMPARISION_SAMPLES)
+    if samples:
+        return min(len(samples), configure["sample_count"])
+    source = open_samples(configure)
+    try:
+        return max(0, min(len(source) - configure['sample_start_idx'], configure["sample_count"]))
+    finally:
+        source.close()
+
+
+async def plan_samples(configure, index_path, src_coll, dst_coll, doc_count, reuse, log_info):
+    """
+    sample_strategy为file时使用_id文件; 其他策略从集群抽取_id写入index_path, reuse且索引已存在时直接使用,
+    续跑与period 2的批次下标才与上次一致. 返回(读取_id使用的配置, 抽样数量)
+    """
+    strategy = configure.get(SAMPLE_STRATEGY, STRATEGY_FILE)
+    if strategy == STRATEGY_FILE:
+        return configure, min(configure["sample_count"], doc_count)
+    if not (reuse and os.path.exists(index_path)):
+        start = time.time()
+        ids = await sample_ids(configure, src_coll, dst_coll, doc_count, range_count_of(configure))
+        os.makedirs(os.path.dirname(index_path), exist_ok=True)
+        write_sample_index(ids, index_path)
+        log_info("SAMPLE => {} ids sampled by {} strategy, time: {:.3f}".format(len(ids), strategy,
+                                                                              time.time() - start))
+    source = SampleSource(index_path)
+    count = len(source)
+    source.close()
+    samples = dict(configure, sample_file_name=index_path, sample_start_idx=0, sample_count=count)
+    samples.pop(COMPARISION_SAMPLES, None)
+    return samples, count
+
+
+def iter_sample_batches(configure, count, batch):
+    """
+    按批次返回(批次起始下标, _id列表), 从_id索引直接seek到sample_start_idx, 只在消费时读取
+    调用方已给出sample_list时直接切分
+    """
+    samples = configure.get(COMPARISION_SAMPLES)
+    if samples:
+        for start_idx in range(0, min(count, len(samples)), batch):
+            yield start_idx, [parse_id(x) for x in samples[start_idx:min(start_idx + batch, count)]]
+        return
+    source = open_samples(configure)
+    try:
+        yield from source.batches(configure['sample_start_idx'], count, batch)
+    finally:
+        source.close()
+
+
+async def consume_units(units, handler, task_count, limiter=None, queue_size=0, budget=None):
+    """
+    生产者从units迭代器按需取出参数放入有界队列, task_count个消费者协程依次执行handler(*unit), 返回执行的单元数
+    limiter不为None时启动limiter.maximum个消费者, 同时工作的数量由limiter按拉取耗时调整
+    budget不为None时每个单元先占用多个collection共享的并发预算
+    """
+    if limiter is not None:
+        task_count = limiter.maximum
+        limiter.open()
+    queue = asyncio.Queue(maxsize=queue_size or task_count * 2)
+    processed = [0]
+
+    async def producer():
+        for unit in units:
+            await queue.put(unit)
+        for _ in range(task_count):
+            await queue.put(None)
+
+    async def consumer(index):
+        while True:
+            if limiter is not None:
+                await limiter.wait(index)
+            unit = await queue.get()
+            if unit is None:
+                if limiter is not None:
+                    limiter.close()
+                break
+            if budget is not None:
+                async with budget:
+                    await handler(*unit)
+            else:
+                await handler(*unit)
+            processed[0] += 1
+
+    workers = [asyncio.create_task(producer())] + [asyncio.create_task(consumer(i)) for i in range(task_count)]
+    try:
+        await asyncio.gather(*workers)
+    finally:
+        for worker in workers:
+            worker.cancel()
+    return processed[0]
+
+
+async def fetch_docs(cursor, batch):
+    """
+    按batch_size整批拉取游标中的全部文档, 每个服务端批次只有一次await, 出错时直接抛出由调用方按批次处理
+    """
+    batch = max(batch, 1)
+    cursor = cursor.batch_size(batch)
+    docs = []
+    while True:
+        chunk = await cursor.to_list(length=batch)
+        docs.extend(chunk)
+        if len(chunk) < batch:
+            return docs
+
+
+async def precheck_ranges(src, dst, ranges, task_count):
+    """
+    并发统计[(range_idx, (lower, upper))]中每个区间两端的精确文档数, 返回[(range_idx, src数量, dst数量)]
+    """
+    counts = []
+
+    async def count(range_idx, lower, upper):
+        src_count, dst_count = await asyncio.gather(src.count(lower, upper), dst.count(lower, upper))
+        counts.append((range_idx, src_count, dst_count))
+
+    await consume_units(((range_idx, lower, upper) for range_idx, (lower, upper) in ranges), count, task_count)
+    return sorted(counts)
+
+
+async def precheck_order(runner, src, dst, ranges):
+    """
+    比较每个区间两端的精确文档数, 数量不一致的区间立即报告并排在最前面比对, 返回区间处理顺序
+    precheck为only时只做预检查, 有数量不一致的区间时runner的结果记为不一致, 返回空列表
+    """
+    order = list(range(len(ranges)))
+    mode = runner.configure.get(PRECHECK, PRECHECK_ON)
+    if mode == PRECHECK_OFF:
+        return order
+    start = time.time()
+    pending = [(range_idx, ranges[range_idx]) for range_idx in order
+               if runner.journal.get(runner.scope, "r:{}".format(range_idx)) is None]
+    counts = await precheck_ranges(src, dst, pending, task_count_of(runner.configure))
+    suspicious = []
+    for range_idx, src_count, dst_count in counts:
+        if src_count == dst_count:
+            continue
+        suspicious.append(range_idx)
+        runner.log_error("PRECHECK => range [{}, {}) count not equals, src: {}, dst: {}".format(
+            ranges[range_idx][0], ranges[range_idx][1], src_count, dst_count),
+            event="precheck", ns=runner.scope, unit=range_idx, src=src_count, dst=dst_count)
+    runner.log_info("PRECHECK => {} ranges counted, {} count mismatches, time: {}".format(
+        len(counts), len(suspicious), time.time() - start))
+    if mode == PRECHECK_ONLY:
+        if suspicious:
+            runner.process_document_res = False
+        return []
+    # 数量不一致的区间在摘要比对中必然得出差异_id, 结果以比对(及复核)为准
+    first = set(suspicious)
+    return suspicious + [range_idx for range_idx in order if range_idx not in first]
+
+
+class SortedDigestStream:
+    """
+    按_id升序批量读取游标并由hasher计算摘要, 供区间合并比对使用, log不为None时记录拉取与摘要耗时
+    """
+    def __init__(self, cursor, batch, digest_engine, hasher, log=None, name="src"):
+        self.cursor = cursor
+        self.batch = batch
+        self.digest_engine = digest_engine
+        self.hasher = hasher
+        self.log = log
+        self.name = name
+        self.buffer = []
+        self.pos = 0
+        self.exhausted = False
+
+    @property
+    def pending(self):
+        return self.pos >= len(self.buffer) and not self.exhausted
+
+    async def fill(self):
+        start = time.time()
+        docs = await self.cursor.to_list(length=self.batch)
+        fetched = time.time()
+        if not docs:
+            self.exhausted = True
+        self.buffer = await self.hasher.digests(self.digest_engine, docs)
+        self.pos = 0
+        if self.log is not None:
+            self.log.observe("{}_fetch".format(self.name), fetched - start)
+            self.log.observe("hash", time.time() - fetched)
+
+    def peek(self):
+        if self.pos < len(self.buffer):
+            return self.buffer[self.pos]
+        return None
+
+    def advance(self):
+        self.pos += 1
 
 
 class AsyncMongoCluster:
     conn = None
     url = ""
 
-    def __init__(self, url):
+    def __init__(self, url, options=None, on_wait=None):
         self.url = url
+        self.options = options or {}
+        self.pool_listener = PoolWaitListener(on_wait)
 
     def connect(self):
-        self.conn = motor.motor_asyncio.AsyncIOMotorClient(self.url)
+        self.conn = motor.motor_asyncio.AsyncIOMotorClient(self.url, event_listeners=[self.pool_listener],
+                                                           **self.options)
 
     def close(self):
         self.conn.close()
 
 
+def open_cluster(url, options=None, on_wait=None):
+    """
+    dump://开头的url使用mongodump导出的.bson文件(或目录)作为数据源, 否则连接mongodb集群
+    """
+    if url.startswith(DUMP_PREFIX):
+        return DumpCluster(url, options, on_wait)
+    return AsyncMongoCluster(url, options, on_wait)
+
+
 class AsyncDbCompare:
+    # 按collection区分的状态, 多个collection同时比对时各自独立
+    scope = CollectionField()
+    digest_engine = CollectionField()
+    src_doc_count = CollectionField()
+    dst_doc_count = CollectionField()
+    process_document_res = CollectionField()
+    rechecks = CollectionField()
+
     def __init__(self, configure):
         self.src = None
         self.dst = None
         self.log = None
-        self.error_log = None
         self.src_doc_count = 0
         self.dst_doc_count = 0
         self.process_document_res = True
         self.configure = configure
-        file_start = configure['sample_start_idx']
-        file_end = configure['sample_start_idx'] + configure["sample_count"]
-        self.log_file_path = _base_dir + f'\\cmp_export\\cmp_log_{file_start}_{file_end}.txt'
-        self.error_log_file_path = _base_dir + f'\\cmp_export\\cmp_diff_log_{file_start}_{file_end}.txt'
+        self.digest_engine = DigestEngine.from_configure(configure)
+        suffix = export_suffix(configure)
+        self.log_file_path = _base_dir + f'\\cmp_export\\cmp_log_{suffix}.txt'
+        self.error_log_file_path = _base_dir + f'\\cmp_export\\cmp_diff_log_{suffix}.txt'
+        self.event_file_path = _base_dir + f'\\cmp_export\\cmp_events_{suffix}.jsonl'
+        self.metrics_file_path = _base_dir + f'\\cmp_export\\cmp_metrics_{suffix}.json'
+        self.journal_file_path = _base_dir + f'\\cmp_export\\cmp_journal_{suffix}.txt'
+        self.sample_file_path = _base_dir + f'\\cmp_export\\cmp_sample_{suffix}_{{}}.idx'
+        self.diff_report = DiffReport(_base_dir + f'\\cmp_export\\cmp_diff_{suffix}.jsonl',
+                                      configure.get(DIFF_LIMIT, 10000), configure.get('query_batch', 20))
+        self.journal = None
+        self.scope = ""
         self.process_count = 0
         self.process_time = 0
         self.total_count = 0
         self.task_count = 0
-        self.tasks = []
-
-    def log_info(self, message):
-        msg = "INFO  [%s] %s " % (time.strftime('%Y-%m-%d %H:%M:%S'), message)
-        print(msg)
-        self.log.write(msg + '\n')
-        self.log.flush()
-
-    def log_error(self, message):
-        msg = "ERROR [%s] %s " % (time.strftime('%Y-%m-%d %H:%M:%S'), message)
-        print(msg)
-        if not self.error_log:
-            os.makedirs(os.path.dirname(self.error_log_file_path), exist_ok=True)
-            self.error_log = open(self.error_log_file_path, 'a+')
-        self.error_log.write(msg + '\n')
-        self.error_log.flush()
+        self.last_progress = 0
+        self.limiter = AdaptiveLimiter.from_configure(configure, self.log_info)
+        self.hasher = None
+        # follow模式下记录初次比对的差异_id, 持续校验开始时优先复核
+        self.follow_seeds = None
+        self.rechecks = RecheckQueue(configure.get(RECHECK_INTERVALS))
+        self.budget = None
+        self.states = []
+
+    def log_debug(self, message, **fields):
+        self.log.debug(message, **fields)
+
+    def log_info(self, message, **fields):
+        self.log.info(message, **fields)
+
+    def log_error(self, message, **fields):
+        self.log.error(message, **fields)
+
+    def log_progress(self, doc_count):
+        """
+        累计已处理文档数, 进度行每秒最多输出一次
+        """
+        self.process_count += doc_count
+        self.log.incr("docs", doc_count)
+        count_collection(docs=doc_count)
+        now = time.time()
+        if now - self.last_progress >= 1 or self.process_count >= self.total_count:
+            self.last_progress = now
+            self.log_info("-------------------------Process Progress: {}/{}----------------------------".format(
+                self.process_count, self.total_count), event="progress", done=self.process_count,
+                total=self.total_count)
 
     async def check(self):
-        check_db_names = self.configure[COMPARE_DBS]
-        for db in check_db_names:
-            src_db = self.src.conn[db]
-            dst_db = self.dst.conn[db]
-
-            check_colls = self.configure[COMPARE_COLLS]
-            for coll in check_colls:
+        """
+        所有collection按估算文档数从大到小调度, 最多collection_concurrency个同时比对并共享task_count并发预算,
+        每个collection都比对完成后输出结果表
+        """
+        self.states = []
+        for db in self.configure[COMPARE_DBS]:
+            for coll in self.configure[COMPARE_COLLS]:
                 coll_start = time.time()
-                src_coll = src_db[coll]
-                dst_coll = dst_db[coll]
-                self.src_doc_count = await src_coll.estimated_document_count()
-                coll_end = time.time()
-                print("Collection time: {}".format(coll_end - coll_start))
-
-                before = time.time()
-                compare_result = await self.data_comparison(src_coll, dst_coll, self.configure[COMPARISION_MODE])
-                if not compare_result:
-                    self.log_error("DIFF => collection [%s] data comparison not equals" % coll)
-                    return False
-                else:
-                    self.log_info("PASS => collection [%s] data data comparison exactly equals" % coll)
-                after = time.time()
-                self.log_info("collection comparison runtime: {}, avg time: {}".format(after - before,
-                                                                                       self.process_time / self.task_count))
-
-        return True
+                digest_engine = DigestEngine.from_configure(self.configure, db, coll)
+                src_coll = digest_engine.collection(self.src.conn[db][coll])
+                dst_coll = digest_engine.collection(self.dst.conn[db][coll])
+                src_doc_count, error = await estimate_count(src_coll)
+                self.states.append(CollectionState(db, coll, src_doc_count, src_coll=src_coll, dst_coll=dst_coll,
+                                                   error=error, digest_engine=digest_engine,
+                                                   src_doc_count=src_doc_count, dst_doc_count=0,
+                                                   process_document_res=True,
+                                                   rechecks=RecheckQueue(self.configure.get(RECHECK_INTERVALS))))
+                self.log_debug("Collection time: {}".format(time.time() - coll_start))
+
+        concurrency = self.configure.get(COLLECTION_CONCURRENCY, 1)
+        if concurrency > 1:
+            self.budget = ConcurrencyBudget.from_configure(self.configure, self.limiter)
+        await run_collections(self.states, self.check_collection, concurrency, self.log_error)
+        for line in result_table(self.states):
+            self.log_info(line)
+        return all(state.ok for state in self.states)
+
+    async def check_collection(self, state):
+        coll, src_coll, dst_coll = state.coll, state.src_coll, state.dst_coll
+        record = self.journal.get(self.scope, UNIT_COLLECTION)
+        if record is not None:
+            self.log_info("RESUME => collection [{}] already compared, result: {}".format(coll, record['ok']))
+            state.ok, state.resumed = record['ok'], True
+            return
+
+        before = time.time()
+        compare_result = await self.data_comparison(src_coll, dst_coll, self.configure[COMPARISION_MODE])
+        if self.rechecks.suspects:
+            compare_result = await self.recheck_diffs(src_coll, dst_coll)
+        await self.report_diffs(src_coll, dst_coll)
+        if self.configure.get(PRECHECK) != PRECHECK_ONLY:
+            self.journal.mark(self.scope, UNIT_COLLECTION, ok=compare_result)
+        self.log_divergence(state)
+        state.ok = compare_result
+        if not compare_result:
+            self.log_error("DIFF => collection [%s] data comparison not equals" % coll,
+                           event="collection", ns=self.scope, ok=False)
+        else:
+            self.log_info("PASS => collection [%s] data data comparison exactly equals" % coll,
+                          event="collection", ns=self.scope, ok=True)
+        after = time.time()
+        self.log_info("collection comparison runtime: {}, avg time: {}".format(after - before,
+                                                                               self.process_time / max(self.task_count, 1)))
+
+    def log_divergence(self, state):
+        """
+        sample模式按本次抽样比对的文档数与差异数估算差异率的置信区间
+        """
+        if self.configure[COMPARISION_MODE] != MODE_SAMPLE or state.docs == 0:
+            return
+        confidence = self.configure.get(SAMPLE_CONFIDENCE, 0.95)
+        self.log_info("SAMPLE => collection [{}] {}".format(
+            state.coll, divergence_summary(state.diffs, state.docs, state.size, confidence)),
+            event="sample", ns=self.scope, sampled=state.docs, divergent=state.diffs, confidence=confidence)
 
     async def data_comparison(self, src_coll, dst_coll, mode):
-        samples = self.configure.get(COMPARISION_SAMPLES, [])
-        if mode == "sample":
-            sample_count = len(samples)
-            count = sample_count \
-                if sample_count <= self.src_doc_count \
-                else self.src_doc_count
-        else:
-            count = self.src_doc_count
+        if mode == MODE_FULL:
+            return await self.full_comparison(src_coll, dst_coll)
+        if mode == MODE_MERKLE:
+            return await self.merkle_comparison(src_coll, dst_coll)
+
+        precheck = self.configure.get(PRECHECK, PRECHECK_ON)
+        if precheck != PRECHECK_OFF:
+            # sample模式没有_id区间, 只比较两端的估算数量; only时数量不一致即为不一致
+            dst_doc_count = await dst_coll.estimated_document_count()
+            matched = dst_doc_count == self.src_doc_count
+            if not matched:
+                self.log_error("PRECHECK => estimated count not equals, src: {}, dst: {}".format(
+                    self.src_doc_count, dst_doc_count), event="precheck", ns=self.scope, src=self.src_doc_count,
+                    dst=dst_doc_count)
+            if precheck == PRECHECK_ONLY:
+                return matched
+
+        samples, count = await plan_samples(self.configure, self.sample_file_path.format(self.scope), src_coll,
+                                            dst_coll, self.src_doc_count, self.configure.get(RESUME, False),
+                                            self.log_info)
 
         if count == 0:
             return True
 
-        self.total_count = count
+        self.total_count += count
         self.log_info("Process Count: {}".format(count))
 
         batch = self.configure.get('query_batch', 20)
 
-        tasks = []
-        start_idx = 0
-        samples = [int(x) for x in samples]
-        while count > 0:
-            end_idx = start_idx + batch if batch < count else start_idx + count
-            values = samples[start_idx: end_idx]
-            tasks.append(self.process_document(src_coll, dst_coll, values, start_idx))
-            count -= batch
-            start_idx = end_idx
-
-        self.tasks = tasks
-        self.task_count = len(tasks)
-        self.log_info("create tasks count: {}".format(len(tasks)))
-
-        sub_tasks = []
-        max_task_count = self.configure['task_count']
-        for i in range(max_task_count):
-            sub_tasks.append(asyncio.create_task(self.sub_future(i)))
-
-        await asyncio.gather(*sub_tasks)
+        units = ((src_coll, dst_coll, values, start_idx)
+                 for start_idx, values in iter_sample_batches(samples, count, batch)
+                 if not self.resume_unit("b:{}".format(start_idx)))
+        await self.run_units(units, self.process_document)
+
+        return self.process_document_res
+
+    async def full_comparison(self, src_coll, dst_coll):
+        dst_doc_count = await dst_coll.estimated_document_count()
+        if self.src_doc_count == 0 and dst_doc_count == 0:
+            return True
+
+        self.total_count += self.src_doc_count
+        self.log_info("Process Count: {}, dst count: {}".format(self.src_doc_count, dst_doc_count))
+
+        ranges = await self.plan_ranges(src_coll)
+        batch = self.configure.get('query_batch', 20)
+        order = await self.precheck(CollectionDigestSource(src_coll, self.digest_engine, batch),
+                                    CollectionDigestSource(dst_coll, self.digest_engine, batch), ranges)
+
+        units = ((src_coll, dst_coll, ranges[range_idx][0], ranges[range_idx][1], range_idx)
+                 for range_idx in order
+                 if not self.resume_unit("r:{}".format(range_idx)))
+        await self.run_units(units, self.process_range)
+
+        return self.process_document_res
+
+    async def merkle_comparison(self, src_coll, dst_coll):
+        dst_doc_count = await dst_coll.estimated_document_count()
+        if self.src_doc_count == 0 and dst_doc_count == 0:
+            return True
+
+        self.total_count += self.src_doc_count
+        self.log_info("Process Count: {}, dst count: {}".format(self.src_doc_count, dst_doc_count))
+
+        batch = self.configure.get('query_batch', 20)
+        src_source = CollectionDigestSource(src_coll, self.digest_engine, batch, self.hasher)
+        dst_source = CollectionDigestSource(dst_coll, self.digest_engine, batch, self.hasher)
+        verifier = merkle_verifier(self.configure, src_source, dst_source)
+        ranges = await self.plan_ranges(src_coll)
+        order = await self.precheck(src_source, dst_source, ranges)
+
+        units = ((verifier, ranges[range_idx][0], ranges[range_idx][1], range_idx)
+                 for range_idx in order
+                 if not self.resume_unit("r:{}".format(range_idx)))
+        await self.run_units(units, self.process_bucket)
+
+        self.log_info("merkle buckets compared: {}, leaf ranges compared: {}".format(
+            verifier.bucket_count, verifier.leaf_count))
+        return self.process_document_res
+
+    async def plan_ranges(self, src_coll):
+        ranges = configured_ranges(self.configure) or self.journal.ranges(self.scope)
+        if ranges is None:
+            ranges = await split_id_ranges(src_coll, range_count_of(self.configure))
+            self.journal.save_ranges(self.scope, ranges)
+        return ranges
+
+    async def precheck(self, src, dst, ranges):
+        return await precheck_order(self, src, dst, ranges)
+
+    def resume_unit(self, unit):
+        """
+        续跑时跳过已完成的批次/区间, 并计入其进度与结果
+        """
+        record = self.journal.get(self.scope, unit)
+        if record is None:
+            return False
+        self.process_count += record.get('docs', 0)
+        if not record['ok']:
+            self.process_document_res = False
+        return True
+
+    def finish_unit(self, unit, doc_count):
+        self.journal.mark(self.scope, unit, ok=unit_result.get()['ok'], docs=doc_count)
+
+    def fail_range(self, range_idx, lower, upper, doc_count, error):
+        """
+        读取失败的区间整体记为不一致, 续跑时不再重试, 不影响其他区间继续比对
+        """
+        unit_result.get()['ok'] = False
+        self.process_document_res = False
+        self.log_error("[{}] process range [{}, {}) failed! msg: {}".format(range_idx, lower, upper, error))
+        self.journal.mark(self.scope, "r:{}".format(range_idx), ok=False, docs=doc_count)
+        return False
+
+    def observe_latency(self, latency):
+        if self.limiter is not None:
+            self.limiter.observe(latency)
+
+    async def run_units(self, units, handler):
+        self.log_info("start tasks, concurrency: {}".format(self.configure['task_count']))
+        if self.budget is not None:
+            task_count = await consume_units(units, handler, self.budget.maximum, budget=self.budget)
+        else:
+            task_count = await consume_units(units, handler, task_count_of(self.configure), self.limiter)
+        self.task_count += task_count
+        self.log_info("finished tasks count: {}".format(task_count))
+
+    async def process_range(self, src_coll, dst_coll, lower, upper, range_idx):
+        """
+        src与dst按_id升序读取同一区间, 一次顺序遍历得出缺失、多余与不一致的文档
+        """
+        process_id.set(range_idx)
+        unit_result.set({"ok": True})
+        start = time.time()
+
+        batch = self.configure.get('query_batch', 20)
+        query = id_range_query(lower, upper)
+        src_stream = SortedDigestStream(self.digest_engine.find(src_coll, query, sort=True).batch_size(batch),
+                                        batch, self.digest_engine, self.hasher, self.log, "src")
+        dst_stream = SortedDigestStream(self.digest_engine.find(dst_coll, query, sort=True).batch_size(batch),
+                                        batch, self.digest_engine, self.hasher, self.log, "dst")
+
+        doc_count = 0
+        fetch_time = 0
+        try:
+            while True:
+                pending = [s.fill() for s in (src_stream, dst_stream) if s.pending]
+                if pending:
+                    fetch_start = time.time()
+                    await asyncio.gather(*pending)
+                    fetch_time += time.time() - fetch_start
+                    self.observe_latency(time.time() - fetch_start)
+                    continue
+
+                src_item, dst_item = src_stream.peek(), dst_stream.peek()
+                if src_item is None and dst_item is None:
+                    break
+
+                kind, doc_id, src_next, dst_next = merge_step(src_item, dst_item)
+                if kind is not None:
+                    self.log_diff(kind, doc_id)
+                if src_next:
+                    src_stream.advance()
+                if dst_next:
+                    dst_stream.advance()
+                doc_count += 1
+        except Exception as e:
+            return self.fail_range(range_idx, lower, upper, doc_count, e)
+
+        end = time.time()
+        self.log.observe("unit", end - start)
+        self.log_debug(
+            "[{}] process range [{}, {}) {} docs total time :{}, get src and dst data time :{}".format(
+                range_idx, lower, upper, doc_count, end - start, fetch_time),
+            event="unit", unit=range_idx, docs=doc_count, seconds=end - start)
+        self.finish_unit("r:{}".format(range_idx), doc_count)
+        self.process_time += end - start
+        self.log_progress(doc_count)
+        return True
 
+    async def process_bucket(self, verifier, lower, upper, range_idx):
+        """
+        分层指纹校验一个_id区间, 仅对指纹不一致的子区间逐文档比对
+        """
+        process_id.set(range_idx)
+        unit_result.set({"ok": True})
+        start = time.time()
+
+        try:
+            doc_count = await verifier.verify(lower, upper, self.log_diff)
+        except Exception as e:
+            return self.fail_range(range_idx, lower, upper, 0, e)
+
+        end = time.time()
+        self.log.observe("unit", end - start)
+        self.log_debug("[{}] verify range [{}, {}) {} docs total time :{}".format(
+            range_idx, lower, upper, doc_count, end - start),
+            event="unit", unit=range_idx, docs=doc_count, seconds=end - start)
+        self.finish_unit("r:{}".format(range_idx), doc_count)
+        self.process_time += end - start
+        self.log_progress(doc_count)
+        return True
+
+    def log_diff(self, kind, doc_id):
+        # 存在疑似差异的单元在进度日志中记为不一致, 续跑时不再复核
+        unit_result.get()['ok'] = False
+        if self.rechecks.enabled:
+            self.rechecks.add(doc_id, kind)
+            return
+        self.report_diff(kind, doc_id)
+
+    def report_diff(self, kind, doc_id):
+        if kind == DIFF_CHANGED:
+            self.log_error("DIFF => _id: {}".format(doc_id), event="diff", ns=self.scope, id=doc_id, kind=kind)
+        else:
+            self.log_error("DIFF => _id: {} {}".format(doc_id, kind), event="diff", ns=self.scope, id=doc_id,
+                           kind=kind)
+        self.log.incr("diffs")
+        self.diff_report.add(self.scope, kind, doc_id)
+        count_collection(diffs=1)
+        if self.follow_seeds is not None:
+            self.follow_seeds.setdefault(self.scope, []).append(doc_id)
+        self.process_document_res = False
+
+    async def recheck_diffs(self, src_coll, dst_coll):
+        """
+        按recheck_intervals退避复核疑似差异, 复核后一致的记录延迟, 次数用完仍不一致的才记为差异
+        """
+        self.log_info("RECHECK => {} suspects, intervals: {}".format(len(self.rechecks), self.rechecks.intervals))
+        batch = self.configure.get('query_batch', 20)
+        task_count = task_count_of(self.configure)
+        while len(self.rechecks):
+            await asyncio.sleep(self.rechecks.wait_time())
+            due = self.rechecks.pop_due(batch * task_count)
+            units = ((src_coll, dst_coll, due[i:i + batch]) for i in range(0, len(due), batch))
+            await consume_units(units, self.recheck_batch, task_count)
+        self.log_info("RECHECK => [{}] {}".format(self.scope, self.rechecks.summary()), event="recheck",
+                      ns=self.scope, suspects=self.rechecks.suspects, resolved=self.rechecks.resolved,
+                      confirmed=self.rechecks.confirmed)
         return self.process_document_res
 
-    async def sub_future(self, index):
-        print("[{}] tasks: {}".format(index, len(self.tasks)))
-        while len(self.tasks) > 0:
-            await asyncio.create_task(self.tasks.pop())
-            print("[{}] tasks: {}".format(index, len(self.tasks)))
+    async def recheck_batch(self, src_coll, dst_coll, suspects):
+        ids = [suspect.doc_id for suspect in suspects]
+        src_digests, dst_digests = await asyncio.gather(self.get_src_cursor_data(src_coll, ids, "recheck"),
+                                                        self.get_dst_cursor_data(dst_coll, ids, "recheck"))
+        for suspect in suspects:
+            if src_digests is None or dst_digests is None:
+                # 拉取失败按仍不一致计, 消耗一次复核次数
+                kind = suspect.kind
+            else:
+                key = doc_key(suspect.doc_id)
+                kind = diff_kind(src_digests.get(key), dst_digests.get(key))
+            if kind is None:
+                lag = self.rechecks.resolve(suspect)
+                self.log.observe("recheck_lag", lag)
+                self.log.incr("recheck_resolved")
+                self.log_debug("RECHECK => _id: {} resolved after {:.3f}s".format(suspect.doc_id, lag),
+                               event="recheck_resolved", ns=self.scope, id=suspect.doc_id, lag=lag)
+            elif not self.rechecks.retry(suspect, kind):
+                self.report_diff(kind, suspect.doc_id)
+
+    async def report_diffs(self, src_coll, dst_coll):
+        """
+        摘要比对结束后只拉取差异文档, 字段级差异写入JSONL报告
+        """
+        try:
+            count, dropped = await self.diff_report.run(self.scope, src_coll, dst_coll, self.digest_engine.rule)
+        except Exception as e:
+            self.log_error("DIFF REPORT => fetch diff documents failed, msg: {}".format(e))
+            return
+        if count:
+            self.log_info("DIFF REPORT => {} documents written to {}".format(count, self.diff_report.path))
+        if dropped:
+            self.log_error("DIFF REPORT => {} diffs over diff_limit not fetched".format(dropped))
 
     async def get_src_cursor_data(self, src_coll, values, start_idx):
         start4 = time.time()
-        src_md5 = {}
-
-        src_cursor = src_coll.find({"_id": {"$in": values}})
-        # docs = await src_cursor.to_list(length=len(values))
-        # if not docs:
-        #     self.log_error("src find result empty, values: {}".format(values))
-        #     return
-
-        if not isinstance(src_cursor, list):
-            while src_cursor.alive:
-                try:
-                    doc = await src_cursor.next()
-                except Exception as e:
-                    self.log_error("src next failed! values: {}, msg: {}".format(values, str(e)))
-                    continue
-                await asyncio.sleep(0)
-                md5 = hashlib.md5(str(doc).replace(': ', ':').replace(', ', ',').encode('utf - 8')).hexdigest()
-                src_md5[doc['_id']] = md5
+        src_digests = {}
+
+        src_cursor = self.digest_engine.find(src_coll, {"_id": {"$in": values}})
+        try:
+            docs = await fetch_docs(src_cursor, len(values))
+        except Exception as e:
+            self.log_error("[{}] src find failed! values: {}, msg: {}".format(start_idx, len(values), e))
+            return None
+        fetched = time.time()
+        src_digests.update((doc_key(doc_id), digest)
+                           for doc_id, digest in await self.hasher.digests(self.digest_engine, docs))
         end4 = time.time()
+        self.log.observe("src_fetch", fetched - start4)
+        self.log.observe("hash", end4 - fetched)
 
-        self.log_info("[{}] get src cursor time: {}".format(start_idx, end4 - start4))
+        self.log_debug("[{}] get src cursor time: {}".format(start_idx, end4 - start4))
 
-        return src_md5
+        return src_digests
 
     async def get_dst_cursor_data(self, dst_coll, values, start_idx):
         start5 = time.time()
-        dst_md5 = {}
-
-        dst_cursor = dst_coll.find({"_id": {"$in": values}})
-        # docs = await dst_cursor.to_list(length=len(values))
-        # if not docs:
-        #     self.log_error("dst find result empty, values: {}".format(values))
-        #     return
-
-        if not isinstance(dst_cursor, list):
-            while dst_cursor.alive:
-                try:
-                    dst = await dst_cursor.next()
-                except Exception as e:
-                    self.log_error("dst next failed! values: {}, msg: {}".format(values, str(e)))
-                    continue
-                await asyncio.sleep(0)
-                md5 = hashlib.md5(str(dst).replace(': ', ':').replace(', ', ',').encode('utf - 8')).hexdigest()
-                dst_md5[dst['_id']] = md5
+        dst_digests = {}
+
+        dst_cursor = self.digest_engine.find(dst_coll, {"_id": {"$in": values}})
+        try:
+            docs = await fetch_docs(dst_cursor, len(values))
+        except Exception as e:
+            self.log_error("[{}] dst find failed! values: {}, msg: {}".format(start_idx, len(values), e))
+            return None
+        fetched = time.time()
+        dst_digests.update((doc_key(doc_id), digest)
+                           for doc_id, digest in await self.hasher.digests(self.digest_engine, docs))
         end5 = time.time()
+        self.log.observe("dst_fetch", fetched - start5)
+        self.log.observe("hash", end5 - fetched)
 
-        self.log_info("[{}] get dst cursor time: {}".format(start_idx, end5 - start5))
-        return dst_md5
+        self.log_debug("[{}] get dst cursor time: {}".format(start_idx, end5 - start5))
+        return dst_digests
 
     async def process_document(self, src_coll, dst_coll, values, start_idx):
         process_id.set(start_idx)
-
-        task1 = asyncio.create_task(self.get_src_cursor_data(src_coll, values, start_idx))
-        task2 = asyncio.create_task(self.get_dst_cursor_data(dst_coll, values, start_idx))
+        unit_result.set({"ok": True})
 
         start4 = time.time()
-        src_docs = await task1
-        dst_docs = await task2
+        src_docs, dst_docs = await asyncio.gather(self.get_src_cursor_data(src_coll, values, start_idx),
+                                                  self.get_dst_cursor_data(dst_coll, values, start_idx))
         end4 = time.time()
+        self.observe_latency(end4 - start4)
 
-        if not src_docs or not dst_docs:
+        if src_docs is None or dst_docs is None:
+            # 拉取失败的批次整体记为不一致, 续跑时不再重试
             self.process_document_res = False
-            self.log_error("ERROR => src docs or dst docs is empty, src docs: {}, dst docs: {}".format(len(src_docs), len(dst_docs)))
+            self.journal.mark(self.scope, "b:{}".format(start_idx), ok=False, docs=len(values))
             return False
 
-        if len(src_docs) != len(dst_docs):
-            dst_miss_ids = [i for i in list(src_docs.keys()) if i not in list(dst_docs.keys())]
-            src_miss_ids = [i for i in list(dst_docs.keys()) if i not in list(src_docs.keys())]
-            self.log_error("DIFF => src docs count: {} != dst docs count: {}, dst missing ids: {}, src missing ids".format(len(src_docs), len(dst_docs), dst_miss_ids, src_miss_ids))
-
-        for id, doc in src_docs.items():
-            migrated = dst_docs.get(id, None)
+        if not src_docs and not dst_docs:
+            self.process_document_res = False
+            self.log_error("ERROR => src docs and dst docs are empty, values: {}".format(len(values)))
+            self.journal.mark(self.scope, "b:{}".format(start_idx), ok=False, docs=len(values))
+            return False
 
-            is_diff = doc != migrated
-            if is_diff:
-                self.log_error("DIFF => _id: {}".format(id))
-                self.process_document_res = False
+        # 摘要按doc_key索引, 报告时换回原始_id
+        ids = dict((doc_key(doc_id), doc_id) for doc_id in values)
+        for key in src_docs.keys() - dst_docs.keys():
+            self.log_diff(DIFF_MISSING_DST, ids.get(key, key))
+        for key in dst_docs.keys() - src_docs.keys():
+            self.log_diff(DIFF_MISSING_SRC, ids.get(key, key))
+        for key in src_docs.keys() & dst_docs.keys():
+            if src_docs[key] != dst_docs[key]:
+                self.log_diff(DIFF_CHANGED, ids.get(key, key))
 
         end6 = time.time()
-        self.log_info(
+        self.log.observe("compare", end6 - end4)
+        self.log.observe("unit", end6 - start4)
+        self.log_debug(
             "[{}] process {} docs total time :{}, get src and dst data time :{}".format(
-                process_id.get(), len(values), end6 - start4, end4 - start4))
+                process_id.get(), len(values), end6 - start4, end4 - start4),
+            event="unit", unit=start_idx, docs=len(values), seconds=end6 - start4)
+        self.finish_unit("b:{}".format(start_idx), len(values))
         self.process_time += end6 - start4
-        self.process_count += len(values)
-        self.log_info("-------------------------Process Progress: {}/{}----------------------------".format(
-            self.process_count, self.total_count))
+        self.log_progress(len(values))
         return True
 
+    def cluster(self, side, url):
+        """
+        按connection_profiles中side的配置创建连接, 获取连接的等待耗时记入指标<side>_pool_wait
+        """
+        return open_cluster(url, client_options(self.configure, side),
+                                 lambda wait: self.log.observe("{}_pool_wait".format(side), wait))
+
+    def log_pool_wait(self):
+        for side, cluster in (("src", self.src), ("dst", self.dst)):
+            if cluster is not None:
+                self.log_info("POOL WAIT => {} {}".format(side, cluster.pool_listener.summary()))
+
+    async def follow_start_times(self):
+        """
+        初次比对前记录src与dst的集群时间, 只有副本集/分片集群支持change stream
+        """
+        try:
+            start_times = await asyncio.gather(cluster_time(self.src.conn), cluster_time(self.dst.conn))
+        except Exception as e:
+            self.log_error("FOLLOW => get cluster time failed, msg: {}".format(e))
+            return None
+        if None in start_times:
+            self.log_error("FOLLOW => change streams require a replica set or sharded cluster")
+            return None
+        return start_times
+
+    async def follow(self, start_times):
+        """
+        订阅各集合src与dst的change stream, 只复核发生变化的_id, 每follow_report_interval秒报告当前不一致的文档数
+        运行follow_duration秒(0为一直运行, Ctrl+C结束), 返回结束时是否没有不一致的文档
+        """
+        debounce = self.configure.get(FOLLOW_DEBOUNCE, 2)
+        batch = self.configure.get('query_batch', 20)
+        states = []
+        for db in self.configure[COMPARE_DBS]:
+            for coll in self.configure[COMPARE_COLLS]:
+                scope = "{}.{}".format(db, coll)
+                engine = DigestEngine.from_configure(self.configure, db, coll)
+                state = FollowScope(scope, engine.collection(self.src.conn[db][coll]),
+                                    engine.collection(self.dst.conn[db][coll]), engine, debounce)
+                for doc_id in self.follow_seeds.pop(scope, ()):
+                    state.queue.add(doc_id)
+                states.append(state)
+
+        tasks = []
+        for state in states:
+            tasks.append(asyncio.create_task(watch_changes(state.src_coll, start_times[0], state.on_change,
+                                                           self.log_error)))
+            tasks.append(asyncio.create_task(watch_changes(state.dst_coll, start_times[1], state.on_change,
+                                                           self.log_error)))
+            tasks.append(asyncio.create_task(self.verify_changes(state, batch)))
+        tasks.append(asyncio.create_task(self.report_follow(states)))
+        self.log_info("FOLLOW => watching {} collections, debounce: {}s".format(len(states), debounce))
+        try:
+            await asyncio.wait(tasks, timeout=self.configure.get(FOLLOW_DURATION, 0) or None)
+        except asyncio.CancelledError:
+            self.log_info("FOLLOW => interrupted")
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        self.log_follow(states)
+        return not any(state.divergent for state in states)
+
+    async def follow_digests(self, state, coll, ids, side):
+        start = time.time()
+        try:
+            docs = await fetch_docs(state.engine.find(coll, {"_id": {"$in": ids}}), len(ids))
+        except Exception as e:
+            self.log_error("FOLLOW => [{}] {} find failed! values: {}, msg: {}".format(state.scope, side, len(ids), e))
+            return None
+        self.log.observe("follow_{}_fetch".format(side), time.time() - start)
+        return dict((doc_key(doc_id), digest) for doc_id, digest in await self.hasher.digests(state.engine, docs))
+
+    async def verify_changes(self, state, batch):
+        """
+        取出静默期已过的_id, 按批次复核两端, 更新当前不一致的_id; 拉取失败的_id重新入队
+        """
+        while True:
+            ids = state.queue.pop_ready(batch)
+            if not ids:
+                await asyncio.sleep(max(state.queue.wait_time(), 0.01))
+                continue
+            src_digests, dst_digests = await asyncio.gather(self.follow_digests(state, state.src_coll, ids, "src"),
+                                                            self.follow_digests(state, state.dst_coll, ids, "dst"))
+            if src_digests is None or dst_digests is None:
+                for doc_id in ids:
+                    state.queue.add(doc_id)
+                continue
+            for doc_id in ids:
+                key = doc_key(doc_id)
+                kind = diff_kind(src_digests.get(key), dst_digests.get(key))
+                if not state.update(doc_id, kind):
+                    continue
+                if kind is None:
+                    self.log_info("FOLLOW RESOLVED => [{}] _id: {}".format(state.scope, doc_id),
+                                  event="follow_resolved", ns=state.scope, id=doc_id)
+                else:
+                    self.log_error("FOLLOW DIFF => [{}] _id: {} {}".format(state.scope, doc_id, kind),
+                                   event="follow_diff", ns=state.scope, id=doc_id, kind=kind)
+            self.log.incr("follow_verified", len(ids))
+
+    async def report_follow(self, states):
+        interval = self.configure.get(FOLLOW_REPORT_INTERVAL, 30)
+        while True:
+            await asyncio.sleep(interval)
+            self.log_follow(states)
+
+    def log_follow(self, states):
+        for state in states:
+            self.log_info("FOLLOW => [{}] changes: {}, verified: {}, pending: {}, divergent: {}".format(
+                state.scope, state.changes, state.verified, len(state.queue), len(state.divergent)),
+                event="follow", ns=state.scope, changes=state.changes, verified=state.verified,
+                pending=len(state.queue), divergent=len(state.divergent))
+
     async def do_compare(self):
         start = time.time()
+        self.log = LogSink.from_configure(self.configure, self.log_file_path, self.error_log_file_path,
+                                          self.event_file_path, self.metrics_file_path)
         src_url, dst_url = self.configure["src_url"], self.configure["dst_url"]
 
         if len(src_url) == 0 or len(dst_url) == 0:
             return False
 
-        if not src_url.startswith('mongodb:') or not dst_url.startswith('mongodb:'):
+        if not src_url.startswith(('mongodb:', DUMP_PREFIX)) or not dst_url.startswith(('mongodb:', DUMP_PREFIX)):
             self.log_error("ERROR => invalid mongodb url")
         try:
-            self.src, self.dst = AsyncMongoCluster(src_url), AsyncMongoCluster(dst_url)
+            self.src, self.dst = self.cluster("src", src_url), self.cluster("dst", dst_url)
             self.src.connect()
             self.dst.connect()
         except Exception as e:
             self.log_error("create mongo connection failed {} | {}, msg: {}".format(src_url, dst_url, e))
 
-        os.makedirs(os.path.dirname(self.log_file_path), exist_ok=True)
-        self.log = open(self.log_file_path, "a+")
+        self.journal = open_journal(self.journal_file_path, self.configure)
+        self.hasher = DigestExecutor.from_configure(self.configure)
 
         self.log_info("==============================================")
         self.log_info("Configuration %s" % self.configure)
+        if self.digest_engine.server:
+            self.log_error(SERVER_DIGEST_WARNING)
+        if len(self.journal):
+            self.log_info("RESUME => {} finished units loaded from {}".format(len(self.journal), self.journal_file_path))
+
+        start_times = None
+        if self.configure.get(FOLLOW, False):
+            start_times = await self.follow_start_times()
+        if start_times is not None:
+            self.follow_seeds = {}
 
         # 开始比对
         result = False
@@ -270,128 +969,266 @@ class AsyncDbCompare:
         except Exception as e:
             self.log_error("check failed {}" .format(e))
 
+        if start_times is not None:
+            # 初次比对后持续校验变化的文档; 初次比对的失败(区间/批次出错、collection出错、差异)仍记为失败,
+            # 持续校验只能让结果变为失败
+            self.log_info("FOLLOW => initial pass result: {}".format(result))
+            follow_result = await self.follow(start_times)
+            result = result and follow_result
+
         end = time.time()
+        self.log_pool_wait()
         self.log_info("runtime {}s".format(end - start))
         if result:
             self.log_info("SUCCESS")
         else:
             self.log_error("FAIL")
+        return result
 
     def quit(self):
+        if self.journal:
+            self.journal.close()
+        self.diff_report.close()
         self.src.close()
         self.dst.close()
-        self.log.close()
-        if self.error_log:
-            self.error_log.close()
+        if self.hasher:
+            self.hasher.close()
+        if self.log:
+            self.log.close()
 
 
 class AsyncDbWrite:
+    # 按collection区分的状态, 多个collection同时写入时各自独立
+    scope = CollectionField()
+    digest_engine = CollectionField()
+    src_doc_count = CollectionField()
+    snapshot_writer = CollectionField()
+    pending_units = CollectionField()
+    write_res = CollectionField()
+    last_checkpoint = CollectionField()
+
     def __init__(self, configure):
         self.src = None
         self.log = None
-        self.error_log = None
         self.src_doc_count = 0
         self.configure = configure
+        self.digest_engine = DigestEngine.from_configure(configure)
         self.file_start = configure['sample_start_idx']
         self.file_end = configure['sample_start_idx'] + configure["sample_count"]
-        self.coll_file_path = _base_dir + '\\write_export\\{}_{}_{}.txt'
-        self.log_file_path = _base_dir + '\\write_export\\write_log_{}_{}.txt'.format(self.file_start, self.file_end)
-        self.error_log_file_path = _base_dir + '\\write_export\\write_error_log_{}_{}.txt'.format(self.file_start,
-                                                                                                  self.file_end)
+        self.coll_file_path = _base_dir + '\\write_export\\{}_{}_{}.snap'
+        suffix = export_suffix(configure)
+        self.log_file_path = _base_dir + '\\write_export\\write_log_{}.txt'.format(suffix)
+        self.error_log_file_path = _base_dir + '\\write_export\\write_error_log_{}.txt'.format(suffix)
+        self.event_file_path = _base_dir + '\\write_export\\write_events_{}.jsonl'.format(suffix)
+        self.metrics_file_path = _base_dir + '\\write_export\\write_metrics_{}.json'.format(suffix)
+        self.journal_file_path = _base_dir + '\\write_export\\write_journal_{}.txt'.format(suffix)
+        self.journal = None
+        self.scope = ""
         self.process_count = 0
         self.process_time = 0
         self.total_count = 0
         self.task_count = 0
-        self.tasks = []
-        self.src_docs = {}
-
-    def log_info(self, message):
-        msg = "INFO  [%s] %s " % (time.strftime('%Y-%m-%d %H:%M:%S'), message)
-        print(msg)
-        self.log.write(msg + '\n')
-        self.log.flush()
-
-    def log_error(self, message):
-        msg = "ERROR [%s] %s " % (time.strftime('%Y-%m-%d %H:%M:%S'), message)
-        print(msg)
-        if not self.error_log:
-            os.makedirs(os.path.dirname(self.error_log_file_path), exist_ok=True)
-            self.error_log = open(self.error_log_file_path, 'a+')
-        self.error_log.write(msg + '\n')
-        self.error_log.flush()
+        self.last_progress = 0
+        self.limiter = AdaptiveLimiter.from_configure(configure, self.log_info)
+        self.hasher = None
+        self.snapshot_writer = None
+        self.pending_units = []
+        self.write_res = True
+        self.last_checkpoint = time.time()
+        self.budget = None
+        self.states = []
+
+    def log_debug(self, message, **fields):
+        self.log.debug(message, **fields)
+
+    def log_info(self, message, **fields):
+        self.log.info(message, **fields)
+
+    def log_error(self, message, **fields):
+        self.log.error(message, **fields)
+
+    def log_progress(self, doc_count):
+        """
+        累计已处理文档数, 进度行每秒最多输出一次
+        """
+        self.process_count += doc_count
+        self.log.incr("docs", doc_count)
+        count_collection(docs=doc_count)
+        now = time.time()
+        if now - self.last_progress >= 1 or self.process_count >= self.total_count:
+            self.last_progress = now
+            self.log_info("-------------------------Process Progress: {}/{}----------------------------".format(
+                self.process_count, self.total_count), event="progress", done=self.process_count,
+                total=self.total_count)
 
     async def check_and_write(self):
-        check_db_names = self.configure[COMPARE_DBS]
-        for db in check_db_names:
-            src_db = self.src.conn[db]
-            check_colls = self.configure[COMPARE_COLLS]
-            for coll in check_colls:
+        """
+        所有collection按估算文档数从大到小调度, 最多collection_concurrency个同时写入并共享task_count并发预算,
+        每个collection都写入完成后输出结果表
+        """
+        self.states = []
+        for db in self.configure[COMPARE_DBS]:
+            for coll in self.configure[COMPARE_COLLS]:
                 coll_start = time.time()
-                src_coll = src_db[coll]
-                self.src_doc_count = await src_coll.estimated_document_count()
-                coll_end = time.time()
-                print("Collection time: {}".format(coll_end - coll_start))
-
-                before = time.time()
-                await self.data_write(coll, src_coll, self.configure[COMPARISION_MODE])
-                after = time.time()
-                self.log_info("collection write runtime: {}, avg time: {}".format(after - before,
-                                                                                  self.process_time / self.task_count))
-
-        return True
+                digest_engine = DigestEngine.from_configure(self.configure, db, coll)
+                src_coll = digest_engine.collection(self.src.conn[db][coll])
+                src_doc_count, error = await estimate_count(src_coll)
+                self.states.append(CollectionState(db, coll, src_doc_count, src_coll=src_coll, error=error,
+                                                   digest_engine=digest_engine, src_doc_count=src_doc_count,
+                                                   snapshot_writer=None, pending_units=[], write_res=True,
+                                                   last_checkpoint=time.time()))
+                self.log_debug("Collection time: {}".format(time.time() - coll_start))
+
+        concurrency = self.configure.get(COLLECTION_CONCURRENCY, 1)
+        if concurrency > 1:
+            self.budget = ConcurrencyBudget.from_configure(self.configure, self.limiter)
+        await run_collections(self.states, self.write_collection, concurrency, self.log_error)
+        for line in result_table(self.states):
+            self.log_info(line)
+        return all(state.ok for state in self.states)
+
+    async def write_collection(self, state):
+        coll = state.coll
+        if self.journal.is_done(self.scope, UNIT_COLLECTION):
+            self.log_info("RESUME => collection [{}] already written".format(coll))
+            state.ok, state.resumed = True, True
+            return
+
+        before = time.time()
+        await self.data_write(coll, state.src_coll, self.configure[COMPARISION_MODE])
+        state.ok = self.write_res
+        if not self.write_res:
+            self.log_error("FAIL => collection [{}] some batches not written".format(coll))
+            return
+        self.journal.mark(self.scope, UNIT_COLLECTION)
+        after = time.time()
+        self.log_info("collection write runtime: {}, avg time: {}".format(after - before,
+                                                                          self.process_time / max(self.task_count, 1)))
 
     async def data_write(self, coll_name, src_coll, mode):
-        samples = self.configure.get(COMPARISION_SAMPLES, [])
-        if mode == "sample":
-            sample_count = len(samples)
-            count = sample_count \
-                if sample_count <= self.src_doc_count \
-                else self.src_doc_count
+        directory = self.coll_file_path.format(coll_name, self.file_start, self.file_end)
+        os.makedirs(os.path.dirname(directory), exist_ok=True)
+        # 多进程按_id区间分片写入同一快照时, 各分片只落盘run, 由主进程统一归并
+        part = self.configure.get(WORKER_CHUNK)
+        self.snapshot_writer = SnapshotWriter(directory, self.digest_engine.tag,
+                                              self.configure.get(SNAPSHOT_KEY_WIDTH, 32),
+                                              resume=self.configure.get(RESUME, False), part=part)
+        if mode in (MODE_FULL, MODE_MERKLE):
+            await self.full_write(src_coll)
         else:
-            count = self.src_doc_count
+            await self.sample_write(coll_name, src_coll)
+        self.commit_units(force=True)
+        if part is not None or not self.write_res:
+            # 有批次写入失败时保留已落盘的run, 续跑时只补写失败的批次
+            self.snapshot_writer = None
+            return
+
+        # 摘要已分批排序落盘, 此处归并为最终快照文件
+        start6 = time.time()
+        count = self.snapshot_writer.close()
+        self.snapshot_writer = None
+        end6 = time.time()
+        self.log_info("write file time: {}, src docs count: {}".format(end6 - start6, count))
+
+    async def sample_write(self, coll_name, src_coll):
+        samples, count = await plan_samples(self.configure, self.sample_file_path(coll_name), src_coll, None,
+                                            self.src_doc_count, self.configure.get(RESUME, False), self.log_info)
 
         if count == 0:
-            return True
+            return False
 
-        self.total_count = count
+        self.total_count += count
         self.log_info("Process Count: {}".format(count))
 
         batch = self.configure.get('query_batch', 20)
 
-        tasks = []
-        start_idx = 0
-        samples = [int(x) for x in samples]
-        while count > 0:
-            end_idx = start_idx + batch if batch < count else start_idx + count
-            values = samples[start_idx: end_idx]
-            tasks.append(self.write_sample_document(src_coll, values, start_idx))
-            count -= batch
-            start_idx = end_idx
-
-        self.task_count = len(tasks)
-        self.tasks = tasks
-        self.log_info("create tasks count: {}".format(len(tasks)))
-
-        sub_tasks = []
-        max_task_count = self.configure['task_count']
-        for i in range(max_task_count):
-            sub_tasks.append(asyncio.create_task(self.sub_future(i)))
-
-        await asyncio.gather(*sub_tasks)
+        units = ((src_coll, values, start_idx)
+                 for start_idx, values in iter_sample_batches(samples, count, batch)
+                 if not self.resume_unit("b:{}".format(start_idx)))
+        await self.run_units(units, self.write_sample_document)
+        return True
 
-        start6 = time.time()
-        directory = self.coll_file_path.format(coll_name, self.file_start, self.file_end)
-        os.makedirs(os.path.dirname(directory), exist_ok=True)
-        with open(directory, "a+", encoding='UTF-8') as w_file:
-            w_file.write(json.dumps(self.src_docs))
-        end6 = time.time()
-        self.log_info("write file time: {}".format(end6 - start6))
+    async def full_write(self, src_coll):
+        """
+        按_id区间写入src全部文档的摘要, 供period 2全量/分层指纹比对
+        """
+        self.total_count += self.src_doc_count
+        self.log_info("Process Count: {}".format(self.src_doc_count))
+
+        source = CollectionDigestSource(src_coll, self.digest_engine, self.configure.get('query_batch', 20),
+                                        self.hasher)
+        ranges = configured_ranges(self.configure) or self.journal.ranges(self.scope)
+        if ranges is None:
+            ranges = await split_id_ranges(src_coll, range_count_of(self.configure))
+            self.journal.save_ranges(self.scope, ranges)
+
+        units = ((source, lower, upper, range_idx)
+                 for range_idx, (lower, upper) in enumerate(ranges)
+                 if not self.resume_unit("r:{}".format(range_idx)))
+        await self.run_units(units, self.write_range)
+
+    def sample_file_path(self, coll_name):
+        # 抽样策略抽取的_id与快照放在一起, period 2按同一批_id比对
+        return self.coll_file_path.format(coll_name, self.file_start, self.file_end) + SAMPLE_INDEX_SUFFIX
+
+    def resume_unit(self, unit):
+        record = self.journal.get(self.scope, unit)
+        if record is None:
+            return False
+        self.process_count += record.get('docs', 0)
+        return True
 
-    async def sub_future(self, index):
-        print("[{}] tasks: {}".format(index, len(self.tasks)))
-        while len(self.tasks) > 0:
-            await asyncio.create_task(self.tasks.pop())
-            print("[{}] tasks: {}".format(index, len(self.tasks)))
+    def commit_units(self, force=False):
+        """
+        单元的摘要全部落盘为run后才记入进度日志; 超过checkpoint_interval或force时强制落盘当前缓冲
+        """
+        if not self.pending_units or self.snapshot_writer is None:
+            return
+        if force or time.time() - self.last_checkpoint >= self.configure.get(CHECKPOINT_INTERVAL, 30):
+            self.snapshot_writer.flush_run()
+        if self.snapshot_writer.buffer:
+            return
+        for unit, doc_count in self.pending_units:
+            self.journal.mark(self.scope, unit, docs=doc_count)
+        self.journal.flush()
+        self.pending_units = []
+        self.last_checkpoint = time.time()
+
+    async def write_range(self, source, lower, upper, range_idx):
+        process_id.set(range_idx)
+        start = time.time()
+
+        try:
+            items = await source.digests(lower, upper)
+        except Exception as e:
+            # 不记入进度日志, 续跑时重新读取该区间, 其他区间继续写入
+            self.write_res = False
+            self.log_error("[{}] process range [{}, {}) failed! msg: {}".format(range_idx, lower, upper, e))
+            return False
+        self.snapshot_writer.add(items)
+        self.pending_units.append(("r:{}".format(range_idx), len(items)))
+        self.commit_units()
+
+        end = time.time()
+        self.log.observe("unit", end - start)
+        self.log_debug("[{}] process range [{}, {}) {} docs total time :{}".format(
+            range_idx, lower, upper, len(items), end - start),
+            event="unit", unit=range_idx, docs=len(items), seconds=end - start)
+        self.process_time += end - start
+        self.log_progress(len(items))
+
+    def observe_latency(self, latency):
+        if self.limiter is not None:
+            self.limiter.observe(latency)
+
+    async def run_units(self, units, handler):
+        self.log_info("start tasks, concurrency: {}".format(self.configure['task_count']))
+        if self.budget is not None:
+            task_count = await consume_units(units, handler, self.budget.maximum, budget=self.budget)
+        else:
+            task_count = await consume_units(units, handler, task_count_of(self.configure), self.limiter)
+        self.task_count += task_count
+        self.log_info("finished tasks count: {}".format(task_count))
 
     async def write_sample_document(self, src_coll, values, start_idx):
         process_id.set(start_idx)
@@ -400,288 +1237,772 @@ class AsyncDbWrite:
 
         src_docs = {}
         start3 = time.time()
-        src_cursor = src_coll.find({"_id": {"$in": values}})
-        if not isinstance(src_cursor, list):
-            while src_cursor.alive:
-                doc = await src_cursor.next()
-                md5 = hashlib.md5(str(doc).replace(': ', ':').replace(', ', ',').encode('utf - 8')).hexdigest()
-                src_docs[doc['_id']] = md5
+        src_cursor = self.digest_engine.find(src_coll, {"_id": {"$in": values}})
+        try:
+            docs = await fetch_docs(src_cursor, len(values))
+        except Exception as e:
+            # 不记入进度日志, 续跑时重新拉取该批次
+            self.write_res = False
+            self.log_error("[{}] src find failed! values: {}, msg: {}".format(start_idx, len(values), e))
+            return False
 
         end3 = time.time()
+        self.observe_latency(end3 - start3)
+        self.log.observe("src_fetch", end3 - start3)
+        src_docs.update(await self.hasher.digests(self.digest_engine, docs))
+        self.log.observe("hash", time.time() - end3)
 
-        self.src_docs.update(src_docs)
+        self.snapshot_writer.add(src_docs.items())
+        self.pending_units.append(("b:{}".format(start_idx), len(values)))
+        self.commit_units()
 
         end0 = time.time()
-        self.log_info(
+        self.log.observe("unit", end0 - start0)
+        self.log_debug(
             "[{}] process {} docs total time :{}, get src data time :{}".format(
                 process_id.get(), len(values), end0 - start0,
-                end3 - start3))
+                end3 - start3),
+            event="unit", unit=start_idx, docs=len(values), seconds=end0 - start0)
         self.process_time += end0 - start0
-        self.process_count += len(values)
-        self.log_info("-------------------------Process Progress: {}/{}----------------------------".format(
-            self.process_count, self.total_count))
+        self.log_progress(len(values))
+
+    def cluster(self, side, url):
+        """
+        按connection_profiles中side的配置创建连接, 获取连接的等待耗时记入指标<side>_pool_wait
+        """
+        return open_cluster(url, client_options(self.configure, side),
+                                 lambda wait: self.log.observe("{}_pool_wait".format(side), wait))
+
+    def log_pool_wait(self):
+        if self.src is not None:
+            self.log_info("POOL WAIT => src {}".format(self.src.pool_listener.summary()))
 
     async def do_write(self):
         start = time.time()
+        self.log = LogSink.from_configure(self.configure, self.log_file_path, self.error_log_file_path,
+                                          self.event_file_path, self.metrics_file_path)
         src_url = self.configure["src_url"]
 
         if len(src_url) == 0:
             return False
 
-        if not src_url.startswith('mongodb:'):
+        if not src_url.startswith(('mongodb:', DUMP_PREFIX)):
             self.log_error("ERROR => invalid mongodb url")
         try:
-            self.src = AsyncMongoCluster(src_url)
+            self.src = self.cluster("src", src_url)
             self.src.connect()
         except Exception as e:
             self.log_error("create mongo connection failed {}, msg: {}".format(src_url, e))
 
-        os.makedirs(os.path.dirname(self.log_file_path), exist_ok=True)
-        self.log = open(self.log_file_path, "a+")
+        self.journal = open_journal(self.journal_file_path, self.configure)
+        self.hasher = DigestExecutor.from_configure(self.configure)
         self.log_info("===============================================")
         self.log_info("Configuration %s" % self.configure)
+        if self.digest_engine.server:
+            self.log_error(SERVER_DIGEST_WARNING)
+        if len(self.journal):
+            self.log_info("RESUME => {} finished units loaded from {}".format(len(self.journal), self.journal_file_path))
 
         # 开始写入
         result = await self.check_and_write()
         end = time.time()
+        self.log_pool_wait()
         self.log_info("runtime {}s".format(end - start))
         if result:
-            print("SUCCESS")
             self.log_info("SUCCESS")
         else:
-            print("FAIL")
             self.log_error("FAIL")
+        return result
 
     def quit(self):
+        if self.journal:
+            # 中断时把各collection已完成单元的摘要落盘, 续跑时不必重新拉取
+            for state in self.states:
+                run_in(state, self.commit_units, True)
+            self.journal.close()
         self.src.close()
-        self.log.close()
-        if self.error_log:
-            self.error_log.close()
+        if self.hasher:
+            self.hasher.close()
+        if self.log:
+            self.log.close()
 
 
 class AsyncDbLoadCompare:
+    # 按collection区分的状态, 多个collection同时比对时各自独立
+    scope = CollectionField()
+    digest_engine = CollectionField()
+    dst_doc_count = CollectionField()
+    process_document_res = CollectionField()
+
     def __init__(self, configure):
         self.src = None
         self.dst = None
         self.log = None
-        self.error_log = None
         self.process_document_res = True
         self.dst_doc_count = 0
         self.configure = configure
+        self.digest_engine = DigestEngine.from_configure(configure)
         self.file_start = configure['sample_start_idx']
         self.file_end = configure['sample_start_idx'] + configure["sample_count"]
-        self.coll_file_path = _base_dir + '\\write_export\\{}_{}_{}.txt'
-        self.log_file_path = _base_dir + '\\load_export\\load_log_{}_{}.txt'.format(self.file_start, self.file_end)
-        self.error_log_file_path = _base_dir + '\\load_export\\load_error_log_{}_{}.txt'.format(self.file_start,
-                                                                                                self.file_end)
+        self.coll_file_path = _base_dir + '\\write_export\\{}_{}_{}.snap'
+        suffix = export_suffix(configure)
+        self.log_file_path = _base_dir + '\\load_export\\load_log_{}.txt'.format(suffix)
+        self.error_log_file_path = _base_dir + '\\load_export\\load_error_log_{}.txt'.format(suffix)
+        self.event_file_path = _base_dir + '\\load_export\\load_events_{}.jsonl'.format(suffix)
+        self.metrics_file_path = _base_dir + '\\load_export\\load_metrics_{}.json'.format(suffix)
+        self.journal_file_path = _base_dir + '\\load_export\\load_journal_{}.txt'.format(suffix)
+        self.diff_report = DiffReport(_base_dir + '\\load_export\\load_diff_{}.jsonl'.format(suffix),
+                                      configure.get(DIFF_LIMIT, 10000), configure.get('query_batch', 20))
+        self.journal = None
+        self.scope = ""
         self.process_count = 0
         self.process_time = 0
         self.total_count = 0
         self.task_count = 0
-        self.tasks = []
-
-    def log_info(self, message):
-        msg = "INFO  [%s] %s " % (time.strftime('%Y-%m-%d %H:%M:%S'), message)
-        print(msg)
-        self.log.write(msg + '\n')
-        self.log.flush()
-
-    def log_error(self, message):
-        msg = "ERROR [%s] %s " % (time.strftime('%Y-%m-%d %H:%M:%S'), message)
-        print(msg)
-        if not self.error_log:
-            os.makedirs(os.path.dirname(self.error_log_file_path), exist_ok=True)
-            self.error_log = open(self.error_log_file_path, 'a+')
-
-        self.error_log.write(msg + '\n')
-        self.error_log.flush()
+        self.last_progress = 0
+        self.limiter = AdaptiveLimiter.from_configure(configure, self.log_info)
+        self.hasher = None
+        self.budget = None
+        self.states = []
+
+    def log_debug(self, message, **fields):
+        self.log.debug(message, **fields)
+
+    def log_info(self, message, **fields):
+        self.log.info(message, **fields)
+
+    def log_error(self, message, **fields):
+        self.log.error(message, **fields)
+
+    def log_progress(self, doc_count):
+        """
+        累计已处理文档数, 进度行每秒最多输出一次
+        """
+        self.process_count += doc_count
+        self.log.incr("docs", doc_count)
+        count_collection(docs=doc_count)
+        now = time.time()
+        if now - self.last_progress >= 1 or self.process_count >= self.total_count:
+            self.last_progress = now
+            self.log_info("-------------------------Process Progress: {}/{}----------------------------".format(
+                self.process_count, self.total_count), event="progress", done=self.process_count,
+                total=self.total_count)
 
     async def load_and_compare(self):
-        check_db_names = self.configure[COMPARE_DBS]
-        for db in check_db_names:
-            src_db = self.src.conn[db]
-            dst_db = self.dst.conn[db]
-            check_colls = self.configure[COMPARE_COLLS]
-            for coll in check_colls:
+        """
+        所有collection按dst估算文档数从大到小调度, 最多collection_concurrency个同时比对并共享task_count并发预算,
+        每个collection都比对完成后输出结果表
+        """
+        self.states = []
+        for db in self.configure[COMPARE_DBS]:
+            for coll in self.configure[COMPARE_COLLS]:
                 coll_start = time.time()
-                src_coll = src_db[coll]
-                dst_coll = dst_db[coll]
-                self.dst_doc_count = await dst_coll.estimated_document_count()
-                coll_end = time.time()
-                print("Collection time: {}".format(coll_end - coll_start))
-
-                before = time.time()
-                compare_result = await self.data_load_compare(coll, dst_coll, src_coll,
-                                                              self.configure[COMPARISION_MODE])
-                if not compare_result:
-                    self.log_error("DIFF => collection [%s] data comparison not equals" % coll)
-                    return False
-                else:
-                    self.log_info("PASS => collection [%s] data data comparison exactly equals" % coll)
-                after = time.time()
-                self.log_info("collection load and comparison runtime: {}, avg time: {}".format(after - before,
-                                                                                                self.process_time / self.task_count))
-
-        return True
+                digest_engine = DigestEngine.from_configure(self.configure, db, coll)
+                src_coll = digest_engine.collection(self.src.conn[db][coll])
+                dst_coll = digest_engine.collection(self.dst.conn[db][coll])
+                dst_doc_count, error = await estimate_count(dst_coll)
+                self.states.append(CollectionState(db, coll, dst_doc_count, src_coll=src_coll, dst_coll=dst_coll,
+                                                   error=error, digest_engine=digest_engine,
+                                                   dst_doc_count=dst_doc_count,
+                                                   process_document_res=True))
+                self.log_debug("Collection time: {}".format(time.time() - coll_start))
+
+        concurrency = self.configure.get(COLLECTION_CONCURRENCY, 1)
+        if concurrency > 1:
+            self.budget = ConcurrencyBudget.from_configure(self.configure, self.limiter)
+        await run_collections(self.states, self.load_collection, concurrency, self.log_error)
+        for line in result_table(self.states):
+            self.log_info(line)
+        return all(state.ok for state in self.states)
+
+    async def load_collection(self, state):
+        coll, src_coll, dst_coll = state.coll, state.src_coll, state.dst_coll
+        record = self.journal.get(self.scope, UNIT_COLLECTION)
+        if record is not None:
+            self.log_info("RESUME => collection [{}] already compared, result: {}".format(coll, record['ok']))
+            state.ok, state.resumed = record['ok'], True
+            return
+
+        before = time.time()
+        compare_result = await self.data_load_compare(coll, dst_coll, src_coll, self.configure[COMPARISION_MODE])
+        await self.report_diffs(src_coll, dst_coll)
+        if self.configure.get(PRECHECK) != PRECHECK_ONLY:
+            self.journal.mark(self.scope, UNIT_COLLECTION, ok=compare_result)
+        self.log_divergence(state)
+        state.ok = compare_result
+        if not compare_result:
+            self.log_error("DIFF => collection [%s] data comparison not equals" % coll,
+                           event="collection", ns=self.scope, ok=False)
+        else:
+            self.log_info("PASS => collection [%s] data data comparison exactly equals" % coll,
+                          event="collection", ns=self.scope, ok=True)
+        after = time.time()
+        self.log_info("collection load and comparison runtime: {}, avg time: {}".format(after - before,
+                                                                                        self.process_time / max(self.task_count, 1)))
+
+    def log_divergence(self, state):
+        """
+        sample模式按本次抽样比对的文档数与差异数估算差异率的置信区间
+        """
+        if self.configure[COMPARISION_MODE] != MODE_SAMPLE or state.docs == 0:
+            return
+        confidence = self.configure.get(SAMPLE_CONFIDENCE, 0.95)
+        self.log_info("SAMPLE => collection [{}] {}".format(
+            state.coll, divergence_summary(state.diffs, state.docs, state.size, confidence)),
+            event="sample", ns=self.scope, sampled=state.docs, divergent=state.diffs, confidence=confidence)
 
     async def data_load_compare(self, coll_name, dst_coll, src_coll, mode):
-        samples = self.configure.get(COMPARISION_SAMPLES, [])
-        if mode == "sample":
-            sample_count = len(samples)
-            count = sample_count \
-                if sample_count <= self.dst_doc_count \
-                else self.dst_doc_count
-        else:
-            count = self.dst_doc_count
+        directory = self.coll_file_path.format(coll_name, self.file_start, self.file_end)
+        if not os.path.exists(directory):
+            self.log_error("ERROR => No such log or directory: {}".format(directory))
+            return False
+
+        start0 = time.time()
+        src_docs = SnapshotReader(directory)
+        end0 = time.time()
+        self.log_info("load file time: {}, src docs count: {}".format(end0 - start0, len(src_docs)))
+        try:
+            if src_docs.digest_tag != self.digest_engine.tag:
+                self.log_error("ERROR => snapshot digest {} does not match configured digest {}".format(
+                    src_docs.digest_tag, self.digest_engine.tag))
+                return False
+            if mode in (MODE_FULL, MODE_MERKLE):
+                return await self.snapshot_comparison(SnapshotDigestSource(src_docs), dst_coll, mode)
+            return await self.sample_load_compare(coll_name, src_docs, dst_coll, src_coll)
+        finally:
+            src_docs.close()
+
+    async def sample_load_compare(self, coll_name, src_docs, dst_coll, src_coll):
+        # 使用period 1写入快照时抽取的_id
+        samples, count = await plan_samples(self.configure, self.sample_file_path(coll_name), src_coll, None,
+                                            self.dst_doc_count, True, self.log_info)
 
         if count == 0:
             return True
 
-        self.total_count = count
+        self.total_count += count
         self.log_info("Process Count: {}".format(count))
 
         batch = self.configure.get('query_batch', 20)
 
-        src_docs = {}
-        directory = self.coll_file_path.format(coll_name, self.file_start, self.file_end)
-        if not os.path.exists(directory):
-            self.log_error("ERROR => No such log or directory: {}".format(directory))
-            return False
+        units = ((src_docs, dst_coll, src_coll, values, start_idx)
+                 for start_idx, values in iter_sample_batches(samples, count, batch)
+                 if not self.resume_unit("b:{}".format(start_idx)))
+        await self.run_units(units, self.compare_sample_document)
 
-        start0 = time.time()
-        with open(directory, "r", encoding='UTF-8') as c_f:
-            l = c_f.read()
-            l = l.replace("}{", ",")
-            src_docs.update(ast.literal_eval(l.strip()))
-        end0 = time.time()
-        self.log_info("load file time: {}, src docs count: {}".format(end0 - start0, len(src_docs)))
+        return self.process_document_res
 
-        tasks = []
-        start_idx = 0
-        samples = [int(x) for x in samples]
-        while count > 0:
-            end_idx = start_idx + batch if batch < count else start_idx + count
-            values = samples[start_idx: end_idx]
-            tasks.append(self.compare_sample_document(src_docs, dst_coll, src_coll, values, start_idx))
-            count -= batch
-            start_idx = end_idx
-
-        self.tasks = tasks
-        self.task_count = len(tasks)
-        self.log_info("create tasks count: {}".format(len(tasks)))
-
-        sub_tasks = []
-        max_task_count = self.configure['task_count']
-        for i in range(max_task_count):
-            sub_tasks.append(asyncio.create_task(self.sub_future(i)))
-
-        await asyncio.gather(*sub_tasks)
+    async def snapshot_comparison(self, snapshot, dst_coll, mode):
+        """
+        src全量摘要文件与dst按_id区间比对, merkle模式先比较区间指纹, full模式直接逐文档比对
+        """
+        if len(snapshot) == 0 and self.dst_doc_count == 0:
+            return True
 
+        self.total_count += max(len(snapshot), self.dst_doc_count)
+        self.log_info("Process Count: {}, dst count: {}".format(len(snapshot), self.dst_doc_count))
+
+        dst_source = CollectionDigestSource(dst_coll, self.digest_engine, self.configure.get('query_batch', 20),
+                                            self.hasher)
+        verifier = merkle_verifier(self.configure, snapshot, dst_source, fingerprints=mode == MODE_MERKLE)
+
+        ranges = configured_ranges(self.configure) or self.journal.ranges(self.scope)
+        if ranges is None:
+            ranges = snapshot.ranges(range_count_of(self.configure))
+            self.journal.save_ranges(self.scope, ranges)
+        order = await self.precheck(snapshot, dst_source, ranges)
+
+        units = ((verifier, ranges[range_idx][0], ranges[range_idx][1], range_idx)
+                 for range_idx in order
+                 if not self.resume_unit("r:{}".format(range_idx)))
+        await self.run_units(units, self.process_bucket)
+
+        self.log_info("merkle buckets compared: {}, leaf ranges compared: {}".format(
+            verifier.bucket_count, verifier.leaf_count))
         return self.process_document_res
 
-    async def sub_future(self, index):
-        print("[{}] tasks: {}".format(index, len(self.tasks)))
-        while len(self.tasks) > 0:
-            await asyncio.create_task(self.tasks.pop())
-            print("[{}] tasks: {}".format(index, len(self.tasks)))
+    async def precheck(self, src, dst, ranges):
+        return await precheck_order(self, src, dst, ranges)
+
+    def sample_file_path(self, coll_name):
+        # 抽样策略抽取的_id与快照放在一起, period 2按同一批_id比对
+        return self.coll_file_path.format(coll_name, self.file_start, self.file_end) + SAMPLE_INDEX_SUFFIX
+
+    def resume_unit(self, unit):
+        """
+        续跑时跳过已完成的批次/区间, 并计入其进度与结果
+        """
+        record = self.journal.get(self.scope, unit)
+        if record is None:
+            return False
+        self.process_count += record.get('docs', 0)
+        if not record['ok']:
+            self.process_document_res = False
+        return True
+
+    def finish_unit(self, unit, doc_count):
+        self.journal.mark(self.scope, unit, ok=unit_result.get()['ok'], docs=doc_count)
+
+    def fail_unit(self, start_idx, doc_count):
+        """
+        拉取失败的批次整体记为不一致, 续跑时不再重试
+        """
+        self.process_document_res = False
+        self.journal.mark(self.scope, "b:{}".format(start_idx), ok=False, docs=doc_count)
+        return False
+
+    def fail_range(self, range_idx, lower, upper, doc_count, error):
+        """
+        读取失败的区间整体记为不一致, 续跑时不再重试, 不影响其他区间继续比对
+        """
+        unit_result.get()['ok'] = False
+        self.process_document_res = False
+        self.log_error("[{}] process range [{}, {}) failed! msg: {}".format(range_idx, lower, upper, error))
+        self.journal.mark(self.scope, "r:{}".format(range_idx), ok=False, docs=doc_count)
+        return False
+
+    def observe_latency(self, latency):
+        if self.limiter is not None:
+            self.limiter.observe(latency)
+
+    async def run_units(self, units, handler):
+        self.log_info("start tasks, concurrency: {}".format(self.configure['task_count']))
+        if self.budget is not None:
+            task_count = await consume_units(units, handler, self.budget.maximum, budget=self.budget)
+        else:
+            task_count = await consume_units(units, handler, task_count_of(self.configure), self.limiter)
+        self.task_count += task_count
+        self.log_info("finished tasks count: {}".format(task_count))
+
+    async def process_bucket(self, verifier, lower, upper, range_idx):
+        """
+        分层指纹校验一个_id区间, 仅对指纹不一致的子区间逐文档比对
+        """
+        process_id.set(range_idx)
+        unit_result.set({"ok": True})
+        start = time.time()
+
+        try:
+            doc_count = await verifier.verify(lower, upper, self.log_diff)
+        except Exception as e:
+            return self.fail_range(range_idx, lower, upper, 0, e)
+
+        end = time.time()
+        self.log.observe("unit", end - start)
+        self.log_debug("[{}] verify range [{}, {}) {} docs total time :{}".format(
+            range_idx, lower, upper, doc_count, end - start),
+            event="unit", unit=range_idx, docs=doc_count, seconds=end - start)
+        self.finish_unit("r:{}".format(range_idx), doc_count)
+        self.process_time += end - start
+        self.log_progress(doc_count)
+        return True
+
+    def log_diff(self, kind, doc_id):
+        if kind == DIFF_CHANGED:
+            self.log_error("DIFF => _id: {}".format(doc_id), event="diff", ns=self.scope, id=doc_id, kind=kind)
+        else:
+            self.log_error("DIFF => _id: {} {}".format(doc_id, kind), event="diff", ns=self.scope, id=doc_id,
+                           kind=kind)
+        self.log.incr("diffs")
+        self.diff_report.add(self.scope, kind, doc_id)
+        count_collection(diffs=1)
+        self.process_document_res = False
+        unit_result.get()['ok'] = False
+
+    async def report_diffs(self, src_coll, dst_coll):
+        """
+        摘要比对结束后只拉取差异文档, 字段级差异写入JSONL报告
+        """
+        try:
+            count, dropped = await self.diff_report.run(self.scope, src_coll, dst_coll, self.digest_engine.rule)
+        except Exception as e:
+            self.log_error("DIFF REPORT => fetch diff documents failed, msg: {}".format(e))
+            return
+        if count:
+            self.log_info("DIFF REPORT => {} documents written to {}".format(count, self.diff_report.path))
+        if dropped:
+            self.log_error("DIFF REPORT => {} diffs over diff_limit not fetched".format(dropped))
 
     async def compare_sample_document(self, src_docs, dst_coll, src_coll, values, start_idx):
         process_id.set(start_idx)
+        unit_result.set({"ok": True})
 
         start3 = time.time()
-        dst_cursor = dst_coll.find({"_id": {"$in": values}})
+        dst_cursor = self.digest_engine.find(dst_coll, {"_id": {"$in": values}})
         dst_docs = {}
-        while dst_cursor.alive:
-            migrated = await dst_cursor.next()
-            migrated_md5 = hashlib.md5(
-                str(migrated).replace(': ', ':').replace(', ', ',').encode('utf - 8')).hexdigest()
-            dst_docs[migrated['_id']] = migrated_md5
+        try:
+            docs = await fetch_docs(dst_cursor, len(values))
+        except Exception as e:
+            self.log_error("[{}] dst find failed! values: {}, msg: {}".format(start_idx, len(values), e))
+            return self.fail_unit(start_idx, len(values))
         end3 = time.time()
+        self.observe_latency(end3 - start3)
+        self.log.observe("dst_fetch", end3 - start3)
+        dst_docs.update(await self.hasher.digests(self.digest_engine, docs))
+        self.log.observe("hash", time.time() - end3)
+
+        # 整批_id排序后在快照中顺序查找
+        src_digests = dict((id, doc_digest) for id, doc_digest in zip(values, src_docs.lookup(values))
+                           if doc_digest is not None)
+        not_in_file = list(dst_docs.keys() - src_digests.keys())
+        if not_in_file:
+            # 快照中没有的_id回源src确认
+            self.log_error("[{}] {} not in src_docs".format(process_id.get(), not_in_file))
+            try:
+                doc_res = await fetch_docs(self.digest_engine.find(src_coll, {"_id": {"$in": not_in_file}}),
+                                           len(not_in_file))
+            except Exception as e:
+                self.log_error("[{}] src find failed! values: {}, msg: {}".format(start_idx, len(not_in_file), e))
+                return self.fail_unit(start_idx, len(values))
+            src_digests.update(await self.hasher.digests(self.digest_engine, doc_res))
 
-        for id, dst_md5 in dst_docs.items():
-            doc_md5 = src_docs.get(str(id), 0)
-            if doc_md5 == 0:
-                self.log_error("[{}] {} not in src_docs".format(process_id.get(), id))
-                doc_res = await src_coll.find_one({"_id": id})
-                doc_md5 = hashlib.md5(
-                    str(doc_res).replace(': ', ':').replace(', ', ',').encode('utf - 8')).hexdigest()
-
-            is_diff = doc_md5 != dst_md5
-            if is_diff:
-                self.log_error("DIFF => _id: {}".format(id))
-                self.process_document_res = False
+        start5 = time.time()
+        for id in src_digests.keys() - dst_docs.keys():
+            self.log_diff(DIFF_MISSING_DST, id)
+        for id in dst_docs.keys() - src_digests.keys():
+            self.log_diff(DIFF_MISSING_SRC, id)
+        for id in dst_docs.keys() & src_digests.keys():
+            if src_digests[id] != dst_docs[id]:
+                self.log_diff(DIFF_CHANGED, id)
 
         end6 = time.time()
-        self.log_info(
+        self.log.observe("compare", end6 - start5)
+        self.log.observe("unit", end6 - start3)
+        self.log_debug(
             "[{}] process {} docs total time :{}, get dst data time :{}".format(
                 process_id.get(), len(values), end6 - start3,
-                end3 - start3))
+                end3 - start3),
+            event="unit", unit=start_idx, docs=len(values), seconds=end6 - start3)
+        self.finish_unit("b:{}".format(start_idx), len(values))
         self.process_time += end6 - start3
-        self.process_count += len(values)
-        self.log_info("-------------------------Process Progress: {}/{}----------------------------".format(
-            self.process_count, self.total_count))
+        self.log_progress(len(values))
 
         return True
 
+    def cluster(self, side, url):
+        """
+        按connection_profiles中side的配置创建连接, 获取连接的等待耗时记入指标<side>_pool_wait
+        """
+        return open_cluster(url, client_options(self.configure, side),
+                                 lambda wait: self.log.observe("{}_pool_wait".format(side), wait))
+
+    def log_pool_wait(self):
+        for side, cluster in (("src", self.src), ("dst", self.dst)):
+            if cluster is not None:
+                self.log_info("POOL WAIT => {} {}".format(side, cluster.pool_listener.summary()))
+
     async def do_load_compare(self):
         start = time.time()
+        self.log = LogSink.from_configure(self.configure, self.log_file_path, self.error_log_file_path,
+                                          self.event_file_path, self.metrics_file_path)
         src_url, dst_url = self.configure["src_url"], self.configure["dst_url"]
 
         if len(src_url) == 0 or len(dst_url) == 0:
             return False
 
-        if not src_url.startswith('mongodb:') or not dst_url.startswith('mongodb:'):
+        if not src_url.startswith(('mongodb:', DUMP_PREFIX)) or not dst_url.startswith(('mongodb:', DUMP_PREFIX)):
             self.log_error("ERROR => invalid mongodb url")
         try:
-            self.src, self.dst = AsyncMongoCluster(src_url), AsyncMongoCluster(dst_url)
+            self.src, self.dst = self.cluster("src", src_url), self.cluster("dst", dst_url)
             self.src.connect()
             self.dst.connect()
         except Exception as e:
             self.log_error("create mongo connection failed {}, msg: {}" .format(dst_url, e))
 
-        os.makedirs(os.path.dirname(self.log_file_path), exist_ok=True)
-        self.log = open(self.log_file_path, "a+")
+        self.journal = open_journal(self.journal_file_path, self.configure)
+        self.hasher = DigestExecutor.from_configure(self.configure)
         self.log_info("============================================")
         self.log_info("Configuration %s" % self.configure)
+        if self.digest_engine.server:
+            self.log_error(SERVER_DIGEST_WARNING)
+        if len(self.journal):
+            self.log_info("RESUME => {} finished units loaded from {}".format(len(self.journal), self.journal_file_path))
 
         # 开始对比
         result = await self.load_and_compare()
         end = time.time()
+        self.log_pool_wait()
         self.log_info("runtime {}s".format(end - start))
         if result:
             self.log_info("SUCCESS")
         else:
             self.log_error("FAIL")
+        return result
 
     def quit(self):
+        if self.journal:
+            self.journal.close()
+        self.diff_report.close()
         self.src.close()
         self.dst.close()
-        self.log.close()
-        if self.error_log:
-            self.error_log.close()
+        if self.hasher:
+            self.hasher.close()
+        if self.log:
+            self.log.close()
 
 
 async def compare(configure):
     cmp = AsyncDbCompare(configure)
-    await cmp.do_compare()
-    cmp.quit()
+    try:
+        result = await cmp.do_compare()
+    finally:
+        cmp.quit()
+    return {"result": bool(result), "process_count": cmp.process_count}
     # input("Press Any Key...")
 
 
 async def write(configure):
     w = AsyncDbWrite(configure)
-    await w.do_write()
-    w.quit()
+    try:
+        result = await w.do_write()
+    finally:
+        w.quit()
+    return {"result": bool(result), "process_count": w.process_count}
     # input("Press Any Key...")
 
 
 async def load_and_compare(configure):
     l = AsyncDbLoadCompare(configure)
-    await l.do_load_compare()
-    l.quit()
+    try:
+        result = await l.do_load_compare()
+    finally:
+        l.quit()
+    return {"result": bool(result), "process_count": l.process_count}
     # input("Press Any Key...")
 
 
+def job_runner(job):
+    """
+    分布式worker按coordinator下发的mode/period选择runner
+    """
+    if job["mode"] == 1:
+        return compare
+    return write if job["period"] == 1 else load_and_compare
+
+
+class ParallelRunner:
+    """
+    多进程比对: sample模式按_id文件下标切分, full/merkle模式按_id区间切分, 由workers个进程动态领取分片执行并汇总结果
+    配置了coordinator时不启动本地进程, 分片按租约分发给各主机上加入的worker
+    """
+    def __init__(self, configure, mode, period):
+        self.configure = configure
+        self.mode = mode
+        self.period = period
+        self.workers = configure.get(WORKERS, 1)
+        self.digest_engine = DigestEngine.from_configure(configure)
+        if mode == 1:
+            self.runner, export = compare, 'cmp_export'
+        elif period == 1:
+            self.runner, export = write, 'write_export'
+        else:
+            self.runner, export = load_and_compare, 'load_export'
+        suffix = export_suffix(configure)
+        self.coll_file_path = _base_dir + '\\write_export\\{}_{}_{}.snap'
+        self.log_file_path = _base_dir + '\\{}\\workers_log_{}.txt'.format(export, suffix)
+        self.journal_file_path = _base_dir + '\\{}\\workers_journal_{}.txt'.format(export, suffix)
+        self.event_file_path = _base_dir + '\\{}\\workers_events_{}.jsonl'.format(export, suffix)
+        self.metrics_file_path = _base_dir + '\\{}\\workers_metrics_{}.json'.format(export, suffix)
+        self.log = None
+        self.journal = None
+        self.scope = "workers"
+        self.chunk_scopes = {}
+        self.chunk_parts = {}
+        self.failed = []
+        self.process_count = 0
+        self.finished = 0
+        self.chunk_total = 0
+
+    def log_info(self, message, **fields):
+        self.log.info(message, **fields)
+
+    def log_error(self, message, **fields):
+        self.log.error(message, **fields)
+
+    @property
+    def range_mode(self):
+        return self.configure[COMPARISION_MODE] in (MODE_FULL, MODE_MERKLE)
+
+    def snapshot_path(self, coll):
+        return self.coll_file_path.format(coll, self.configure['sample_start_idx'],
+                                          self.configure['sample_start_idx'] + self.configure['sample_count'])
+
+    def collections(self):
+        for db in self.configure[COMPARE_DBS]:
+            for coll in self.configure[COMPARE_COLLS]:
+                yield db, coll
+
+    async def plan_ranges(self):
+        """
+        切分各collection的_id区间, 区间数为range_count或task_count * 8 * workers, 续跑时沿用保存的切分
+        """
+        range_count = self.configure.get(RANGE_COUNT, 0) or task_count_of(self.configure) * 8 * self.workers
+        plans = {}
+        src = None
+        try:
+            for db, coll in self.collections():
+                scope = "{}.{}".format(db, coll)
+                ranges = self.journal.ranges(scope)
+                if ranges is None:
+                    if self.mode == 2 and self.period == 2:
+                        # period 2按src快照文件切分, 文件不存在时由分片报错
+                        ranges = [(None, None)]
+                        if os.path.exists(self.snapshot_path(coll)):
+                            reader = SnapshotReader(self.snapshot_path(coll))
+                            ranges = SnapshotDigestSource(reader).ranges(range_count)
+                            reader.close()
+                    else:
+                        if src is None:
+                            src = open_cluster(self.configure["src_url"], client_options(self.configure, "src"))
+                            src.connect()
+                        src_coll = self.digest_engine.collection(src.conn[db][coll])
+                        ranges = await split_id_ranges(src_coll, range_count)
+                    self.journal.save_ranges(scope, ranges)
+                plans[(db, coll)] = ranges
+        finally:
+            if src is not None:
+                src.close()
+        return plans
+
+    def plan_chunks(self):
+        base = dict(self.configure)
+        base.pop(WORKERS, None)
+        base.pop(COMPARISION_SAMPLES, None)
+        base.pop(METRICS_PORT, None)
+        base.pop(COORDINATOR, None)
+        base.pop(COORDINATOR_TOKEN, None)
+        chunks = []
+        if not self.range_mode:
+            # 分片只记录下标范围, 由worker进程自行流式读取_id文件
+            sample_count = count_samples(self.configure)
+            chunk_size = self.configure.get(WORKER_CHUNK_SIZE, 5000)
+            for offset in range(0, sample_count, chunk_size):
+                chunk = dict(base)
+                chunk['sample_start_idx'] = self.configure['sample_start_idx'] + offset
+                chunk['sample_count'] = min(chunk_size, sample_count - offset)
+                chunks.append(("s:{}".format(chunk['sample_start_idx']), chunk))
+            return chunks
+
+        # 每个分片包含若干连续区间, 分片内由task_count个协程并发处理
+        group = task_count_of(self.configure) * 2
+        for (db, coll), ranges in asyncio.run(self.plan_ranges()).items():
+            for offset in range(0, len(ranges), group):
+                chunk = dict(base)
+                chunk[WORKER_CHUNK] = "w{}".format(len(chunks))
+                chunk[COMPARE_DBS] = [db]
+                chunk[COMPARE_COLLS] = [coll]
+                chunk[ID_RANGES] = [list(r) for r in ranges[offset:offset + group]]
+                name = "r:{}".format(len(chunks))
+                self.chunk_scopes[name] = "{}.{}".format(db, coll)
+                self.chunk_parts[name] = chunk[WORKER_CHUNK]
+                chunks.append((name, chunk))
+        return chunks
+
+    def on_result(self, name, pid, report):
+        # 分布式比对时分片由被接受的租约写入, run前缀以coordinator返回的为准
+        part = report.get('part') or self.chunk_parts.get(name)
+        self.journal.mark(self.scope, name, ok=report['result'], docs=report['process_count'], part=part)
+        self.process_count += report['process_count']
+        if report['result']:
+            self.log_info("[{}] worker {} finished, {} docs".format(name, pid, report['process_count']))
+        else:
+            self.failed.append(name)
+            self.log_error("[{}] worker {} FAIL, {} docs {}".format(name, pid, report['process_count'],
+                                                                 report.get('error', '')))
+        self.finished += 1
+        self.log.incr("chunks")
+        self.log.incr("docs", report['process_count'])
+        self.log_info("-------------------------Process Progress: {}/{} chunks----------------------------".format(
+            self.finished, self.chunk_total), event="progress", done=self.finished, total=self.chunk_total)
+
+    def merge_snapshots(self):
+        """
+        period 1各分片只落盘了run, 全部分片成功后按collection归并为最终快照文件
+        """
+        for db, coll in self.collections():
+            scope = "{}.{}".format(db, coll)
+            names = [name for name, chunk_scope in self.chunk_scopes.items() if chunk_scope == scope]
+            if self.journal.is_done(scope, UNIT_COLLECTION) or any(name in self.failed for name in names):
+                continue
+            start = time.time()
+            digest_tag = DigestEngine.from_configure(self.configure, db, coll).tag
+            # 只归并各分片被接受的那次写入的run
+            records = dict((name, self.journal.get(self.scope, name)) for name in names)
+            parts = dict((name, record.get('part') or self.chunk_parts[name]) for name, record in records.items())
+            writer = SnapshotWriter(self.snapshot_path(coll), digest_tag, self.configure.get(SNAPSHOT_KEY_WIDTH, 32),
+                                    resume=True, parts=list(parts.values()))
+            # 有文档的分片必须有run, 否则(如write_export不是各主机共享的目录)归并出的快照缺少这些文档
+            missing = set(writer.missing_parts([parts[name] for name in names if records[name].get('docs', 0) > 0]))
+            if missing:
+                lost = sorted(name for name in names if parts[name] in missing)
+                self.failed.extend(lost)
+                self.log_error("ERROR => [{}] run files of chunks {} not found in {}, write_export must be shared "
+                               "by coordinator and all workers".format(scope, lost, writer.run_dir))
+                continue
+            count = writer.close()
+            self.journal.mark(scope, UNIT_COLLECTION)
+            self.log_info("write file time: {}, {} src docs count: {}".format(time.time() - start, scope, count))
+
+    def run(self):
+        start = time.time()
+        self.log = LogSink.from_configure(self.configure, self.log_file_path, None, self.event_file_path,
+                                          self.metrics_file_path)
+        self.journal = open_journal(self.journal_file_path, self.configure)
+        self.log_info("==============================================")
+        self.log_info("Workers: {}, Configuration {}".format(
+            self.workers, self.configure))
+
+        chunks = self.plan_chunks()
+        self.chunk_total = len(chunks)
+        if self.mode == 2 and self.period == 1 and self.range_mode and not self.configure.get(RESUME, False):
+            for _, coll in self.collections():
+                shutil.rmtree(self.snapshot_path(coll) + '.runs', ignore_errors=True)
+
+        tasks = []
+        for name, chunk in chunks:
+            record = self.journal.get(self.scope, name)
+            if record is None:
+                tasks.append((name, chunk))
+                continue
+            self.process_count += record.get('docs', 0)
+            self.finished += 1
+            if not record['ok']:
+                self.failed.append(name)
+        self.log_info("create chunks count: {}, resumed: {}".format(len(tasks), len(chunks) - len(tasks)))
+
+        if self.configure.get(COORDINATOR):
+            try:
+                pending = serve_chunks(tasks, self.configure[COORDINATOR], {"mode": self.mode, "period": self.period},
+                                       self.configure.get(LEASE_SECONDS, 60), self.configure.get(COORDINATOR_TOKEN),
+                                       self.on_result, self.log_info, self.log_error)
+            except ValueError as e:
+                self.log_error("ERROR => {}".format(e))
+                return False
+        else:
+            pending = run_workers(self.runner, tasks, self.workers, self.on_result)
+        for name in sorted(pending):
+            self.failed.append(name)
+            self.log_error("[{}] chunk not finished, worker exited".format(name))
+
+        if self.mode == 2 and self.period == 1 and self.range_mode:
+            self.merge_snapshots()
+
+        result = not self.failed
+        self.log_info("runtime {}s, chunks: {}, failed chunks: {}, docs: {}".format(
+            time.time() - start, len(chunks), len(self.failed), self.process_count))
+        if result:
+            self.log_info("SUCCESS")
+        else:
+            self.log_error("FAIL => failed chunks: {}".format(sorted(self.failed)))
+        return result
+
+    def quit(self):
+        if self.journal:
+            self.journal.close()
+        if self.log:
+            self.log.close()
+
+
 def usage():
     print("usage")
     print(
@@ -690,14 +2011,32 @@ def usage():
         '| Like : python3 comparison.py -m 2 -f compare_conf.json -p 1 -i 0 -c 200 -b 20 -t 3')
     print(
         '| Or: python3 comparison.py --mode=2 --cfg_file=compare_conf.json --period=1 --start_idx=0 --count=200 --batch=20 --task_count=3')
+    print(
+        '| Full: python3 comparison.py --mode=1 --cfg_file=compare_conf.json --comparison_mode=full --batch=500 --task_count=8')
+    print(
+        '| Merkle: python3 comparison.py --mode=1 --cfg_file=compare_conf.json --comparison_mode=merkle --task_count=8')
+    print(
+        '| Workers: python3 comparison.py --mode=1 --cfg_file=compare_conf.json --start_idx=0 --count=1000000 --workers=8')
+    print(
+        '| Precheck: python3 comparison.py --mode=1 --cfg_file=compare_conf.json --comparison_mode=full --precheck=only')
+    print(
+        '| Follow: python3 comparison.py --mode=1 --cfg_file=compare_conf.json --comparison_mode=full --follow')
+    print(
+        '| Strategy: python3 comparison.py --mode=1 --cfg_file=compare_conf.json --sample_strategy=random --count=500000')
+    print(
+        '| Coordinator: python3 comparison.py --mode=1 --cfg_file=compare_conf.json --comparison_mode=full --coordinator=0.0.0.0:7600')
+    print(
+        '| Worker: python3 comparison.py --cfg_file=compare_conf.json --join=http://10.0.0.1:7600 --workers=4')
     print(
         '|------------------------------------------------------------------------------------------------------------------|')
     exit(0)
 
 
 if __name__ == '__main__':
+    multiprocessing.freeze_support()
     opts, args = getopt.getopt(sys.argv[1:], "hm:p:f:i:c:b:t:",
-                               ["help", "mode=", 'period=', 'cfg_file=', 'start_idx=', 'count=', 'batch=', 'task_count='])
+                               ["help", "mode=", 'period=', 'cfg_file=', 'start_idx=', 'count=', 'batch=', 'task_count=',
+                                'comparison_mode=', 'resume', 'workers=', 'precheck=', 'follow', 'sample_strategy=', 'coordinator=', 'join='])
 
     cfg_file = "compare_conf.json"
     sample_start_idx = -1
@@ -706,6 +2045,14 @@ if __name__ == '__main__':
     task_count = -1
     mode = 1
     period = -1
+    comparison_mode = ""
+    resume = False
+    workers = 0
+    precheck = ""
+    follow = False
+    sample_strategy = ""
+    coordinator = ""
+    join = ""
     for key, value in opts:
         if key in ("-h", "--help"):
             usage()
@@ -722,7 +2069,32 @@ if __name__ == '__main__':
         if key in ("-b", "--batch"):
             batch = int(value)
         if key in ("-t", "--task_count"):
-            task_count = int(value)
+            task_count = value if value == TASK_COUNT_AUTO else int(value)
+        if key == "--comparison_mode":
+            comparison_mode = value
+        if key == "--resume":
+            resume = True
+        if key == "--workers":
+            workers = int(value)
+        if key == "--precheck":
+            precheck = value
+        if key == "--follow":
+            follow = True
+        if key == "--sample_strategy":
+            sample_strategy = value
+        if key == "--coordinator":
+            coordinator = value
+        if key == "--join":
+            join = value
+
+    if join:
+        # worker主机只需要coordinator地址, 分片配置由coordinator下发; 配置文件存在时读取coordinator_token
+        token = None
+        if os.path.exists(cfg_file):
+            with open(cfg_file, 'r') as cmp_cfg:
+                token = json.load(cmp_cfg).get(COORDINATOR_TOKEN)
+        run_joiners(join, token, job_runner, workers)
+        sys.exit(0)
 
     with open(cfg_file, 'r') as cmp_cfg:
         configure = json.load(cmp_cfg)
@@ -740,27 +2112,52 @@ if __name__ == '__main__':
     if batch > 0:
         configure['query_batch'] = batch
 
-    if task_count > 0:
+    if task_count == TASK_COUNT_AUTO or task_count > 0:
         configure['task_count'] = task_count
 
-    configure["comparison_mode"] = "sample"
-
-    end = sample_start_idx + sample_count
-    sample_list = []
-    with open(configure["sample_file_name"], 'r', encoding='utf-8', errors='ignore') as f:
-        for line in itertools.islice(f, sample_start_idx, end, 1):
-            line = line.strip('\n')
-            sample_list.append(line)
-
-    configure["sample_list"] = sample_list
-    if len(sample_list) != 0:
-        if mode == 1:
+    if resume:
+        configure[RESUME] = True
+
+    if workers > 0:
+        configure[WORKERS] = workers
+
+    if precheck:
+        configure[PRECHECK] = precheck
+
+    if follow:
+        configure[FOLLOW] = True
+
+    if sample_strategy:
+        configure[SAMPLE_STRATEGY] = sample_strategy
+
+    if coordinator:
+        configure[COORDINATOR] = coordinator
+
+    if comparison_mode:
+        configure[COMPARISION_MODE] = comparison_mode
+    configure.setdefault(COMPARISION_MODE, MODE_SAMPLE)
+
+    # sample模式的_id在比对时按批次从_id文件流式读取, 使用抽样策略时由各collection抽取
+    result = False
+    by_strategy = configure[COMPARISION_MODE] == MODE_SAMPLE and \
+        configure.get(SAMPLE_STRATEGY, STRATEGY_FILE) != STRATEGY_FILE
+    if configure[COMPARISION_MODE] != MODE_SAMPLE or by_strategy or os.path.exists(configure["sample_file_name"]):
+        if (configure.get(WORKERS, 0) > 1 or configure.get(COORDINATOR)) and (mode == 1 or period in (1, 2)) \
+                and not configure.get(FOLLOW) and not by_strategy:
+            # 多进程/分布式比对, 分片由各worker进程动态领取
+            parallel = ParallelRunner(configure, mode, period)
+            try:
+                result = parallel.run()
+            finally:
+                parallel.quit()
+        elif mode == 1:
             # 同步对比
-            asyncio.run(compare(configure))
+            result = asyncio.run(compare(configure))["result"]
         elif mode == 2:
             if period == 1:
                 # 写入文件
-                asyncio.run(write(configure))
+                result = asyncio.run(write(configure))["result"]
             elif period == 2:
                 # 加载文件对比
-                asyncio.run(load_and_compare(configure))
+                result = asyncio.run(load_and_compare(configure))["result"]
+    sys.exit(0 if result else 1)
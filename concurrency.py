@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+"""
+Module Description: 并发数自适应, 按批次拉取耗时AIMD调整同时工作的协程数
+Date: 2026/10/18
+Author: HuYuanCheng
+"""
+import asyncio
+
+TASK_COUNT_AUTO = "auto"
+LATENCY_TARGET = "latency_target"
+TASK_COUNT_MAX = "task_count_max"
+
+
+def task_count_of(configure):
+    """
+    固定并发数, auto模式下为初始并发数, 用于区间切分等按并发数估算的场景
+    """
+    task_count = configure['task_count']
+    if task_count == TASK_COUNT_AUTO:
+        return min(4, configure.get(TASK_COUNT_MAX, 32))
+    return task_count
+
+
+class AdaptiveLimiter:
+    """
+    每收集约limit个批次耗时为一个窗口, 中位数不超过latency_target时并发数+1, 超过时乘以decrease, 每个窗口最多调整一次
+    序号不小于当前并发数的消费协程处理完手上的批次后暂停, 并发数增加时恢复
+    """
+    def __init__(self, initial, maximum, target, minimum=1, decrease=0.75, on_change=None):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target = target
+        self.decrease = decrease
+        self.on_change = on_change
+        self.samples = []
+        self.changed = None
+        self.closed = False
+
+    @classmethod
+    def from_configure(cls, configure, on_change=None):
+        """
+        task_count为auto时返回自适应限流器, 否则返回None; latency_target单位为毫秒
+        """
+        if configure['task_count'] != TASK_COUNT_AUTO:
+            return None
+        return cls(task_count_of(configure), configure.get(TASK_COUNT_MAX, 32),
+                   configure.get(LATENCY_TARGET, 200) / 1000.0, on_change=on_change)
+
+    @property
+    def active(self):
+        return int(self.limit)
+
+    async def wait(self, index):
+        while index >= self.active and not self.closed:
+            if self.changed is None:
+                self.changed = asyncio.Event()
+            await self.changed.wait()
+
+    def open(self):
+        self.closed = False
+
+    def close(self):
+        """
+        队列中已没有待处理单元, 唤醒所有暂停的消费协程退出
+        """
+        self.closed = True
+        self._notify()
+
+    def _notify(self):
+        if self.changed is not None:
+            changed, self.changed = self.changed, None
+            changed.set()
+
+    def observe(self, latency):
+        self.samples.append(latency)
+        if len(self.samples) < self.active:
+            return
+        median = sorted(self.samples)[len(self.samples) // 2]
+        self.samples = []
+
+        before = self.active
+        if median > self.target:
+            self.limit = max(self.minimum, self.limit * self.decrease)
+        else:
+            self.limit = min(self.maximum, self.limit + 1)
+        if self.active != before:
+            if self.on_change:
+                self.on_change("CONCURRENCY => {} -> {}, median latency: {:.3f}s".format(before, self.active,
+                                                                                          median))
+            self._notify()
+
+
+class ConcurrencyBudget:
+    """
+    多个collection同时比对时共享的并发预算, 所有collection同时执行的单元数不超过task_count,
+    task_count为auto时上限随限流器的当前并发数调整
+    """
+    def __init__(self, task_count, limiter=None):
+        self.task_count = task_count
+        self.limiter = limiter
+        self.used = 0
+        self.condition = None
+
+    @classmethod
+    def from_configure(cls, configure, limiter=None):
+        return cls(task_count_of(configure), limiter)
+
+    @property
+    def maximum(self):
+        return self.limiter.maximum if self.limiter is not None else self.task_count
+
+    @property
+    def capacity(self):
+        return self.limiter.active if self.limiter is not None else self.task_count
+
+    async def __aenter__(self):
+        if self.condition is None:
+            self.condition = asyncio.Condition()
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.used < self.capacity)
+            self.used += 1
+
+    async def __aexit__(self, *exc):
+        async with self.condition:
+            self.used -= 1
+            self.condition.notify_all()
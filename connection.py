@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+"""
+Module Description: 连接配置, 按src/dst读取连接参数(连接池、读偏好、压缩、超时), 并统计从连接池获取连接的等待耗时
+Date: 2026/10/18
+Author: HuYuanCheng
+"""
+import threading
+import time
+
+from pymongo import monitoring
+
+from concurrency import TASK_COUNT_AUTO, TASK_COUNT_MAX
+
+CONNECTION_PROFILES = "connection_profiles"
+MAX_POOL_SIZE = "maxPoolSize"
+
+# 连接池在并发数之外预留的连接数, 用于切分区间、差异明细等并发之外的查询
+POOL_HEADROOM = 2
+
+
+def pool_size_of(configure):
+    task_count = configure['task_count']
+    if task_count == TASK_COUNT_AUTO:
+        task_count = configure.get(TASK_COUNT_MAX, 32)
+    return task_count + POOL_HEADROOM
+
+
+def client_options(configure, side):
+    """
+    返回side(src/dst)的AsyncIOMotorClient参数, 参数名与pymongo一致, 如readPreference、compressors、
+    connectTimeoutMS、socketTimeoutMS、serverSelectionTimeoutMS、waitQueueTimeoutMS; 未配置maxPoolSize时按并发数推算
+    """
+    options = dict((configure.get(CONNECTION_PROFILES) or {}).get(side) or {})
+    options.setdefault(MAX_POOL_SIZE, pool_size_of(configure))
+    return options
+
+
+class PoolWaitListener(monitoring.ConnectionPoolListener):
+    """
+    统计获取连接的等待耗时: motor在线程池中执行pymongo操作, 同一线程上的开始与取到连接事件即为一次等待
+    on_wait不为None时在取到连接后以等待秒数回调
+    """
+    def __init__(self, on_wait=None):
+        self.on_wait = on_wait
+        self.lock = threading.Lock()
+        self.started = {}
+        self.count = 0
+        self.failed = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def connection_check_out_started(self, event):
+        self.started[threading.get_ident()] = time.monotonic()
+
+    def connection_checked_out(self, event):
+        start = self.started.pop(threading.get_ident(), None)
+        if start is None:
+            return
+        wait = time.monotonic() - start
+        with self.lock:
+            self.count += 1
+            self.total += wait
+            self.max = max(self.max, wait)
+        if self.on_wait is not None:
+            self.on_wait(wait)
+
+    def connection_check_out_failed(self, event):
+        self.started.pop(threading.get_ident(), None)
+        with self.lock:
+            self.failed += 1
+
+    def summary(self):
+        with self.lock:
+            return "checkouts: {}, avg wait: {:.3f}ms, max wait: {:.3f}ms, failed: {}".format(
+                self.count, self.total / max(self.count, 1) * 1000, self.max * 1000, self.failed)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        pass
+
+    def connection_checked_in(self, event):
+        pass
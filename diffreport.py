@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+
+"""
+Module Description: 差异明细, 摘要比对确认差异_id后, 只拉取这些文档做字段级比对并输出JSONL报告
+Date: 2026/10/18
+Author: HuYuanCheng
+"""
+import asyncio
+import os
+
+import bson
+from bson import json_util
+
+from follow import doc_key
+from ranges import DIFF_CHANGED, DIFF_MISSING_DST, DIFF_MISSING_SRC
+
+DIFF_LIMIT = "diff_limit"
+
+DIFF_ORDER = "field order"
+DIFF_RESOLVED = "resolved"
+
+
+def to_dict(doc):
+    if doc is None or isinstance(doc, dict):
+        return doc
+    return bson.decode(bytes(doc.raw))
+
+
+def field_diff(src, dst, path=""):
+    """
+    递归比较两个文档, 返回字段级差异列表, 数组按下标比较
+    """
+    diffs = []
+    if isinstance(src, dict) and isinstance(dst, dict):
+        for key, value in src.items():
+            sub_path = "{}.{}".format(path, key) if path else key
+            if key not in dst:
+                diffs.append({"path": sub_path, "kind": DIFF_MISSING_DST, "src": value})
+            else:
+                diffs.extend(field_diff(value, dst[key], sub_path))
+        for key in dst.keys() - src.keys():
+            sub_path = "{}.{}".format(path, key) if path else key
+            diffs.append({"path": sub_path, "kind": DIFF_MISSING_SRC, "dst": dst[key]})
+        if not diffs and list(src) != list(dst):
+            diffs.append({"path": path, "kind": DIFF_ORDER, "src": list(src), "dst": list(dst)})
+    elif isinstance(src, list) and isinstance(dst, list):
+        for i in range(max(len(src), len(dst))):
+            sub_path = "{}.{}".format(path, i)
+            if i >= len(dst):
+                diffs.append({"path": sub_path, "kind": DIFF_MISSING_DST, "src": src[i]})
+            elif i >= len(src):
+                diffs.append({"path": sub_path, "kind": DIFF_MISSING_SRC, "dst": dst[i]})
+            else:
+                diffs.extend(field_diff(src[i], dst[i], sub_path))
+    elif type(src) is not type(dst) or src != dst:
+        diffs.append({"path": path, "kind": DIFF_CHANGED, "src": src, "dst": dst})
+    return diffs
+
+
+class DiffReport:
+    """
+    按collection收集摘要阶段的差异_id(每个collection最多limit个), collection比对结束后按batch分批拉取两端文档, 字段级比对写入JSONL
+    每行: {"ns": "db.coll", "_id": ..., "digest": 摘要阶段差异类型, "kind": 拉取后差异类型, "fields": [...]}
+    """
+    def __init__(self, path, limit=10000, batch=100):
+        self.path = path
+        self.limit = limit
+        self.batch = max(batch, 1)
+        self.pending = {}
+        self.dropped = {}
+        self.file = None
+
+    def add(self, scope, kind, doc_id):
+        pending = self.pending.setdefault(scope, [])
+        if len(pending) < self.limit:
+            pending.append((kind, doc_id))
+        else:
+            self.dropped[scope] = self.dropped.get(scope, 0) + 1
+
+    async def fetch(self, coll, ids, rule=None):
+        projection = rule.projection if rule is not None else None
+        docs = await coll.find({"_id": {"$in": ids}}, projection).to_list(length=len(ids))
+        docs = [to_dict(doc) for doc in docs]
+        if rule is not None and rule.normalizing:
+            docs = [rule.normalize(doc) for doc in docs]
+        # 文档类型的_id不可哈希, 按doc_key建立映射
+        return {doc_key(doc['_id']): doc for doc in docs}
+
+    async def run(self, scope, src_coll, dst_coll, rule=None):
+        """
+        拉取并比对已收集的差异文档, 与摘要阶段使用相同的collection规则, 返回(写入条数, 超出limit未拉取的条数)
+        """
+        pending, dropped = self.pending.pop(scope, []), self.dropped.pop(scope, 0)
+        if not pending:
+            return 0, dropped
+        if self.file is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.file = open(self.path, 'a+', encoding='utf-8')
+
+        for start in range(0, len(pending), self.batch):
+            chunk = pending[start:start + self.batch]
+            ids = [doc_id for _, doc_id in chunk]
+            src_docs, dst_docs = await asyncio.gather(self.fetch(src_coll, ids, rule), self.fetch(dst_coll, ids, rule))
+            for digest_kind, doc_id in chunk:
+                src, dst = src_docs.get(doc_key(doc_id)), dst_docs.get(doc_key(doc_id))
+                record = {"ns": scope, "_id": doc_id, "digest": digest_kind}
+                if src is None and dst is None:
+                    record["kind"] = DIFF_RESOLVED
+                elif dst is None:
+                    record.update(kind=DIFF_MISSING_DST, src=src)
+                elif src is None:
+                    record.update(kind=DIFF_MISSING_SRC, dst=dst)
+                else:
+                    fields = field_diff(src, dst)
+                    record.update(kind=DIFF_CHANGED if fields else DIFF_RESOLVED, fields=fields)
+                self.file.write(json_util.dumps(record) + '\n')
+            self.file.flush()
+        return len(pending), dropped
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
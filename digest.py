@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+
+"""
+Module Description: 文档摘要计算, 直接对原始BSON字节计算摘要, 避免解码为dict
+Date: 2026/10/18
+Author: HuYuanCheng
+"""
+import hashlib
+import struct
+
+import bson
+from bson.codec_options import CodecOptions
+from bson.objectid import ObjectId
+from bson.raw_bson import RawBSONDocument
+
+from rules import CollectionRule
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+DIGEST_ALGO = "digest_algo"
+DIGEST_CANONICAL = "digest_canonical"
+DIGEST_LOCATION = "digest_location"
+
+LOCATION_CLIENT = "client"
+LOCATION_SERVER = "server"
+
+ALGO_MD5_STR = "md5_str"
+ALGO_MD5 = "md5"
+ALGO_BLAKE2B = "blake2b"
+ALGO_XXH3 = "xxh3"
+
+DIGEST_SIZE = 16
+
+RAW_CODEC_OPTIONS = CodecOptions(document_class=RawBSONDocument)
+
+_INT32 = struct.Struct('<i')
+_INT64 = struct.Struct('<q')
+_DIGEST_PAIR = struct.Struct('<qq')
+
+# 服务端摘要: hashed索引使用的64位哈希 + 文档BSON字节数, 只有_id和摘要返回客户端
+# hashed索引的哈希对数值先截断为64位整数再计算, int/long/double值相等时哈希相同, 因此服务端摘要是有损的:
+# double只改动小数部分(如2.3改为2.9)或long与double互换(BSON长度同为8字节)时摘要不变, 比对不会报出差异
+SERVER_DIGEST_PROJECTION = {
+    "_id": 1,
+    "h": {"$toHashedIndexKey": "$$ROOT"},
+    "n": {"$bsonSize": "$$ROOT"},
+}
+
+# 区间指纹: 文档数 + 摘要两个64位分量各自的和, 服务端用Decimal128累加避免溢出
+SERVER_FINGERPRINT_GROUP = {
+    "_id": None,
+    "c": {"$sum": 1},
+    "h": {"$sum": {"$toDecimal": {"$toHashedIndexKey": "$$ROOT"}}},
+    "n": {"$sum": {"$toLong": {"$bsonSize": "$$ROOT"}}},
+}
+
+EMPTY_FINGERPRINT = (0, 0, 0)
+
+SERVER_DIGEST_WARNING = "WARNING => digest_location server is lossy: double fraction changes and long/double " \
+                        "type changes with equal value are not detected, use digest_location client for exact compare"
+
+
+def raw_id(raw):
+    """
+    从原始BSON字节中读取_id, _id为首个字段且为常见类型时不解码整个文档
+    """
+    if raw[4:9] == b'\x07_id\x00':
+        return ObjectId(bytes(raw[9:21]))
+    if raw[4:9] == b'\x12_id\x00':
+        return _INT64.unpack_from(raw, 9)[0]
+    if raw[4:9] == b'\x10_id\x00':
+        return _INT32.unpack_from(raw, 9)[0]
+    if raw[4:9] == b'\x02_id\x00':
+        size = _INT32.unpack_from(raw, 9)[0]
+        return bytes(raw[13:13 + size - 1]).decode('utf-8')
+    return bson.decode(bytes(raw))['_id']
+
+
+def _sort_keys(value):
+    if isinstance(value, dict):
+        return {k: _sort_keys(value[k]) for k in sorted(value)}
+    if isinstance(value, list):
+        return [_sort_keys(v) for v in value]
+    return value
+
+
+def canonical_bson(raw):
+    """
+    字段按key排序后重新编码, 使摘要与字段顺序无关
+    """
+    return bson.encode(_sort_keys(bson.decode(bytes(raw))))
+
+
+class DigestEngine:
+    """
+    可选摘要算法的文档摘要计算, 摘要统一为DIGEST_SIZE字节的二进制
+    md5_str为旧版str(doc)的md5, 需要解码后的dict文档, 仅用于兼容旧数据
+    location为server时由服务端聚合计算摘要($toHashedIndexKey + $bsonSize, 需要mongodb 4.4+), 算法配置不生效,
+    摘要有损, 见SERVER_DIGEST_WARNING
+    rule为collection的投影/规范化规则, 投影下推到查询; 需要规范化时服务端无法计算, 强制在本地计算摘要
+    """
+    def __init__(self, algo=ALGO_BLAKE2B, canonical=False, location=LOCATION_CLIENT, rule=None):
+        if algo not in (ALGO_MD5_STR, ALGO_MD5, ALGO_BLAKE2B, ALGO_XXH3):
+            raise ValueError("unsupported digest algorithm: {}".format(algo))
+        if algo == ALGO_XXH3 and xxhash is None:
+            raise ValueError("digest algorithm xxh3 requires the xxhash package")
+        if location not in (LOCATION_CLIENT, LOCATION_SERVER):
+            raise ValueError("unsupported digest location: {}".format(location))
+        if location == LOCATION_SERVER and canonical:
+            raise ValueError("canonical digest is not supported with server digest location")
+        if rule is not None and rule.normalizing:
+            location = LOCATION_CLIENT
+        self.algo = algo
+        self.canonical = canonical
+        self.location = location
+        self.rule = rule
+
+    @classmethod
+    def from_configure(cls, configure, db=None, coll=None):
+        rule = CollectionRule.from_configure(configure, db, coll) if coll else None
+        return cls(configure.get(DIGEST_ALGO, ALGO_BLAKE2B), configure.get(DIGEST_CANONICAL, False),
+                   configure.get(DIGEST_LOCATION, LOCATION_CLIENT), rule)
+
+    @property
+    def projection(self):
+        return self.rule.projection if self.rule is not None else None
+
+    @property
+    def server(self):
+        return self.location == LOCATION_SERVER
+
+    @property
+    def tag(self):
+        """
+        摘要计算方式标识, 写入快照文件头用于校验两个阶段配置一致
+        """
+        tag = LOCATION_SERVER if self.server else self.algo + ('+c' if self.canonical else '')
+        if self.rule is not None:
+            tag += '#' + self.rule.tag
+        return tag
+
+    @property
+    def raw(self):
+        return self.server or self.algo != ALGO_MD5_STR
+
+    def collection(self, coll):
+        """
+        返回按原始BSON读取的collection, 文档不再解码为dict
+        """
+        if not self.raw:
+            return coll
+        return coll.with_options(codec_options=RAW_CODEC_OPTIONS)
+
+    def find(self, coll, query, sort=False):
+        """
+        返回计算摘要所需的游标, 服务端摘要模式下只返回_id与摘要
+        """
+        if self.server:
+            pipeline = [{"$match": query}]
+            if sort:
+                pipeline.append({"$sort": {"_id": 1}})
+            if self.projection:
+                pipeline.append({"$project": self.projection})
+            pipeline.append({"$project": SERVER_DIGEST_PROJECTION})
+            return coll.aggregate(pipeline)
+        cursor = coll.find(query, self.projection)
+        if sort:
+            cursor = cursor.sort("_id", 1)
+        return cursor
+
+    def fingerprint_pipeline(self, query):
+        pipeline = [{"$match": query}]
+        if self.projection:
+            pipeline.append({"$project": self.projection})
+        pipeline.append({"$group": SERVER_FINGERPRINT_GROUP})
+        return pipeline
+
+    @staticmethod
+    def fingerprint_from_server(doc):
+        return doc['c'], int(doc['h'].to_decimal()), doc['n']
+
+    @staticmethod
+    def fold(digests):
+        """
+        将一组摘要合并为与顺序无关的区间指纹(count, sum_h, sum_n), 与服务端指纹计算方式一致
+        """
+        count = sum_h = sum_n = 0
+        for digest in digests:
+            h, n = _DIGEST_PAIR.unpack(digest)
+            count += 1
+            sum_h += h
+            sum_n += n
+        return count, sum_h, sum_n
+
+    def hash_bytes(self, data):
+        if self.algo == ALGO_BLAKE2B:
+            return hashlib.blake2b(data, digest_size=DIGEST_SIZE).digest()
+        if self.algo == ALGO_XXH3:
+            return xxhash.xxh3_128_digest(data)
+        return hashlib.md5(data).digest()
+
+    def digest_raw(self, raw):
+        if self.rule is not None and self.rule.normalizing:
+            doc = self.rule.normalize(bson.decode(bytes(raw)))
+            raw = bson.encode(_sort_keys(doc) if self.canonical else doc)
+        elif self.canonical:
+            raw = canonical_bson(raw)
+        return self.hash_bytes(raw)
+
+    def digest(self, doc):
+        if self.server:
+            return _DIGEST_PAIR.pack(doc['h'], doc['n'])
+        if not self.raw:
+            if self.rule is not None and self.rule.normalizing:
+                doc = self.rule.normalize(doc)
+            return self.hash_bytes(str(doc).replace(': ', ':').replace(', ', ',').encode('utf - 8'))
+        return self.digest_raw(doc.raw)
+
+    def doc_id(self, doc):
+        if not self.raw:
+            return doc['_id']
+        return raw_id(doc.raw)
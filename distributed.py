@@ -0,0 +1,347 @@
+# -*- coding: utf-8 -*-
+
+"""
+Module Description: 跨主机分布式比对, coordinator持有分片计划, 通过HTTP按租约把分片分发给各主机的worker并汇总结果
+Date: 2026/10/18
+Author: HuYuanCheng
+"""
+import asyncio
+import collections
+import hmac
+import ipaddress
+import itertools
+import multiprocessing
+import os
+import queue
+import socket
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from bson import json_util
+
+from workers import WORKER_CHUNK
+
+COORDINATOR = "coordinator"
+COORDINATOR_TOKEN = "coordinator_token"
+LEASE_SECONDS = "lease_seconds"
+
+TOKEN_HEADER = "X-Coordinator-Token"
+# 同一分片租约到期(worker退出或失联)的最大次数, 超过后记为未完成
+LEASE_ATTEMPTS = 3
+POLL_INTERVAL = 1
+# worker连不上coordinator时的重试次数, 每次间隔POLL_INTERVAL秒
+JOIN_RETRIES = 30
+
+
+def parse_address(address):
+    """
+    host:port, 省略host时监听所有地址
+    """
+    host, _, port = address.rpartition(':')
+    return host or '0.0.0.0', int(port)
+
+
+def is_loopback(host):
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+class LeaseTable:
+    """
+    分片租约: queue为待领取的分片, leases为租约id -> [分片名, worker, 到期时间, 租约的run前缀]
+    worker处理期间定期续约; 到期未续约的分片放回队首由其他worker领取, 只接受有效租约提交的结果
+    """
+    def __init__(self, chunks, lease_seconds, attempts=LEASE_ATTEMPTS):
+        self.chunks = dict(chunks)
+        self.queue = collections.deque(name for name, _ in chunks)
+        self.leases = {}
+        self.finished = set()
+        self.expired = collections.Counter()
+        self.lease_seconds = lease_seconds
+        self.attempts = attempts
+        self.seq = itertools.count(1)
+        self.lock = threading.Lock()
+
+    @property
+    def done(self):
+        with self.lock:
+            return not self.queue and not self.leases
+
+    def lease(self, worker, now=None):
+        """
+        领取下一个分片, 返回(租约id, 分片名, 分片配置); 没有待领取的分片时返回None
+        """
+        now = time.time() if now is None else now
+        with self.lock:
+            while self.queue:
+                name = self.queue.popleft()
+                if name in self.finished:
+                    continue
+                seq = next(self.seq)
+                lease_id = "{}#{}".format(name, seq)
+                configure = dict(self.chunks[name])
+                if configure.get(WORKER_CHUNK) is not None:
+                    # 每个租约使用独立的run前缀, 租约到期后原worker仍在写入时不会与新worker的run互相删除、覆盖
+                    configure[WORKER_CHUNK] = "{}_l{}".format(configure[WORKER_CHUNK], seq)
+                self.leases[lease_id] = [name, worker, now + self.lease_seconds, configure.get(WORKER_CHUNK)]
+                return lease_id, name, configure
+            return None
+
+    def renew(self, lease_id, now=None):
+        now = time.time() if now is None else now
+        with self.lock:
+            lease = self.leases.get(lease_id)
+            if lease is None:
+                return False
+            lease[2] = now + self.lease_seconds
+            return True
+
+    def complete(self, lease_id):
+        """
+        记录租约对应的分片结果, 返回(分片名, 租约的run前缀); 只接受仍然有效的租约,
+        租约已到期回收(分片已重新分发或放弃)时返回None
+        """
+        with self.lock:
+            lease = self.leases.get(lease_id)
+            if lease is None:
+                return None
+            name, part = lease[0], lease[3]
+            self.finished.add(name)
+            for lease_id in [lease_id for lease_id, lease in self.leases.items() if lease[0] == name]:
+                del self.leases[lease_id]
+            if name in self.queue:
+                self.queue.remove(name)
+            return name, part
+
+    def expire(self, now=None):
+        """
+        回收到期的租约, 到期次数未超过attempts时放回队首; 返回[(分片名, worker, 是否重新分发)]
+        """
+        now = time.time() if now is None else now
+        events = []
+        with self.lock:
+            for lease_id, (name, worker, expires, _) in list(self.leases.items()):
+                if expires > now:
+                    continue
+                del self.leases[lease_id]
+                self.expired[name] += 1
+                requeue = self.expired[name] < self.attempts
+                if requeue:
+                    self.queue.appendleft(name)
+                events.append((name, worker, requeue))
+        return events
+
+    def pending(self):
+        with self.lock:
+            return set(self.chunks) - self.finished
+
+    def status(self):
+        with self.lock:
+            return {"queued": len(self.queue), "leased": len(self.leases), "finished": len(self.finished),
+                    "total": len(self.chunks)}
+
+
+def _serve(table, address, job, token, results):
+    class Handler(BaseHTTPRequestHandler):
+        def authorized(self):
+            if not token:
+                return True
+            return hmac.compare_digest(self.headers.get(TOKEN_HEADER, "").encode('utf-8'), token.encode('utf-8'))
+
+        def do_POST(self):
+            if not self.authorized():
+                return self.reply(403, {"error": "invalid coordinator token"})
+            length = int(self.headers.get("Content-Length", 0))
+            body = json_util.loads(self.rfile.read(length).decode('utf-8')) if length else {}
+            if self.path == "/lease":
+                lease = table.lease(body.get("worker", ""))
+                if lease is None:
+                    return self.reply(200, {"name": None, "done": table.done, "wait": POLL_INTERVAL})
+                lease_id, name, configure = lease
+                return self.reply(200, {"name": name, "lease": lease_id, "configure": configure, "job": job,
+                                        "lease_seconds": table.lease_seconds})
+            if self.path == "/renew":
+                return self.reply(200, {"ok": table.renew(body.get("lease"))})
+            if self.path == "/result":
+                accepted = table.complete(body.get("lease"))
+                if accepted is not None:
+                    name, part = accepted
+                    results.put((name, body.get("worker", ""), dict(body["report"], part=part)))
+                return self.reply(200, {"ok": accepted is not None})
+            return self.reply(404, {"error": "unknown path {}".format(self.path)})
+
+        def do_GET(self):
+            if not self.authorized():
+                return self.reply(403, {"error": "invalid coordinator token"})
+            if self.path != "/status":
+                return self.reply(404, {"error": "unknown path {}".format(self.path)})
+            return self.reply(200, table.status())
+
+        def reply(self, code, payload):
+            data = json_util.dumps(payload).encode('utf-8')
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(parse_address(address), Handler)
+    threading.Thread(target=server.serve_forever, name="coordinator-http", daemon=True).start()
+    return server
+
+
+def serve_chunks(chunks, address, job, lease_seconds, token, on_result, log_info, log_error):
+    """
+    在address上按租约分发chunks直到全部完成(或Ctrl+C), 每个分片的结果在调用线程回调on_result(name, worker, report),
+    report['part']为被接受的租约写入run使用的前缀
+    job为worker选择runner的参数, 返回未完成的分片名; 监听非回环地址时必须配置token
+    """
+    if not chunks:
+        return set()
+    host = parse_address(address)[0]
+    if not token and not is_loopback(host):
+        raise ValueError("coordinator_token is required when coordinator listens on non-loopback address {}".format(
+            address))
+    table = LeaseTable(chunks, lease_seconds)
+    results = queue.Queue()
+    server = _serve(table, address, job, token, results)
+    log_info("COORDINATOR => listening on {}:{}, chunks: {}, lease: {}s".format(
+        server.server_address[0], server.server_address[1], len(chunks), lease_seconds))
+    try:
+        while not table.done or not results.empty():
+            for name, worker, requeue in table.expire():
+                if requeue:
+                    log_error("COORDINATOR => [{}] lease of worker {} expired, handed out again".format(name, worker))
+                else:
+                    log_error("COORDINATOR => [{}] lease expired {} times, give up".format(name, table.attempts))
+            try:
+                name, worker, report = results.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                continue
+            on_result(name, worker, report)
+        # 保持片刻, 轮询中的worker收到done后退出
+        time.sleep(POLL_INTERVAL * 2)
+    except KeyboardInterrupt:
+        log_error("COORDINATOR => interrupted, {}".format(table.status()))
+    finally:
+        server.shutdown()
+        server.server_close()
+    return table.pending()
+
+
+def request(url, path, body, token=None, timeout=30):
+    headers = {"Content-Type": "application/json"}
+    if token:
+        headers[TOKEN_HEADER] = token
+    req = urllib.request.Request(url.rstrip('/') + path, data=json_util.dumps(body).encode('utf-8'), headers=headers)
+    with urllib.request.urlopen(req, timeout=timeout) as resp:
+        return json_util.loads(resp.read().decode('utf-8'))
+
+
+class LeaseKeeper:
+    """
+    分片处理期间在后台线程每interval秒续约一次
+    """
+    def __init__(self, url, lease_id, interval, token, log):
+        self.url = url
+        self.lease_id = lease_id
+        self.interval = interval
+        self.token = token
+        self.log = log
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="lease-keeper", daemon=True)
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                if not request(self.url, "/renew", {"lease": self.lease_id}, self.token)["ok"]:
+                    # 租约已被回收, 结果仍会提交, 分片已由其他worker完成时被忽略
+                    self.log("WORKER => lease {} lost".format(self.lease_id))
+                    return
+            except (urllib.error.URLError, OSError) as e:
+                self.log("WORKER => renew lease {} failed, msg: {}".format(self.lease_id, e))
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+
+
+def _call(url, path, body, token, log):
+    """
+    请求coordinator, 连接失败时重试JOIN_RETRIES次, 仍失败返回None
+    """
+    for attempt in range(JOIN_RETRIES):
+        try:
+            return request(url, path, body, token)
+        except urllib.error.HTTPError as e:
+            log("WORKER => coordinator {}{} rejected, code: {}".format(url, path, e.code))
+            return None
+        except (urllib.error.URLError, OSError) as e:
+            if attempt == 0:
+                log("WORKER => coordinator {} unreachable, retrying, msg: {}".format(url, e))
+            time.sleep(POLL_INTERVAL)
+    return None
+
+
+def join_coordinator(url, token, resolve_runner, worker=None, log=print):
+    """
+    持续从coordinator领取分片, 按job选择runner执行并提交结果, 所有分片完成或coordinator不可达时返回处理的分片数
+    resolve_runner(job)返回runner协程函数
+    """
+    worker = worker or "{}:{}".format(socket.gethostname(), os.getpid())
+    count = 0
+    while True:
+        lease = _call(url, "/lease", {"worker": worker}, token, log)
+        if lease is None or lease.get("done"):
+            return count
+        if lease["name"] is None:
+            # 其他worker的分片尚未完成, 租约到期后可领取
+            time.sleep(lease.get("wait", POLL_INTERVAL))
+            continue
+        name = lease["name"]
+        start = time.time()
+        with LeaseKeeper(url, lease["lease"], max(lease["lease_seconds"] / 3, 1), token, log):
+            try:
+                report = asyncio.run(resolve_runner(lease["job"])(lease["configure"]))
+            except Exception as e:
+                report = {"result": False, "process_count": 0, "error": str(e)}
+        count += 1
+        log("WORKER => [{}] {} docs, result: {}, time: {:.3f}".format(name, report["process_count"], report["result"],
+                                                                   time.time() - start))
+        if _call(url, "/result", {"name": name, "lease": lease["lease"], "worker": worker, "report": report},
+                 token, log) is None:
+            return count
+
+
+def _join_main(url, token, resolve_runner):
+    join_coordinator(url, token, resolve_runner)
+
+
+def run_joiners(url, token, resolve_runner, processes):
+    """
+    本机启动processes个worker进程加入coordinator, processes为1时在当前进程执行
+    """
+    if processes <= 1:
+        join_coordinator(url, token, resolve_runner)
+        return
+    # motor客户端不能跨fork使用, 统一使用spawn, 与windows行为一致
+    ctx = multiprocessing.get_context('spawn')
+    workers = [ctx.Process(target=_join_main, args=(url, token, resolve_runner)) for _ in range(processes)]
+    for process in workers:
+        process.start()
+    for process in workers:
+        process.join()
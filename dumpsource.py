@@ -0,0 +1,434 @@
+# -*- coding: utf-8 -*-
+
+"""
+Module Description: mongodump导出的.bson文件作为比对的一端, 内存映射后按_id建立索引, 文档直接以映射内存切片计算摘要
+Date: 2026/10/18
+Author: HuYuanCheng
+"""
+import asyncio
+import bisect
+import mmap
+import os
+import random
+import struct
+from array import array
+
+import bson
+from bson.raw_bson import RawBSONDocument
+
+from connection import PoolWaitListener
+from digest import raw_id
+from ranges import id_sort_key
+from snapshot import DigestTable, KeyCodec, KEY_STRING
+
+DUMP_PREFIX = "dump://"
+
+_INT32 = struct.Struct('<i')
+_OFFSET = struct.Struct('<q')
+
+
+def dump_file_path(root, db, coll):
+    """
+    root为.bson文件时所有collection都读取该文件; 为目录时依次查找<root>/<db>/<coll>.bson与<root>/<coll>.bson
+    """
+    if os.path.isfile(root):
+        return root
+    for path in (os.path.join(root, db, coll + ".bson"), os.path.join(root, coll + ".bson")):
+        if os.path.isfile(path):
+            return path
+        if os.path.isfile(path + ".gz"):
+            raise ValueError("gzip compressed dump is not supported, decompress first: {}".format(path + ".gz"))
+    raise FileNotFoundError("no bson dump for {}.{} under {}".format(db, coll, root))
+
+
+def _path_tree(paths):
+    """
+    点分字段路径转换为嵌套dict, 叶子为True; 已包含上层字段时忽略更深的路径
+    """
+    tree = {}
+    for path in paths:
+        node = tree
+        parts = path.split('.')
+        for part in parts[:-1]:
+            node = node.setdefault(part, {})
+            if node is True:
+                break
+        else:
+            node[parts[-1]] = True
+    return tree
+
+
+def _include(value, tree):
+    """
+    与mongodb包含投影相同: 数组逐个元素投影, 子文档中没有的字段不返回, 路径上的标量值(及数组中的标量)被丢弃
+    """
+    if isinstance(value, dict):
+        doc = {}
+        for key, item in value.items():
+            sub = tree.get(key)
+            if sub is True:
+                doc[key] = item
+            elif sub is not None and isinstance(item, (dict, list)):
+                doc[key] = _include(item, sub)
+        return doc
+    return [_include(item, tree) for item in value if isinstance(item, (dict, list))]
+
+
+def _exclude(value, tree):
+    if isinstance(value, dict):
+        doc = {}
+        for key, item in value.items():
+            sub = tree.get(key)
+            if sub is True:
+                continue
+            doc[key] = item if sub is None else _exclude(item, sub)
+        return doc
+    if isinstance(value, list):
+        return [_exclude(item, tree) for item in value]
+    return value
+
+
+def project(doc, projection):
+    """
+    在本地按find投影处理文档, 支持点分路径; _id始终返回
+    """
+    if any(projection.values()):
+        tree = _path_tree(field for field, flag in projection.items() if flag)
+        tree["_id"] = True
+        return _include(doc, tree)
+    return _exclude(doc, _path_tree(field for field in projection if field != "_id"))
+
+
+class DumpFile:
+    """
+    内存映射的.bson文件, 首次使用时在线程中顺序扫描一遍, 建立按_id排序的索引:
+    _id同为int/ObjectId/字符串时为DigestTable(定长key + 8字节文档偏移), 否则为(排序键, _id, 文档偏移)列表
+    error不为None时(文件不存在等)在首次使用时抛出, 只影响使用该文件的collection
+    """
+    def __init__(self, path, error=None):
+        self.path = path
+        self.error = error
+        self.file = None
+        self.mmap = None
+        self.view = None
+        self.table = None
+        self.keys = []
+        self.ids = []
+        self.offsets = array('q')
+        self.loaded = False
+        self.lock = None
+
+    def __len__(self):
+        return len(self.table) if self.table is not None else len(self.ids)
+
+    async def load(self):
+        if self.loaded:
+            return
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        async with self.lock:
+            if not self.loaded:
+                await asyncio.get_running_loop().run_in_executor(None, self._load)
+                self.loaded = True
+
+    def _load(self):
+        if self.error is not None:
+            raise self.error
+        self.file = open(self.path, 'rb')
+        size = os.fstat(self.file.fileno()).st_size
+        if size == 0:
+            return
+        self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.mmap)
+        ids, offsets = [], array('q')
+        pos = 0
+        while pos < size:
+            length = _INT32.unpack_from(self.view, pos)[0] if pos + 4 <= size else 0
+            if length < 5 or pos + length > size:
+                raise ValueError("corrupt bson dump {} at offset {}".format(self.path, pos))
+            offsets.append(pos)
+            ids.append(raw_id(self.view[pos:pos + length]))
+            pos += length
+        codec = self._codec(ids)
+        if codec is not None:
+            self.table = DigestTable.build(zip(ids, (_OFFSET.pack(offset) for offset in offsets)),
+                                           _OFFSET.size, codec=codec)
+            return
+        keys = [id_sort_key(doc_id) for doc_id in ids]
+        if any(keys[i] > keys[i + 1] for i in range(len(keys) - 1)):
+            # mongodump按自然顺序导出, 不保证_id有序
+            order = sorted(range(len(keys)), key=keys.__getitem__)
+            keys = [keys[i] for i in order]
+            ids = [ids[i] for i in order]
+            offsets = array('q', (offsets[i] for i in order))
+        self.keys, self.ids, self.offsets = keys, ids, offsets
+
+    @staticmethod
+    def _codec(ids):
+        """
+        所有_id可按同一定长key存储时返回KeyCodec, 字符串_id按最长_id确定宽度
+        """
+        if not ids:
+            return None
+        try:
+            codec = KeyCodec.for_id(ids[0])
+        except ValueError:
+            return None
+        if isinstance(ids[0], str):
+            codec = KeyCodec(KEY_STRING, max(max(len(doc_id.encode('utf-8')) if isinstance(doc_id, str) else 0
+                                                 for doc_id in ids), 1))
+        if not all(codec.accepts(doc_id) for doc_id in ids):
+            return None
+        return codec
+
+    def id_at(self, pos):
+        return self.table.id_at(pos) if self.table is not None else self.ids[pos]
+
+    def raw(self, pos):
+        """
+        第pos个文档(按_id排序)在映射内存上的切片, 不复制
+        """
+        if self.table is not None:
+            offset = _OFFSET.unpack(self.table.value_at(pos))[0]
+        else:
+            offset = self.offsets[pos]
+        return self.view[offset:offset + _INT32.unpack_from(self.view, offset)[0]]
+
+    def select(self, query):
+        """
+        支持比对使用的_id查询: 无条件、$in、$gte/$lt区间, 返回按_id排序的文档序号
+        """
+        cond = (query or {}).get("_id")
+        if not cond:
+            return range(len(self))
+        if not isinstance(cond, dict):
+            cond = {"$in": [cond]}
+        if self.table is not None:
+            if "$in" in cond:
+                return sorted(set(pos for pos in self.table.search(cond["$in"]) if pos >= 0))
+            start, end = self.table.range_positions(cond.get("$gte"), cond.get("$lt"))
+            return range(start, end)
+        if "$in" in cond:
+            positions = set()
+            for doc_id in cond["$in"]:
+                key = id_sort_key(doc_id)
+                pos = bisect.bisect_left(self.keys, key)
+                if pos < len(self.keys) and self.keys[pos] == key:
+                    positions.add(pos)
+            return sorted(positions)
+        start = bisect.bisect_left(self.keys, id_sort_key(cond["$gte"])) if "$gte" in cond else 0
+        end = bisect.bisect_left(self.keys, id_sort_key(cond["$lt"])) if "$lt" in cond else len(self.keys)
+        return range(start, max(start, end))
+
+    def close(self):
+        self.view = None
+        if self.mmap is not None:
+            try:
+                self.mmap.close()
+            except BufferError:
+                # 仍有文档切片在使用, 由垃圾回收释放
+                pass
+            self.mmap = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class DumpCursor:
+    """
+    与motor游标相同的批量读取接口, 结果按_id升序; raw时返回映射内存上的RawBSONDocument
+    """
+    def __init__(self, dump, query, projection, raw):
+        self.dump = dump
+        self.query = query
+        self.projection = projection
+        self.raw = raw
+        self.positions = None
+        self.pos = 0
+
+    def sort(self, key, direction=1):
+        return self
+
+    def batch_size(self, batch):
+        return self
+
+    @property
+    def alive(self):
+        return self.positions is None or self.pos < len(self.positions)
+
+    def _doc(self, pos):
+        data = self.dump.raw(pos)
+        if self.projection:
+            doc = project(bson.decode(bytes(data)), self.projection)
+            return RawBSONDocument(bson.encode(doc)) if self.raw else doc
+        return RawBSONDocument(data) if self.raw else bson.decode(bytes(data))
+
+    async def to_list(self, length=None):
+        if self.positions is None:
+            await self.dump.load()
+            self.positions = self.dump.select(self.query)
+        end = len(self.positions) if length is None else min(len(self.positions), self.pos + length)
+        docs = [self._doc(pos) for pos in self.positions[self.pos:end]]
+        self.pos = end
+        # 整批在事件循环线程解析, 让出一次供其他协程执行
+        await asyncio.sleep(0)
+        return docs
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        docs = await self.to_list(1)
+        if not docs:
+            raise StopAsyncIteration
+        return docs[0]
+
+
+class DumpCollection:
+    """
+    只读collection, 支持比对用到的查询、计数与切分区间的聚合; 服务端摘要(digest_location=server)不可用
+    """
+    def __init__(self, dump, full_name, raw=False):
+        self.dump = dump
+        self.full_name = full_name
+        self.raw = raw
+
+    def with_options(self, codec_options=None):
+        raw = codec_options is not None and codec_options.document_class is RawBSONDocument
+        return DumpCollection(self.dump, self.full_name, raw)
+
+    async def estimated_document_count(self):
+        await self.dump.load()
+        return len(self.dump)
+
+    async def count_documents(self, query, **kwargs):
+        await self.dump.load()
+        return len(self.dump.select(query))
+
+    def find(self, query=None, projection=None):
+        return DumpCursor(self.dump, query, projection, self.raw)
+
+    def aggregate(self, pipeline, **kwargs):
+        stages = [list(stage)[0] for stage in pipeline]
+        if stages == ["$sample", "$project", "$sort"]:
+            return DumpAggregate(self.dump, self._sample, None, pipeline[0]["$sample"]["size"], True)
+        if stages == ["$match", "$project", "$sample"]:
+            return DumpAggregate(self.dump, self._sample, pipeline[0]["$match"], pipeline[2]["$sample"]["size"],
+                                 False)
+        if stages == ["$match", "$project", "$bucketAuto"]:
+            return DumpAggregate(self.dump, self._buckets, pipeline[0]["$match"],
+                                 pipeline[2]["$bucketAuto"]["buckets"])
+        if "$group" in stages or stages[-1:] == ["$project"]:
+            # 服务端摘要与区间指纹
+            raise ValueError("bson dump source can not compute server side digests (pipeline {}), "
+                             "use digest_location client".format(stages))
+        raise ValueError("bson dump source does not support aggregation pipeline {}".format(stages))
+
+    def _sample(self, match, size, ordered):
+        """
+        $sample: 从满足match的文档中随机抽取size个_id, ordered时按_id排序
+        """
+        positions = self.dump.select(match)
+        chosen = random.sample(range(len(positions)), min(size, len(positions)))
+        if ordered:
+            chosen.sort()
+        return [{"_id": self.dump.id_at(positions[i])} for i in chosen]
+
+    async def split_bounds(self, count):
+        """
+        切分区间使用的count个切分点: 文件已按_id排序, 按位置等分, 区间文档数相同且结果稳定
+        """
+        await self.dump.load()
+        total = len(self.dump)
+        count = min(count, total)
+        return [self.dump.id_at((i + 1) * total // (count + 1)) for i in range(count)]
+
+    def _buckets(self, match, parts):
+        positions = self.dump.select(match)
+        buckets = []
+        for i in range(parts):
+            part = positions[i * len(positions) // parts:(i + 1) * len(positions) // parts]
+            if len(part):
+                buckets.append({"_id": {"min": self.dump.id_at(part[0]), "max": self.dump.id_at(part[-1])},
+                                "count": len(part)})
+        return buckets
+
+
+class DumpAggregate(DumpCursor):
+    """
+    聚合结果游标, 结果在首次读取时由func计算
+    """
+    def __init__(self, dump, func, *args):
+        super().__init__(dump, None, None, False)
+        self.func = func
+        self.args = args
+        self.docs = None
+
+    async def to_list(self, length=None):
+        if self.docs is None:
+            await self.dump.load()
+            self.docs = self.func(*self.args)
+            self.positions = range(len(self.docs))
+        end = len(self.docs) if length is None else min(len(self.docs), self.pos + length)
+        docs = self.docs[self.pos:end]
+        self.pos = end
+        return docs
+
+
+class DumpDatabase:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+
+    def __getitem__(self, coll):
+        return DumpCollection(self.client.file(self.name, coll), "{}.{}".format(self.name, coll))
+
+    async def command(self, name, *args, **kwargs):
+        # 没有operationTime, follow模式按非副本集处理
+        return {"ok": 1.0}
+
+
+class DumpClient:
+    def __init__(self, root):
+        self.root = root
+        self.files = {}
+
+    def __getitem__(self, db):
+        return DumpDatabase(self, db)
+
+    @property
+    def admin(self):
+        return DumpDatabase(self, "admin")
+
+    def file(self, db, coll):
+        try:
+            path = dump_file_path(self.root, db, coll)
+        except (OSError, ValueError) as e:
+            # 延迟到读取该collection时报错, 不影响其他collection
+            return DumpFile(None, e)
+        dump = self.files.get(path)
+        if dump is None:
+            dump = self.files[path] = DumpFile(path)
+        return dump
+
+    def close(self):
+        for dump in self.files.values():
+            dump.close()
+        self.files = {}
+
+
+class DumpCluster:
+    """
+    以mongodump导出文件代替集群连接, url为dump://<.bson文件或mongodump输出目录>
+    """
+    def __init__(self, url, options=None, on_wait=None):
+        self.url = url
+        self.conn = None
+        self.pool_listener = PoolWaitListener(on_wait)
+
+    def connect(self):
+        self.conn = DumpClient(self.url[len(DUMP_PREFIX):])
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+"""
+Module Description: 持续校验, 初次比对后订阅src与dst集合的change stream, 变化的_id去重后在静默期结束时复核
+Date: 2026/10/18
+Author: HuYuanCheng
+"""
+import asyncio
+import time
+
+import bson
+
+FOLLOW = "follow"
+FOLLOW_DEBOUNCE = "follow_debounce"
+FOLLOW_REPORT_INTERVAL = "follow_report_interval"
+FOLLOW_DURATION = "follow_duration"
+
+# 只需要变化文档的_id, 不拉取整篇文档
+CHANGE_PIPELINE = [{"$project": {"documentKey": 1, "operationType": 1}}]
+
+# 集合被删除/重命名后change stream失效, 不再有后续事件
+INVALIDATE_OPERATIONS = ("drop", "rename", "dropDatabase", "invalidate")
+
+
+def doc_key(doc_id):
+    try:
+        hash(doc_id)
+        return doc_id
+    except TypeError:
+        # 文档类型的_id不可哈希, 按BSON编码去重
+        return bson.encode({"_id": doc_id})
+
+
+class ChangeQueue:
+    """
+    待复核的_id队列: 同一_id多次变化只保留一次, 最后一次变化后静默debounce秒才取出,
+    避免复核时dst尚未同步到src的最新写入
+    """
+    def __init__(self, debounce):
+        self.debounce = debounce
+        self.pending = {}
+
+    def __len__(self):
+        return len(self.pending)
+
+    def add(self, doc_id, now=None):
+        key = doc_key(doc_id)
+        self.pending.pop(key, None)
+        # dict保持插入顺序, 重新插入后队首始终是最早静默的_id
+        self.pending[key] = (doc_id, time.monotonic() if now is None else now)
+
+    def pop_ready(self, limit, now=None):
+        now = time.monotonic() if now is None else now
+        ready = []
+        for key, (doc_id, changed) in self.pending.items():
+            if now - changed < self.debounce or len(ready) >= limit:
+                break
+            ready.append((key, doc_id))
+        for key, _ in ready:
+            del self.pending[key]
+        return [doc_id for _, doc_id in ready]
+
+    def wait_time(self, now=None):
+        """
+        距离队首_id可以复核的秒数, 队列为空时返回debounce
+        """
+        if not self.pending:
+            return self.debounce
+        now = time.monotonic() if now is None else now
+        _, changed = next(iter(self.pending.values()))
+        return max(self.debounce - (now - changed), 0)
+
+
+class FollowScope:
+    """
+    一个集合的持续校验状态, divergent为当前不一致的_id及差异类型
+    """
+    def __init__(self, scope, src_coll, dst_coll, engine, debounce):
+        self.scope = scope
+        self.src_coll = src_coll
+        self.dst_coll = dst_coll
+        self.engine = engine
+        self.queue = ChangeQueue(debounce)
+        self.divergent = {}
+        self.changes = 0
+        self.verified = 0
+
+    def on_change(self, doc_id):
+        self.changes += 1
+        self.queue.add(doc_id)
+
+    def update(self, doc_id, kind):
+        """
+        记录一次复核结果, kind为None表示一致; 返回状态是否变化
+        """
+        key = doc_key(doc_id)
+        self.verified += 1
+        if kind is None:
+            return self.divergent.pop(key, None) is not None
+        changed = key not in self.divergent or self.divergent[key][1] != kind
+        self.divergent[key] = (doc_id, kind)
+        return changed
+
+
+async def cluster_time(client):
+    """
+    返回集群当前的operationTime, 初次比对前记录, change stream从该时间点开始, 不遗漏比对期间的写入
+    单节点(非副本集)不支持change stream, 返回None
+    """
+    res = await client.admin.command("ping")
+    return res.get("operationTime")
+
+
+async def watch_changes(coll, start_time, on_change, log_error, retry_interval=1):
+    """
+    订阅coll的change stream, 每个变化文档的_id回调on_change; 出错后从最后的resume token继续
+    """
+    token = None
+    while True:
+        try:
+            options = {"resume_after": token} if token is not None else {"start_at_operation_time": start_time}
+            async with coll.watch(CHANGE_PIPELINE, **options) as stream:
+                async for change in stream:
+                    token = stream.resume_token
+                    if change["operationType"] in INVALIDATE_OPERATIONS:
+                        log_error("FOLLOW => change stream on {} invalidated by {}".format(
+                            coll.full_name, change["operationType"]))
+                        return
+                    on_change(change["documentKey"]["_id"])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log_error("FOLLOW => change stream on {} failed, msg: {}".format(coll.full_name, e))
+            await asyncio.sleep(retry_interval)
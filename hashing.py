@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+"""
+Module Description: 摘要计算执行器, 拉取到的整批文档交给线程池/进程池计算摘要, 事件循环只负责I/O
+Date: 2026/10/18
+Author: HuYuanCheng
+"""
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from digest import raw_id
+
+HASH_EXECUTOR = "hash_executor"
+HASH_WORKERS = "hash_workers"
+
+EXECUTOR_INLINE = "inline"
+EXECUTOR_THREAD = "thread"
+EXECUTOR_PROCESS = "process"
+
+# 少于该数量的批次直接在事件循环线程计算, 提交到池的开销大于计算本身
+MIN_POOL_BATCH = 16
+
+
+def digest_docs(engine, docs):
+    """
+    计算一批文档的(_id, 摘要)
+    """
+    return [(engine.doc_id(doc), engine.digest(doc)) for doc in docs]
+
+
+def _digest_raws(engine, raws):
+    # 进程池中执行: 只传输原始BSON字节, 不需要序列化RawBSONDocument
+    return [(raw_id(raw), engine.digest_raw(raw)) for raw in raws]
+
+
+class DigestExecutor:
+    """
+    inline: 在事件循环线程计算(默认)
+    thread: 线程池, hashlib对2KB以上的数据计算时释放GIL, 适合较大的文档
+    process: 进程池(spawn), 可以利用多核, 整批原始BSON字节发送到子进程计算
+    服务端摘要模式下摘要已由服务端算出, 始终在事件循环线程解析
+    """
+    def __init__(self, kind=EXECUTOR_INLINE, workers=0):
+        if kind not in (EXECUTOR_INLINE, EXECUTOR_THREAD, EXECUTOR_PROCESS):
+            raise ValueError("unsupported hash executor: {}".format(kind))
+        self.kind = kind
+        self.workers = workers or os.cpu_count() or 1
+        self.pool = None
+        if kind == EXECUTOR_THREAD:
+            self.pool = ThreadPoolExecutor(self.workers, thread_name_prefix="digest")
+        elif kind == EXECUTOR_PROCESS:
+            self.pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+
+    @classmethod
+    def from_configure(cls, configure):
+        return cls(configure.get(HASH_EXECUTOR, EXECUTOR_INLINE), configure.get(HASH_WORKERS, 0))
+
+    async def digests(self, engine, docs):
+        if self.pool is None or engine.server or len(docs) < MIN_POOL_BATCH:
+            return digest_docs(engine, docs)
+        loop = asyncio.get_running_loop()
+        if self.kind == EXECUTOR_PROCESS and engine.raw:
+            return await loop.run_in_executor(self.pool, _digest_raws, engine, [bytes(doc.raw) for doc in docs])
+        return await loop.run_in_executor(self.pool, digest_docs, engine, docs)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=True)
+            self.pool = None
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+
+"""
+Module Description: 日志与指标, 事件循环中只将日志放入队列, 由后台线程批量写入文本日志/JSONL事件/指标快照
+Date: 2026/10/18
+Author: HuYuanCheng
+"""
+import bisect
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LOG_LEVEL = "log_level"
+LOG_FLUSH_INTERVAL = "log_flush_interval"
+METRICS_INTERVAL = "metrics_interval"
+METRICS_PORT = "metrics_port"
+
+LEVELS = {"debug": 10, "info": 20, "error": 40}
+LEVEL_NAMES = {10: "DEBUG", 20: "INFO ", 40: "ERROR"}
+
+# 耗时直方图桶上界(秒), 最后一个桶为+inf
+HISTOGRAM_BOUNDS = [0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10, 30]
+
+_STOP = object()
+
+
+class Histogram:
+    def __init__(self):
+        self.buckets = [0] * (len(HISTOGRAM_BOUNDS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.buckets[bisect.bisect_left(HISTOGRAM_BOUNDS, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        """
+        按桶估算分位数, 返回所在桶的上界
+        """
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if n and seen >= rank:
+                return HISTOGRAM_BOUNDS[i] if i < len(HISTOGRAM_BOUNDS) else self.max
+        return 0.0
+
+    def snapshot(self):
+        return {"count": self.count, "sum": round(self.sum, 6), "max": round(self.max, 6),
+                "p50": self.quantile(0.5), "p95": self.quantile(0.95), "p99": self.quantile(0.99),
+                "buckets": dict(zip([str(b) for b in HISTOGRAM_BOUNDS] + ["+inf"], self.buckets))}
+
+
+class Metrics:
+    """
+    计数器与耗时直方图, 在事件循环线程中更新, 后台线程读取快照
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.start = time.time()
+
+    def incr(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, seconds):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    def snapshot(self):
+        with self.lock:
+            return {"ts": time.time(), "uptime": round(time.time() - self.start, 3),
+                    "counters": dict(self.counters),
+                    "histograms": dict((name, h.snapshot()) for name, h in self.histograms.items())}
+
+
+class LogSink:
+    """
+    info/error/debug只做级别判断并入队, 后台线程每flush_interval秒批量输出到控制台、文本日志(ERROR写入error_path)与JSONL事件文件
+    metrics_path不为空时每metrics_interval秒覆盖写入指标快照, metrics_port大于0时提供http://127.0.0.1:port/metrics
+    """
+    def __init__(self, path, error_path=None, event_path=None, metrics_path=None, level="info", console=True,
+                 flush_interval=1.0, metrics_interval=5.0, metrics_port=0):
+        self.path = path
+        self.error_path = error_path or path
+        self.event_path = event_path
+        self.metrics_path = metrics_path
+        self.level = LEVELS.get(level, LEVELS["info"])
+        self.console = console
+        self.flush_interval = flush_interval
+        self.metrics_interval = metrics_interval
+        self.metrics = Metrics()
+        self.queue = queue.SimpleQueue()
+        self.files = {}
+        self.server = None
+        if metrics_port:
+            self.server = self._serve(metrics_port)
+        self.thread = threading.Thread(target=self._run, name="log-sink", daemon=True)
+        self.thread.start()
+
+    @classmethod
+    def from_configure(cls, configure, path, error_path, event_path=None, metrics_path=None):
+        return cls(path, error_path, event_path, metrics_path, configure.get(LOG_LEVEL, "info"),
+                   flush_interval=configure.get(LOG_FLUSH_INTERVAL, 1.0),
+                   metrics_interval=configure.get(METRICS_INTERVAL, 5.0),
+                   metrics_port=configure.get(METRICS_PORT, 0))
+
+    def enabled(self, level):
+        return LEVELS[level] >= self.level
+
+    def log(self, level, message, **fields):
+        if LEVELS[level] >= self.level:
+            self.queue.put((time.time(), LEVELS[level], message, fields))
+
+    def debug(self, message, **fields):
+        self.log("debug", message, **fields)
+
+    def info(self, message, **fields):
+        self.log("info", message, **fields)
+
+    def error(self, message, **fields):
+        self.log("error", message, **fields)
+
+    def incr(self, name, value=1):
+        self.metrics.incr(name, value)
+
+    def observe(self, name, seconds):
+        self.metrics.observe(name, seconds)
+
+    def _file(self, path):
+        f = self.files.get(path)
+        if f is None:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            f = self.files[path] = open(path, 'a+', encoding='utf-8')
+        return f
+
+    def _write(self, items):
+        console = []
+        lines = {}
+        events = []
+        for ts, level, message, fields in items:
+            text = "%s [%s] %s " % (LEVEL_NAMES[level], time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(ts)),
+                                    message)
+            console.append(text)
+            lines.setdefault(self.error_path if level >= LEVELS["error"] else self.path, []).append(text)
+            if self.event_path:
+                event = {"ts": round(ts, 6), "level": LEVEL_NAMES[level].strip(), "msg": message}
+                event.update(fields)
+                events.append(json.dumps(event, default=str, ensure_ascii=False))
+        if self.console and console:
+            sys.stdout.write('\n'.join(console) + '\n')
+        for path, texts in lines.items():
+            self._file(path).write('\n'.join(texts) + '\n')
+        if events:
+            self._file(self.event_path).write('\n'.join(events) + '\n')
+
+    def _flush(self):
+        for f in self.files.values():
+            f.flush()
+        if self.console:
+            sys.stdout.flush()
+
+    def write_metrics(self):
+        if not self.metrics_path:
+            return
+        os.makedirs(os.path.dirname(self.metrics_path), exist_ok=True)
+        tmp_path = self.metrics_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.metrics.snapshot(), f, indent=1)
+        os.replace(tmp_path, self.metrics_path)
+
+    def _run(self):
+        last_metrics = time.time()
+        stop = False
+        while not stop:
+            items = []
+            try:
+                item = self.queue.get(timeout=self.flush_interval)
+                while True:
+                    if item is _STOP:
+                        stop = True
+                        break
+                    items.append(item)
+                    if len(items) >= 10000:
+                        break
+                    item = self.queue.get_nowait()
+            except queue.Empty:
+                pass
+            try:
+                self._write(items)
+                self._flush()
+                if stop or time.time() - last_metrics >= self.metrics_interval:
+                    self.write_metrics()
+                    last_metrics = time.time()
+            except Exception as e:
+                sys.stderr.write("log sink write failed: {}\n".format(e))
+
+    def _serve(self, port):
+        sink = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = json.dumps(sink.metrics.snapshot()).encode('utf-8')
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+        return server
+
+    def close(self):
+        self.queue.put(_STOP)
+        self.thread.join()
+        for f in self.files.values():
+            f.close()
+        self.files = {}
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+
+"""
+Module Description: 分层区间指纹校验, 先比较_id区间指纹, 仅对指纹不一致的区间继续细分直至逐文档比对
+Date: 2026/10/18
+Author: HuYuanCheng
+"""
+import asyncio
+
+from digest import DigestEngine, EMPTY_FINGERPRINT
+from hashing import digest_docs
+from ranges import bounds_to_ranges, id_range_query, merge_digests
+
+MERKLE_FANOUT = "merkle_fanout"
+MERKLE_LEAF_SIZE = "merkle_leaf_size"
+
+
+class CollectionDigestSource:
+    """
+    在线collection, 服务端摘要模式下区间指纹由服务端聚合计算, 否则拉取摘要后在本地合并
+    hasher为摘要计算执行器(hashing.DigestExecutor), None时在当前线程计算
+    """
+    def __init__(self, coll, digest_engine, batch, hasher=None):
+        self.coll = coll
+        self.digest_engine = digest_engine
+        self.batch = batch
+        self.hasher = hasher
+
+    async def count(self, lower, upper):
+        """
+        区间精确文档数, 只按_id索引计数不读取文档
+        """
+        return await self.coll.count_documents(id_range_query(lower, upper), hint=[("_id", 1)])
+
+    async def fingerprint(self, lower, upper):
+        """
+        返回(区间指纹, 逐文档摘要); 本地摘要模式下计算指纹已拉取了区间内全部摘要, 一并返回供直接合并比对,
+        服务端摘要模式下只有指纹经过网络, 摘要为None
+        """
+        engine = self.digest_engine
+        if engine.server:
+            cursor = self.coll.aggregate(engine.fingerprint_pipeline(id_range_query(lower, upper)))
+            docs = await cursor.to_list(length=1)
+            return (engine.fingerprint_from_server(docs[0]) if docs else EMPTY_FINGERPRINT), None
+        items = await self.digests(lower, upper)
+        return engine.fold(digest for _, digest in items), items
+
+    async def digests(self, lower, upper):
+        engine = self.digest_engine
+        cursor = engine.find(self.coll, id_range_query(lower, upper), sort=True).batch_size(self.batch)
+        items = []
+        while True:
+            docs = await cursor.to_list(length=self.batch)
+            if not docs:
+                break
+            if self.hasher is not None:
+                items.extend(await self.hasher.digests(engine, docs))
+            else:
+                items.extend(digest_docs(engine, docs))
+        return items
+
+    async def split(self, lower, upper, parts):
+        cursor = self.coll.aggregate([{"$match": id_range_query(lower, upper)},
+                                      {"$project": {"_id": 1}},
+                                      {"$bucketAuto": {"groupBy": "$_id", "buckets": parts}}],
+                                     allowDiskUse=True)
+        buckets = await cursor.to_list(length=None)
+        return [bucket['_id']['min'] for bucket in buckets[1:]]
+
+
+class SnapshotDigestSource:
+    """
+    分步模式period 1保存的src摘要快照文件(SnapshotReader)
+    """
+    def __init__(self, reader):
+        self.reader = reader
+
+    def __len__(self):
+        return len(self.reader)
+
+    async def count(self, lower, upper):
+        start, end = self.reader.range_positions(lower, upper)
+        return end - start
+
+    async def fingerprint(self, lower, upper):
+        start, end = self.reader.range_positions(lower, upper)
+        return DigestEngine.fold(self.reader.digests(start, end)), None
+
+    async def digests(self, lower, upper):
+        start, end = self.reader.range_positions(lower, upper)
+        return self.reader.items(start, end)
+
+    def _bounds(self, start, end, parts):
+        step = (end - start) / parts
+        bounds = []
+        for i in range(1, parts):
+            pos = start + int(i * step)
+            if pos >= end:
+                break
+            doc_id = self.reader.id_at(pos)
+            if not bounds or doc_id != bounds[-1]:
+                bounds.append(doc_id)
+        return bounds
+
+    async def split(self, lower, upper, parts):
+        start, end = self.reader.range_positions(lower, upper)
+        return self._bounds(start, end, parts)
+
+    def ranges(self, range_count):
+        bounds = []
+        if range_count > 1 and len(self.reader):
+            bounds = self._bounds(0, len(self.reader), range_count)
+        return bounds_to_ranges(bounds)
+
+
+class MerkleVerifier:
+    """
+    区间指纹一致则整个区间通过; 不一致且文档数超过leaf_size时按fanout细分递归, 否则逐文档合并比对
+    任一端计算指纹时已拉取了逐文档摘要(本地摘要模式)时不再细分, 直接用已拉取的摘要合并比对, 避免每一层重复拉取
+    fingerprints为False时直接逐文档比对
+    """
+    def __init__(self, src, dst, fanout=16, leaf_size=1000, fingerprints=True):
+        self.src = src
+        self.dst = dst
+        self.fanout = max(fanout, 2)
+        self.leaf_size = leaf_size
+        self.fingerprints = fingerprints
+        self.bucket_count = 0
+        self.leaf_count = 0
+
+    async def verify(self, lower, upper, on_diff):
+        """
+        校验区间[lower, upper), 差异通过on_diff(差异类型, _id)返回, 返回区间内文档数
+        """
+        src_items = dst_items = None
+        if self.fingerprints:
+            (src_fp, src_items), (dst_fp, dst_items) = await asyncio.gather(self.src.fingerprint(lower, upper),
+                                                                            self.dst.fingerprint(lower, upper))
+            self.bucket_count += 1
+            if src_fp == dst_fp:
+                return src_fp[0]
+
+            fetched = src_items is not None or dst_items is not None
+            if max(src_fp[0], dst_fp[0]) > self.leaf_size and not fetched:
+                side = self.src if src_fp[0] >= dst_fp[0] else self.dst
+                bounds = [b for b in await side.split(lower, upper, self.fanout) if b != lower]
+                if bounds:
+                    doc_count = 0
+                    for sub_lower, sub_upper in zip([lower] + bounds, bounds + [upper]):
+                        doc_count += await self.verify(sub_lower, sub_upper, on_diff)
+                    return doc_count
+
+        src_items, dst_items = await asyncio.gather(self._digests(self.src, src_items, lower, upper),
+                                                    self._digests(self.dst, dst_items, lower, upper))
+        self.leaf_count += 1
+        for kind, doc_id in merge_digests(src_items, dst_items):
+            on_diff(kind, doc_id)
+        return max(len(src_items), len(dst_items))
+
+    @staticmethod
+    async def _digests(source, items, lower, upper):
+        if items is not None:
+            return items
+        return await source.digests(lower, upper)
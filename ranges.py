@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+
+"""
+Module Description: _id区间切分与有序合并比对
+Date: 2026/10/18
+Author: HuYuanCheng
+"""
+import datetime
+import math
+import re
+import uuid
+from collections.abc import Mapping
+
+from bson import ObjectId
+from bson.code import Code
+from bson.datetime_ms import DatetimeMS
+from bson.dbref import DBRef
+from bson.decimal128 import Decimal128
+from bson.max_key import MaxKey
+from bson.min_key import MinKey
+from bson.regex import Regex
+from bson.timestamp import Timestamp
+
+DIFF_CHANGED = "changed"
+DIFF_MISSING_DST = "missing in dst"
+DIFF_MISSING_SRC = "missing in src"
+
+# mongodb比较时的类型顺序(canonical type), 数值类型之间按数值比较, 字符串与symbol同类
+TYPE_MIN_KEY = -1
+TYPE_NULL = 5
+TYPE_NUMBER = 10
+TYPE_STRING = 15
+TYPE_OBJECT = 20
+TYPE_ARRAY = 25
+TYPE_BINARY = 30
+TYPE_OBJECTID = 35
+TYPE_BOOL = 40
+TYPE_DATE = 45
+TYPE_TIMESTAMP = 47
+TYPE_REGEX = 50
+TYPE_CODE = 60
+TYPE_CODE_WITH_SCOPE = 65
+TYPE_MAX_KEY = 127
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+_MILLISECOND = datetime.timedelta(milliseconds=1)
+
+
+def _number_key(value):
+    # NaN小于所有数值; int/long/double/decimal按数值比较, Decimal与float比较是精确的
+    if isinstance(value, Decimal128):
+        value = value.to_decimal()
+        if value.is_nan():
+            return TYPE_NUMBER, 0
+    elif isinstance(value, float) and math.isnan(value):
+        return TYPE_NUMBER, 0
+    return TYPE_NUMBER, 1, value
+
+
+def _date_millis(value):
+    if isinstance(value, DatetimeMS):
+        return int(value)
+    if value.tzinfo is not None:
+        value = value.replace(tzinfo=None) - value.utcoffset()
+    return (value - _EPOCH) // _MILLISECOND
+
+
+def _object_key(value):
+    # 逐字段比较: 先比较字段值的类型顺序, 再比较字段名, 最后比较值; 字段较少且前缀相同的较小
+    keys = ((name, id_sort_key(item)) for name, item in value.items())
+    return TYPE_OBJECT, tuple((key[0], name, key) for name, key in keys)
+
+
+def id_sort_key(value):
+    """
+    按mongodb的BSON比较顺序生成_id排序键, 保证合并比对时与服务端sort("_id")顺序一致:
+    MinKey < null < 数值 < 字符串 < 嵌入文档 < 数组 < BinData < ObjectId < bool < 日期 < Timestamp < 正则 < MaxKey
+    不支持的类型抛出TypeError
+    """
+    if value is None:
+        return (TYPE_NULL,)
+    if isinstance(value, bool):
+        return TYPE_BOOL, value
+    if isinstance(value, (int, float, Decimal128)):
+        return _number_key(value)
+    if isinstance(value, Code):
+        if value.scope is not None:
+            return TYPE_CODE_WITH_SCOPE, str(value), _object_key(value.scope)
+        return TYPE_CODE, str(value)
+    if isinstance(value, str):
+        return TYPE_STRING, value
+    if isinstance(value, ObjectId):
+        return TYPE_OBJECTID, value.binary
+    if isinstance(value, bytes):
+        # BinData先比较长度, 再比较subtype, 最后逐字节比较; bytes为subtype 0
+        return TYPE_BINARY, len(value), getattr(value, 'subtype', 0), bytes(value)
+    if isinstance(value, uuid.UUID):
+        return TYPE_BINARY, 16, 4, value.bytes
+    if isinstance(value, (datetime.datetime, DatetimeMS)):
+        return TYPE_DATE, _date_millis(value)
+    if isinstance(value, Timestamp):
+        return TYPE_TIMESTAMP, value.time, value.inc
+    if isinstance(value, DBRef):
+        return _object_key(value.as_doc())
+    if isinstance(value, Mapping):
+        return _object_key(value)
+    if isinstance(value, (list, tuple)):
+        return TYPE_ARRAY, tuple(map(id_sort_key, value))
+    if isinstance(value, Regex):
+        return TYPE_REGEX, value.pattern, value.flags
+    if isinstance(value, re.Pattern):
+        return id_sort_key(Regex.from_native(value))
+    if isinstance(value, MinKey):
+        return (TYPE_MIN_KEY,)
+    if isinstance(value, MaxKey):
+        return (TYPE_MAX_KEY,)
+    raise TypeError("unsupported _id type for ordered compare: {!r}".format(type(value)))
+
+
+def id_range_query(lower, upper):
+    """
+    _id区间查询条件 [lower, upper), None表示不设边界
+    """
+    cond = {}
+    if lower is not None:
+        cond["$gte"] = lower
+    if upper is not None:
+        cond["$lt"] = upper
+    return {"_id": cond} if cond else {}
+
+
+def bounds_to_ranges(bounds):
+    return list(zip([None] + bounds, bounds + [None]))
+
+
+async def split_id_ranges(coll, range_count):
+    """
+    通过$sample随机抽取_id作为切分点, 将集合切分为range_count个左闭右开的_id区间
+    collection提供split_bounds(如mongodump文件数据源)时直接使用其切分点
+    """
+    bounds = []
+    if range_count > 1 and hasattr(coll, "split_bounds"):
+        for doc_id in await coll.split_bounds(range_count - 1):
+            if not bounds or doc_id != bounds[-1]:
+                bounds.append(doc_id)
+    elif range_count > 1:
+        cursor = coll.aggregate([{"$sample": {"size": range_count - 1}},
+                                 {"$project": {"_id": 1}},
+                                 {"$sort": {"_id": 1}}])
+        async for doc in cursor:
+            if not bounds or doc['_id'] != bounds[-1]:
+                bounds.append(doc['_id'])
+    return bounds_to_ranges(bounds)
+
+
+def merge_step(src_item, dst_item):
+    """
+    合并比对的一步, src_item/dst_item为两端当前的(id, digest), 已读完的一端为None
+    返回(差异类型, _id, src是否前进, dst是否前进), 一致时差异类型为None
+    """
+    if dst_item is None or (src_item is not None and id_sort_key(src_item[0]) < id_sort_key(dst_item[0])):
+        return DIFF_MISSING_DST, src_item[0], True, False
+    if src_item is None or id_sort_key(dst_item[0]) < id_sort_key(src_item[0]):
+        return DIFF_MISSING_SRC, dst_item[0], False, True
+    return diff_kind(src_item[1], dst_item[1]), src_item[0], True, True
+
+
+def merge_digests(src_items, dst_items):
+    """
+    合并比对两个按_id升序的(id, digest)序列, 依次返回(差异类型, _id)
+    """
+    src_items, dst_items = iter(src_items), iter(dst_items)
+    src_item, dst_item = next(src_items, None), next(dst_items, None)
+    while src_item is not None or dst_item is not None:
+        kind, doc_id, src_next, dst_next = merge_step(src_item, dst_item)
+        if kind is not None:
+            yield kind, doc_id
+        if src_next:
+            src_item = next(src_items, None)
+        if dst_next:
+            dst_item = next(dst_items, None)
+
+
+def diff_kind(src_digest, dst_digest):
+    """
+    按_id查询两端摘要的差异类型, 不存在的一端为None; 一致(或两端都不存在)时返回None
+    """
+    if src_digest == dst_digest:
+        return None
+    if dst_digest is None:
+        return DIFF_MISSING_DST
+    if src_digest is None:
+        return DIFF_MISSING_SRC
+    return DIFF_CHANGED
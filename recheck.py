@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+"""
+Module Description: 疑似差异复核队列, 迁移同步追赶期间的差异多为复制延迟, 按退避间隔重新拉取, 多次复核仍不一致才记为差异
+Date: 2026/10/18
+Author: HuYuanCheng
+"""
+import heapq
+import itertools
+import time
+
+RECHECK_INTERVALS = "recheck_intervals"
+
+
+class Suspect:
+    __slots__ = ("doc_id", "kind", "first_seen", "attempt")
+
+    def __init__(self, doc_id, kind, first_seen):
+        self.doc_id = doc_id
+        self.kind = kind
+        self.first_seen = first_seen
+        self.attempt = 0
+
+
+class RecheckQueue:
+    """
+    第n次复核在上一次比对后intervals[n-1]秒进行, intervals全部用完仍不一致即确认差异
+    resolved/lags记录复核后一致的_id数量与从首次发现到一致的耗时(近似复制延迟)
+    """
+    def __init__(self, intervals):
+        self.intervals = list(intervals or [])
+        self.heap = []
+        self.seq = itertools.count()
+        self.suspects = 0
+        self.resolved = 0
+        self.confirmed = 0
+        self.lags = []
+
+    @property
+    def enabled(self):
+        return bool(self.intervals)
+
+    def __len__(self):
+        return len(self.heap)
+
+    def _push(self, suspect, now):
+        heapq.heappush(self.heap, (now + self.intervals[suspect.attempt], next(self.seq), suspect))
+
+    def add(self, doc_id, kind, now=None):
+        now = time.time() if now is None else now
+        self.suspects += 1
+        self._push(Suspect(doc_id, kind, now), now)
+
+    def wait_time(self, now=None):
+        if not self.heap:
+            return 0
+        now = time.time() if now is None else now
+        return max(self.heap[0][0] - now, 0)
+
+    def pop_due(self, limit, now=None):
+        now = time.time() if now is None else now
+        due = []
+        while self.heap and self.heap[0][0] <= now and len(due) < limit:
+            due.append(heapq.heappop(self.heap)[2])
+        return due
+
+    def resolve(self, suspect, now=None):
+        now = time.time() if now is None else now
+        self.resolved += 1
+        self.lags.append(now - suspect.first_seen)
+        return now - suspect.first_seen
+
+    def retry(self, suspect, kind, now=None):
+        """
+        复核仍不一致: 还有剩余次数时按下一个间隔重新入队返回True, 否则确认差异返回False
+        """
+        now = time.time() if now is None else now
+        suspect.kind = kind
+        suspect.attempt += 1
+        if suspect.attempt < len(self.intervals):
+            self._push(suspect, now)
+            return True
+        self.confirmed += 1
+        return False
+
+    def summary(self):
+        lags = sorted(self.lags)
+        if not lags:
+            return "suspects: {}, resolved: 0, confirmed: {}".format(self.suspects, self.confirmed)
+        return "suspects: {}, resolved: {}, confirmed: {}, lag avg: {:.3f}s, p95: {:.3f}s, max: {:.3f}s".format(
+            self.suspects, self.resolved, self.confirmed, sum(lags) / len(lags),
+            lags[min(int(len(lags) * 0.95), len(lags) - 1)], lags[-1])
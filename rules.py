@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+"""
+Module Description: collection级别的字段投影与规范化规则, 投影在查询时下推到服务端, 规范化在计算摘要前应用
+Date: 2026/10/18
+Author: HuYuanCheng
+"""
+import decimal
+import hashlib
+import json
+
+import bson
+from bson.decimal128 import Decimal128
+from bson.int64 import Int64
+
+COLLECTION_RULES = "collection_rules"
+
+RULE_INCLUDE = "include"
+RULE_EXCLUDE = "exclude"
+RULE_NUMERIC = "numeric"
+RULE_UNORDERED_ARRAYS = "unordered_arrays"
+
+
+INT64_MIN = -(1 << 63)
+INT64_MAX = (1 << 63) - 1
+
+
+def _numeric(value):
+    """
+    数值类型归一: int64范围内的整数值统一为int, 其余为float, 使int32/int64/double/decimal的同值相等
+    超出int64范围的整数值保留为float, 否则无法编码为BSON
+    """
+    if isinstance(value, Decimal128):
+        value = value.to_decimal()
+        if not value.is_finite():
+            return float(value)
+    if isinstance(value, decimal.Decimal):
+        if value == value.to_integral_value() and INT64_MIN <= value <= INT64_MAX:
+            return int(value)
+        return float(value)
+    if isinstance(value, float):
+        return int(value) if value.is_integer() and INT64_MIN <= value <= INT64_MAX else value
+    if isinstance(value, Int64):
+        return int(value)
+    return value
+
+
+def _array_key(value):
+    return bson.encode({"v": value})
+
+
+class CollectionRule:
+    """
+    include/exclude: 字段列表, 转换为find投影, 二者不能同时配置, _id始终返回
+    numeric: true时数值类型归一后再比较
+    unordered_arrays: 忽略元素顺序的数组字段路径列表(点分, 不含下标), true表示所有数组
+    """
+    def __init__(self, include=None, exclude=None, numeric=False, unordered_arrays=None):
+        if include and exclude:
+            raise ValueError("collection rule can not set both include and exclude")
+        self.include = [f for f in include or [] if f != '_id']
+        self.exclude = [f for f in exclude or [] if f != '_id']
+        self.numeric = numeric
+        self.unordered = unordered_arrays
+
+    @classmethod
+    def from_configure(cls, configure, db, coll):
+        """
+        按"db.coll"或"coll"查找规则, 未配置时返回None
+        """
+        rules = configure.get(COLLECTION_RULES) or {}
+        rule = rules.get("{}.{}".format(db, coll), rules.get(coll))
+        if not rule:
+            return None
+        return cls(rule.get(RULE_INCLUDE), rule.get(RULE_EXCLUDE), rule.get(RULE_NUMERIC, False),
+                   rule.get(RULE_UNORDERED_ARRAYS))
+
+    @property
+    def projection(self):
+        if self.include:
+            return dict((field, 1) for field in self.include)
+        if self.exclude:
+            return dict((field, 0) for field in self.exclude)
+        return None
+
+    @property
+    def normalizing(self):
+        return bool(self.numeric or self.unordered)
+
+    @property
+    def tag(self):
+        """
+        规则标识, 写入快照文件用于校验两个阶段规则一致
+        """
+        data = json.dumps([self.include, self.exclude, bool(self.numeric), self.unordered], sort_keys=True)
+        return hashlib.md5(data.encode('utf-8')).hexdigest()[:6]
+
+    def _unordered(self, path):
+        if self.unordered is True:
+            return True
+        return bool(self.unordered) and path in self.unordered
+
+    def normalize(self, value, path=""):
+        if isinstance(value, dict):
+            return dict((key, self.normalize(item, "{}.{}".format(path, key) if path else key))
+                        for key, item in value.items())
+        if isinstance(value, list):
+            items = [self.normalize(item, path) for item in value]
+            if self._unordered(path):
+                items.sort(key=_array_key)
+            return items
+        if self.numeric and not isinstance(value, bool):
+            return _numeric(value)
+        return value
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+
+"""
+Module Description: 抽样_id来源, 文本_id文件转换为定长二进制索引, 任意起始下标直接seek, 按批次读取带类型的_id
+Date: 2026/10/18
+Author: HuYuanCheng
+"""
+import array
+import os
+import re
+import struct
+import sys
+
+from bson import ObjectId
+
+from snapshot import KEY_INT64, KEY_OBJECTID, KEY_STRING
+
+SAMPLE_ID_TYPE = "sample_id_type"
+
+ID_TYPE_AUTO = "auto"
+ID_TYPES = {"int": KEY_INT64, "objectid": KEY_OBJECTID, "string": KEY_STRING}
+# 生成索引时的sample_id_type写入文件头, 0为未记录(旧索引)
+_ID_TYPE_CODES = {ID_TYPE_AUTO: 1, "int": 2, "objectid": 3, "string": 4}
+_KEY_TYPE_CODES = {KEY_INT64: 2, KEY_OBJECTID: 3, KEY_STRING: 4}
+
+SAMPLE_INDEX_MAGIC = b'MCSIDX01'
+SAMPLE_INDEX_SUFFIX = '.idx'
+
+# magic | key type | key width | id count | sample_id_type
+_HEADER = struct.Struct('<8sBHQB')
+HEADER_SIZE = 32
+READ_RECORDS = 8192
+
+_INT_PATTERN = re.compile(r'^-?\d+$')
+_OBJECTID_PATTERN = re.compile(r'^[0-9a-fA-F]{24}$')
+
+
+def detect_id_type(text):
+    if _INT_PATTERN.match(text):
+        return KEY_INT64
+    if _OBJECTID_PATTERN.match(text):
+        return KEY_OBJECTID
+    return KEY_STRING
+
+
+def parse_id(text, key_type=None):
+    """
+    文本_id转换为对应类型, key_type为None时按内容判断
+    """
+    if not isinstance(text, str):
+        return text
+    text = text.strip()
+    key_type = key_type or detect_id_type(text)
+    if key_type == KEY_INT64:
+        return int(text)
+    if key_type == KEY_OBJECTID:
+        return ObjectId(text)
+    return text
+
+
+def _iter_lines(path):
+    with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield line
+
+
+def build_sample_index(path, index_path, id_type=ID_TYPE_AUTO):
+    """
+    文本_id文件(每行一个_id, 忽略空行)转换为二进制索引: int64按小端8字节, ObjectId为12字节, 字符串按最长_id补齐
+    """
+    key_type = ID_TYPES.get(id_type)
+    id_type_code = _ID_TYPE_CODES.get(id_type, _ID_TYPE_CODES[ID_TYPE_AUTO])
+    width = 0
+    count = 0
+    for line in _iter_lines(path):
+        if key_type is None:
+            key_type = detect_id_type(line)
+        if key_type == KEY_STRING:
+            width = max(width, len(line.encode('utf-8')))
+        count += 1
+    key_type = key_type or KEY_INT64
+    if key_type == KEY_INT64:
+        width = 8
+    elif key_type == KEY_OBJECTID:
+        width = 12
+
+    tmp_path = '{}.{}.tmp'.format(index_path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        f.write(_HEADER.pack(SAMPLE_INDEX_MAGIC, key_type, width, count, id_type_code).ljust(HEADER_SIZE, b'\x00'))
+        records = []
+        for line_no, line in enumerate(_iter_lines(path)):
+            try:
+                if key_type == KEY_INT64:
+                    records.append(struct.pack('<q', int(line)))
+                elif key_type == KEY_OBJECTID:
+                    records.append(ObjectId(line).binary)
+                else:
+                    records.append(line.encode('utf-8').ljust(width, b'\x00'))
+            except Exception as e:
+                os.remove(tmp_path)
+                raise ValueError("invalid sample id {!r} at line {}: {}".format(line, line_no, e))
+            if len(records) >= READ_RECORDS:
+                f.write(b''.join(records))
+                records = []
+        f.write(b''.join(records))
+    os.replace(tmp_path, index_path)
+    return count
+
+
+def write_sample_index(ids, index_path):
+    """
+    已抽取的_id直接写为二进制索引, _id需同为int、ObjectId或字符串
+    """
+    key_type, width = KEY_INT64, 8
+    if ids and isinstance(ids[0], ObjectId):
+        key_type, width = KEY_OBJECTID, 12
+    elif ids and isinstance(ids[0], str):
+        key_type, width = KEY_STRING, max(len(x.encode('utf-8')) for x in ids if isinstance(x, str))
+    records = []
+    for doc_id in ids:
+        if key_type == KEY_INT64 and isinstance(doc_id, int) and not isinstance(doc_id, bool):
+            records.append(struct.pack('<q', doc_id))
+        elif key_type == KEY_OBJECTID and isinstance(doc_id, ObjectId):
+            records.append(doc_id.binary)
+        elif key_type == KEY_STRING and isinstance(doc_id, str):
+            records.append(doc_id.encode('utf-8').ljust(width, b'\x00'))
+        else:
+            raise ValueError("sampled _id {!r} can not be stored in sample index, _id must all be int, "
+                             "ObjectId or string".format(doc_id))
+
+    tmp_path = '{}.{}.tmp'.format(index_path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        f.write(_HEADER.pack(SAMPLE_INDEX_MAGIC, key_type, width, len(ids), _KEY_TYPE_CODES[key_type]).ljust(
+            HEADER_SIZE, b'\x00'))
+        f.write(b''.join(records))
+    os.replace(tmp_path, index_path)
+    return len(ids)
+
+
+def _index_id_type(index_path):
+    """
+    索引文件头记录的sample_id_type, 文件无效时返回None
+    """
+    with open(index_path, 'rb') as f:
+        header = f.read(_HEADER.size)
+    if len(header) < _HEADER.size or not header.startswith(SAMPLE_INDEX_MAGIC):
+        return None
+    return _HEADER.unpack(header)[4]
+
+
+class SampleSource:
+    """
+    读取二进制_id索引, 第i个_id位于HEADER_SIZE + i * width, 不需要从文件开头扫描
+    """
+    def __init__(self, index_path):
+        self.path = index_path
+        self.file = open(index_path, 'rb')
+        magic, self.key_type, self.width, self.count, self.id_type_code = _HEADER.unpack(
+            self.file.read(_HEADER.size))
+        if magic != SAMPLE_INDEX_MAGIC:
+            self.close()
+            raise ValueError("invalid sample index file: {}".format(index_path))
+
+    @classmethod
+    def open(cls, path, id_type=ID_TYPE_AUTO):
+        """
+        path为文本_id文件时使用同目录下的.idx索引, 索引不存在、比文本文件旧或生成时的sample_id_type不同时重新生成
+        """
+        if path.endswith(SAMPLE_INDEX_SUFFIX):
+            return cls(path)
+        index_path = path + SAMPLE_INDEX_SUFFIX
+        if not os.path.exists(index_path) or os.path.getmtime(index_path) < os.path.getmtime(path) \
+                or _index_id_type(index_path) != _ID_TYPE_CODES.get(id_type, _ID_TYPE_CODES[ID_TYPE_AUTO]):
+            build_sample_index(path, index_path, id_type)
+        return cls(index_path)
+
+    def __len__(self):
+        return self.count
+
+    def _decode(self, data):
+        if self.key_type == KEY_INT64:
+            ids = array.array('q')
+            ids.frombytes(data)
+            if sys.byteorder == 'big':
+                ids.byteswap()
+            return ids.tolist()
+        width = self.width
+        if self.key_type == KEY_OBJECTID:
+            return [ObjectId(data[pos:pos + width]) for pos in range(0, len(data), width)]
+        return [data[pos:pos + width].rstrip(b'\x00').decode('utf-8') for pos in range(0, len(data), width)]
+
+    def batches(self, start, count, batch):
+        """
+        从第start个_id起按batch个一批读取, 共count个, 返回(相对start的下标, _id列表)
+        """
+        end = min(self.count, start + count)
+        pos = max(0, start)
+        self.file.seek(HEADER_SIZE + pos * self.width)
+        while pos < end:
+            size = min(batch, end - pos)
+            yield pos - start, self._decode(self.file.read(size * self.width))
+            pos += size
+
+    def close(self):
+        self.file.close()
+
+
+if __name__ == '__main__':
+    # 预先生成索引: python samples.py sample_list.txt [auto|int|objectid|string]
+    sample_path = sys.argv[1]
+    print("sample index {} ids: {}".format(
+        sample_path + SAMPLE_INDEX_SUFFIX,
+        build_sample_index(sample_path, sample_path + SAMPLE_INDEX_SUFFIX,
+                           sys.argv[2] if len(sys.argv) > 2 else ID_TYPE_AUTO)))
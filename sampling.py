@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+
+"""
+Module Description: 服务端抽样策略, 不依赖外部_id文件: $sample均匀随机、按_id区间分层、按_id哈希固定比例, 并估算差异率的置信区间
+Date: 2026/10/18
+Author: HuYuanCheng
+"""
+import hashlib
+import math
+from statistics import NormalDist
+
+import bson
+from bson.int64 import Int64
+
+from follow import doc_key
+from ranges import id_range_query, id_sort_key, split_id_ranges
+
+SAMPLE_STRATEGY = "sample_strategy"
+SAMPLE_FRACTION = "sample_fraction"
+SAMPLE_CONFIDENCE = "sample_confidence"
+
+STRATEGY_FILE = "file"
+STRATEGY_RANDOM = "random"
+STRATEGY_STRATIFIED = "stratified"
+STRATEGY_HASH = "hash"
+SAMPLE_STRATEGIES = (STRATEGY_FILE, STRATEGY_RANDOM, STRATEGY_STRATIFIED, STRATEGY_HASH)
+
+HASH_SPACE = 1 << 64
+ID_SCAN_BATCH = 10000
+
+
+def sample_size(configure, doc_count):
+    """
+    抽样数量: 配置了sample_fraction时按估算文档数的比例, 否则为sample_count
+    """
+    fraction = configure.get(SAMPLE_FRACTION, 0)
+    if fraction > 0:
+        return min(doc_count, int(math.ceil(doc_count * fraction)))
+    return min(doc_count, configure["sample_count"])
+
+
+def hash_selected(doc_id, threshold):
+    """
+    _id的BSON编码取8字节blake2b, 小于threshold即入选; 与进程、主机无关, 多次运行选中的_id相同
+    """
+    digest = hashlib.blake2b(bson.encode({"_id": doc_id}), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') < threshold
+
+
+def sorted_ids(ids):
+    unique = {}
+    for doc_id in ids:
+        unique.setdefault(doc_key(doc_id), doc_id)
+    return sorted(unique.values(), key=id_sort_key)
+
+
+async def random_ids(coll, size):
+    """
+    $sample均匀随机抽取size个_id, 抽样数量小于集合5%时服务端使用随机游标, 不扫描全表
+    """
+    if size <= 0:
+        return []
+    cursor = coll.aggregate([{"$sample": {"size": size}},
+                             {"$project": {"_id": 1}},
+                             {"$sort": {"_id": 1}}], allowDiskUse=True)
+    return [doc['_id'] async for doc in cursor]
+
+
+async def stratified_ids(coll, size, strata):
+    """
+    按$sample切分点将集合分为strata个文档数相近的_id区间, 每个区间各自$sample同样数量的_id,
+    保证_id空间的每一段都被覆盖; 区间由_id索引限定, 但$match之后的$sample不能使用随机游标,
+    服务端需读取区间内的全部文档再抽取, 总读取量与集合大小相当, 只有抽中的_id返回客户端
+    """
+    if size <= 0:
+        return []
+    ranges = await split_id_ranges(coll, min(strata, size))
+    per_range = int(math.ceil(size / len(ranges)))
+    ids = []
+    for lower, upper in ranges:
+        cursor = coll.aggregate([{"$match": id_range_query(lower, upper)},
+                                 {"$project": {"_id": 1}},
+                                 {"$sample": {"size": per_range}}], allowDiskUse=True)
+        ids.extend([doc['_id'] async for doc in cursor])
+    return ids
+
+
+def hashed_threshold(fraction):
+    """
+    $toHashedIndexKey返回有符号int64, 小于该值的_id约占fraction
+    """
+    return Int64(int(HASH_SPACE * fraction) - HASH_SPACE // 2)
+
+
+async def hash_ids(coll, fraction):
+    """
+    服务端按$toHashedIndexKey(_id)过滤, 只返回入选的_id: 服务端仍需遍历全部文档, 但不向客户端传输未入选的_id;
+    哈希与服务端进程、主机无关, 两端与多次运行选中的_id相同
+    collection提供split_bounds(mongodump文件数据源)时在本地按_id升序读取, 按blake2b(_id)保留
+    """
+    fraction = min(max(fraction, 0), 1)
+    if fraction == 0:
+        return []
+    if hasattr(coll, "split_bounds"):
+        threshold = int(HASH_SPACE * fraction)
+        cursor = coll.find({}, {"_id": 1}).sort("_id", 1).batch_size(ID_SCAN_BATCH)
+        return [doc['_id'] async for doc in cursor if hash_selected(doc['_id'], threshold)]
+    pipeline = [{"$project": {"_id": 1}}]
+    if fraction < 1:
+        pipeline.insert(0, {"$match": {"$expr": {"$lt": [{"$toHashedIndexKey": "$_id"},
+                                                         hashed_threshold(fraction)]}}})
+    cursor = coll.aggregate(pipeline, allowDiskUse=True)
+    return [doc['_id'] async for doc in cursor]
+
+
+async def sample_ids(configure, src_coll, dst_coll, doc_count, strata):
+    """
+    按sample_strategy抽取_id, 返回去重并按_id排序的列表; dst_coll不为None时hash策略同时扫描dst,
+    dst多出的文档同样按比例入选
+    """
+    strategy = configure.get(SAMPLE_STRATEGY, STRATEGY_FILE)
+    if strategy == STRATEGY_RANDOM:
+        return sorted_ids(await random_ids(src_coll, sample_size(configure, doc_count)))
+    if strategy == STRATEGY_STRATIFIED:
+        return sorted_ids(await stratified_ids(src_coll, sample_size(configure, doc_count), strata))
+    if strategy == STRATEGY_HASH:
+        fraction = configure.get(SAMPLE_FRACTION, 0)
+        if fraction <= 0:
+            fraction = configure["sample_count"] / max(doc_count, 1)
+        ids = await hash_ids(src_coll, fraction)
+        if dst_coll is not None:
+            ids.extend(await hash_ids(dst_coll, fraction))
+        return sorted_ids(ids)
+    raise ValueError("unknown sample_strategy: {}, expected one of {}".format(strategy, SAMPLE_STRATEGIES))
+
+
+def divergence_interval(diffs, sampled, confidence=0.95):
+    """
+    差异率的Wilson置信区间, 返回(下界, 上界); 没有差异时上界约为3.84/sampled(95%)
+    """
+    if sampled <= 0:
+        return 0.0, 1.0
+    z = NormalDist().inv_cdf(1 - (1 - confidence) / 2)
+    rate = diffs / sampled
+    denominator = 1 + z * z / sampled
+    center = (rate + z * z / (2 * sampled)) / denominator
+    margin = z * math.sqrt(rate * (1 - rate) / sampled + z * z / (4 * sampled * sampled)) / denominator
+    return max(0.0, center - margin), min(1.0, center + margin)
+
+
+def divergence_summary(diffs, sampled, doc_count, confidence=0.95):
+    """
+    抽样比对结果: 差异率、置信区间与按上界估算的整个集合差异文档数
+    """
+    lower, upper = divergence_interval(diffs, sampled, confidence)
+    return "sampled: {}, divergent: {}, rate: {:.4%}, {:.0%} confidence interval: [{:.4%}, {:.4%}], " \
+           "estimated divergent docs: <= {} of {}".format(sampled, diffs, diffs / max(sampled, 1), confidence,
+                                                          lower, upper, int(math.ceil(upper * doc_count)), doc_count)
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+"""
+Module Description: 多collection调度, 按估算文档数从大到小并发比对多个collection, 每个collection都执行完成后汇总结果表
+Date: 2026/10/18
+Author: HuYuanCheng
+"""
+import asyncio
+import contextvars
+import time
+
+COLLECTION_CONCURRENCY = "collection_concurrency"
+
+collection_context = contextvars.ContextVar('State of collection', default=None)
+
+
+class CollectionState:
+    """
+    一个collection的比对状态与结果, fields为runner中按collection区分的属性(见CollectionField)的初始值
+    """
+    def __init__(self, db, coll, size=0, **fields):
+        self.db = db
+        self.coll = coll
+        self.scope = "{}.{}".format(db, coll)
+        self.size = size
+        self.ok = None
+        self.resumed = False
+        self.docs = 0
+        self.diffs = 0
+        self.seconds = 0.0
+        self.error = ""
+        self.__dict__.update(fields)
+
+
+class CollectionField:
+    """
+    runner上按collection区分的属性: 在collection任务中读写该collection的CollectionState,
+    不在collection任务中时与普通实例属性相同
+    """
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, runner, owner=None):
+        if runner is None:
+            return self
+        state = collection_context.get()
+        if state is None:
+            return runner.__dict__[self.name]
+        return getattr(state, self.name)
+
+    def __set__(self, runner, value):
+        state = collection_context.get()
+        if state is None:
+            runner.__dict__[self.name] = value
+        else:
+            setattr(state, self.name, value)
+
+
+def count_collection(docs=0, diffs=0):
+    """
+    累计当前collection本次处理的文档数与差异数, 不在collection任务中时忽略
+    """
+    state = collection_context.get()
+    if state is not None:
+        state.docs += docs
+        state.diffs += diffs
+
+
+def run_in(state, func, *args):
+    """
+    在state所属collection的上下文中同步执行func, 用于退出时处理各collection未落盘的数据
+    """
+    token = collection_context.set(state)
+    try:
+        return func(*args)
+    finally:
+        collection_context.reset(token)
+
+
+async def estimate_count(coll):
+    """
+    估算文档数, 返回(文档数, 错误信息); 出错(如dump文件不存在)时文档数为0, 由run_collections将该collection记为失败
+    """
+    try:
+        return await coll.estimated_document_count(), ""
+    except Exception as e:
+        return 0, str(e)
+
+
+async def run_collections(states, handler, concurrency, log_error):
+    """
+    按估算文档数从大到小启动handler(state), 最多concurrency个collection同时进行;
+    单个collection出错只记为失败, 其余collection继续
+    """
+    semaphore = asyncio.Semaphore(max(concurrency, 1))
+
+    async def run(state):
+        if state.error:
+            # 调度前(估算文档数时)已出错
+            state.ok = False
+            log_error("ERROR => collection [{}] failed, msg: {}".format(state.scope, state.error),
+                      event="collection", ns=state.scope, ok=False)
+            return
+        async with semaphore:
+            collection_context.set(state)
+            start = time.time()
+            try:
+                await handler(state)
+            except Exception as e:
+                state.ok = False
+                state.error = str(e)
+                log_error("ERROR => collection [{}] failed, msg: {}".format(state.scope, e),
+                          event="collection", ns=state.scope, ok=False)
+            state.seconds = time.time() - start
+
+    ordered = sorted(states, key=lambda state: state.size, reverse=True)
+    await asyncio.gather(*[asyncio.create_task(run(state)) for state in ordered])
+
+
+def result_table(states):
+    """
+    每个collection一行: ns、结果、估算文档数、本次处理文档数、差异数、耗时
+    """
+    width = max([len(state.scope) for state in states] + [2])
+    lines = ["{}  {:<8}  {:>12}  {:>12}  {:>8}  {:>10}".format(
+        "ns".ljust(width), "result", "estimated", "docs", "diffs", "seconds")]
+    for state in states:
+        if state.ok is None:
+            result = "-"
+        else:
+            result = "pass" if state.ok else ("error" if state.error else "fail")
+        if state.resumed:
+            # 续跑时沿用上次的结果
+            result += "*"
+        lines.append("{}  {:<8}  {:>12}  {:>12}  {:>8}  {:>10.3f}".format(
+            state.scope.ljust(width), result, state.size, state.docs, state.diffs, state.seconds))
+    return lines
@@ -0,0 +1,512 @@
+# -*- coding: utf-8 -*-
+
+"""
+Module Description: 分步模式src摘要快照文件, 按_id排序的定长二进制记录 + 区间索引, 读取时内存映射二分查找;
+                    同样布局的内存摘要表, 按批查找与求差集
+Date: 2026/10/18
+Author: HuYuanCheng
+"""
+import array
+import bisect
+import heapq
+import mmap
+import os
+import shutil
+import struct
+
+from bson import ObjectId
+
+from digest import DIGEST_SIZE
+from ranges import id_sort_key
+
+SNAPSHOT_MAGIC = b'MCSNAP01'
+SNAPSHOT_VERSION = 1
+SNAPSHOT_KEY_WIDTH = "snapshot_key_width"
+
+KEY_INT64 = 1
+KEY_OBJECTID = 2
+KEY_STRING = 3
+
+# magic | version | key type | key width | digest width | digest tag | record count | index stride | index offset
+_HEADER = struct.Struct('<8sHBHH16sQIQ')
+HEADER_SIZE = 64
+INDEX_STRIDE = 4096
+RUN_RECORDS = 1 << 20
+_RUN_META = struct.Struct('<BH')
+_INT64_KEY = struct.Struct('>Q')
+_INT64_BIAS = 1 << 63
+
+
+class KeyCodec:
+    """
+    _id与定长key互转, key按字节序比较与mongodb同类型_id的排序一致
+    """
+    def __init__(self, key_type, width):
+        self.key_type = key_type
+        self.width = width
+
+    @classmethod
+    def for_id(cls, doc_id, string_width=32):
+        if isinstance(doc_id, int) and not isinstance(doc_id, bool):
+            return cls(KEY_INT64, 8)
+        if isinstance(doc_id, ObjectId):
+            return cls(KEY_OBJECTID, 12)
+        if isinstance(doc_id, str):
+            return cls(KEY_STRING, string_width)
+        raise ValueError("unsupported _id type for snapshot: {}".format(type(doc_id).__name__))
+
+    def encode(self, doc_id):
+        if self.key_type == KEY_INT64:
+            if not isinstance(doc_id, int) or isinstance(doc_id, bool):
+                raise ValueError("snapshot expects int64 _id, got {!r}".format(doc_id))
+            return _INT64_KEY.pack(doc_id + _INT64_BIAS)
+        if self.key_type == KEY_OBJECTID:
+            if not isinstance(doc_id, ObjectId):
+                raise ValueError("snapshot expects ObjectId _id, got {!r}".format(doc_id))
+            return doc_id.binary
+        if not isinstance(doc_id, str):
+            raise ValueError("snapshot expects string _id, got {!r}".format(doc_id))
+        data = doc_id.encode('utf-8')
+        if len(data) > self.width or b'\x00' in data:
+            raise ValueError("string _id {!r} does not fit snapshot key width {}".format(doc_id, self.width))
+        return data.ljust(self.width, b'\x00')
+
+    def decode(self, key):
+        if self.key_type == KEY_INT64:
+            return _INT64_KEY.unpack(key)[0] - _INT64_BIAS
+        if self.key_type == KEY_OBJECTID:
+            return ObjectId(bytes(key))
+        return bytes(key).rstrip(b'\x00').decode('utf-8')
+
+    def accepts(self, doc_id):
+        return self.encode_or_none(doc_id) is not None
+
+    def encode_or_none(self, doc_id):
+        try:
+            return self.encode(doc_id)
+        except ValueError:
+            return None
+
+
+class SortedKeyTable:
+    """
+    按定长key升序排列的(key, value)记录, 子类提供count、codec、key_at、value_at与bisect_key(key, lo)
+    按批查找时先将查询_id按key排序, 每个key从上一个命中位置继续二分, 一批_id顺序访问一遍记录
+    """
+    def __len__(self):
+        return self.count
+
+    def id_at(self, pos):
+        return self.codec.decode(self.key_at(pos))
+
+    def position(self, doc_id):
+        """
+        _id在表中的插入位置, 类型与表不一致时按mongodb类型顺序落在两端
+        """
+        key = self.codec.encode_or_none(doc_id)
+        if key is not None:
+            return self.bisect_key(key)
+        if self.count == 0:
+            return 0
+        return 0 if id_sort_key(doc_id) < id_sort_key(self.id_at(0)) else self.count
+
+    def range_positions(self, lower, upper):
+        start = 0 if lower is None else self.position(lower)
+        end = self.count if upper is None else self.position(upper)
+        return start, max(start, end)
+
+    def get(self, doc_id):
+        key = self.codec.encode_or_none(doc_id)
+        if key is None:
+            return None
+        pos = self.bisect_key(key)
+        if pos < self.count and self.key_at(pos) == key:
+            return self.value_at(pos)
+        return None
+
+    def search(self, ids):
+        """
+        按批查找, 返回与ids一一对应的记录下标, 不存在时为-1
+        """
+        positions = [-1] * len(ids)
+        keys = []
+        for i, doc_id in enumerate(ids):
+            key = self.codec.encode_or_none(doc_id)
+            if key is not None:
+                keys.append((key, i))
+        keys.sort()
+        pos = 0
+        for key, i in keys:
+            pos = self.bisect_key(key, pos)
+            if pos < self.count and self.key_at(pos) == key:
+                positions[i] = pos
+        return positions
+
+    def lookup(self, ids):
+        """
+        按批查找, 返回与ids一一对应的value, 不存在时为None
+        """
+        return [None if pos < 0 else self.value_at(pos) for pos in self.search(ids)]
+
+    def difference(self, ids):
+        """
+        ids中不在表中的_id, 保持ids的顺序
+        """
+        return [doc_id for doc_id, pos in zip(ids, self.search(ids)) if pos < 0]
+
+    def items(self, start, end):
+        return [(self.id_at(pos), self.value_at(pos)) for pos in range(start, end)]
+
+
+def _iter_run(path, record_size, chunk_records=8192):
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(record_size * chunk_records)
+            if not chunk:
+                break
+            for pos in range(0, len(chunk), record_size):
+                yield chunk[pos:pos + record_size]
+
+
+class SnapshotWriter:
+    """
+    增量写入(id, digest): 内存中累积到run_records条后排序落盘为一个run, close时多路归并为最终文件
+    resume为True时保留上次中断前已落盘的run继续写入
+    part不为None时为多进程写入同一快照的其中一部分, 只落盘run不归并, 由主进程以resume方式加载全部run后close
+    parts不为None时只加载这些part写入的run, 其他part(如租约到期后被放弃的写入)的run被忽略
+    """
+    def __init__(self, path, digest_tag, string_width=32, run_records=RUN_RECORDS, resume=False, part=None,
+                 parts=None):
+        self.path = path
+        self.digest_tag = digest_tag
+        self.string_width = string_width
+        self.run_records = run_records
+        self.run_dir = path + '.runs'
+        self.run_prefix = 'run_' if part is None else '{}_run_'.format(part)
+        self.part = part
+        self.parts = parts
+        self.codec = None
+        self.buffer = []
+        self.runs = []
+        self.count = 0
+        if resume and os.path.exists(self.run_dir):
+            self._load_runs()
+        elif part is not None:
+            for run_path in self._run_files():
+                os.remove(run_path)
+        elif os.path.exists(self.run_dir):
+            shutil.rmtree(self.run_dir)
+
+    def _run_files(self):
+        if not os.path.exists(self.run_dir):
+            return []
+        if self.part is not None:
+            prefixes = (self.run_prefix,)
+        elif self.parts is not None:
+            prefixes = tuple('{}_run_'.format(part) for part in self.parts)
+        else:
+            prefixes = ('',)
+        return sorted(os.path.join(self.run_dir, name) for name in os.listdir(self.run_dir)
+                      if name.startswith(prefixes) and name.endswith('.bin'))
+
+    def missing_parts(self, parts):
+        """
+        parts中没有任何run文件的part, 如各主机写入的快照目录并不共享时
+        """
+        names = os.listdir(self.run_dir) if os.path.exists(self.run_dir) else []
+        return [part for part in parts
+                if not any(name.startswith('{}_run_'.format(part)) and name.endswith('.bin') for name in names)]
+
+    def _load_runs(self):
+        meta_path = os.path.join(self.run_dir, 'meta')
+        if not os.path.exists(meta_path):
+            return
+        with open(meta_path, 'rb') as f:
+            self.codec = KeyCodec(*_RUN_META.unpack(f.read(_RUN_META.size)))
+        self.runs = self._run_files()
+
+    def add(self, items):
+        for doc_id, digest in items:
+            if self.codec is None:
+                self.codec = KeyCodec.for_id(doc_id, self.string_width)
+            self.buffer.append(self.codec.encode(doc_id) + digest)
+        if len(self.buffer) >= self.run_records:
+            self.flush_run()
+
+    def flush_run(self):
+        if not self.buffer:
+            return
+        self.buffer.sort()
+        os.makedirs(self.run_dir, exist_ok=True)
+        meta_path = os.path.join(self.run_dir, 'meta')
+        if not os.path.exists(meta_path):
+            with open(meta_path + '.' + self.run_prefix, 'wb') as f:
+                f.write(_RUN_META.pack(self.codec.key_type, self.codec.width))
+            os.replace(meta_path + '.' + self.run_prefix, meta_path)
+        run_path = self._next_run_path()
+        tmp_path = run_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(b''.join(self.buffer))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, run_path)
+        self.runs.append(run_path)
+        self.buffer = []
+
+    def _next_run_path(self):
+        index = len(self.runs)
+        while os.path.exists(os.path.join(self.run_dir, '{}{}.bin'.format(self.run_prefix, index))):
+            index += 1
+        return os.path.join(self.run_dir, '{}{}.bin'.format(self.run_prefix, index))
+
+    def close(self):
+        """
+        归并所有run写出最终文件, 重复_id只保留一条, 返回记录数
+        """
+        self.flush_run()
+        codec = self.codec or KeyCodec(KEY_INT64, 8)
+        record_size = codec.width + DIGEST_SIZE
+        tmp_path = self.path + '.tmp'
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+
+        index = []
+        count = 0
+        last_key = None
+        with open(tmp_path, 'wb') as f:
+            f.write(b'\x00' * HEADER_SIZE)
+            pending = []
+            for record in heapq.merge(*[_iter_run(run, record_size) for run in self.runs]):
+                key = record[:codec.width]
+                if key == last_key:
+                    continue
+                if count % INDEX_STRIDE == 0:
+                    index.append(key)
+                last_key = key
+                pending.append(record)
+                count += 1
+                if len(pending) >= 8192:
+                    f.write(b''.join(pending))
+                    pending = []
+            f.write(b''.join(pending))
+            index_offset = f.tell()
+            f.write(b''.join(index))
+            f.seek(0)
+            f.write(_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, codec.key_type, codec.width, DIGEST_SIZE,
+                                 self.digest_tag.encode('ascii'), count, INDEX_STRIDE, index_offset))
+        os.replace(tmp_path, self.path)
+        shutil.rmtree(self.run_dir, ignore_errors=True)
+        self.count = count
+        return count
+
+
+class SnapshotReader(SortedKeyTable):
+    """
+    内存映射读取快照文件, 单个_id查找先在区间索引中二分定位块, 再在块内二分
+    """
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, key_type, key_width, digest_width, digest_tag,
+         self.count, self.stride, index_offset) = _HEADER.unpack_from(self.mm, 0)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            self.close()
+            raise ValueError("invalid snapshot file: {}".format(path))
+        self.digest_tag = digest_tag.rstrip(b'\x00').decode('ascii')
+        self.codec = KeyCodec(key_type, key_width)
+        self.key_width = key_width
+        self.digest_width = digest_width
+        self.record_size = key_width + digest_width
+        index_count = (self.count + self.stride - 1) // self.stride
+        self.index = [self.mm[index_offset + i * key_width:index_offset + (i + 1) * key_width]
+                      for i in range(index_count)]
+
+    def key_at(self, pos):
+        offset = HEADER_SIZE + pos * self.record_size
+        return self.mm[offset:offset + self.key_width]
+
+    def digest_at(self, pos):
+        offset = HEADER_SIZE + pos * self.record_size + self.key_width
+        return self.mm[offset:offset + self.digest_width]
+
+    value_at = digest_at
+
+    def bisect_key(self, key, lo=0):
+        """
+        返回lo之后第一个 >= key 的记录下标
+        """
+        block = bisect.bisect_right(self.index, key) - 1
+        if block < 0:
+            return lo
+        hi = min(block * self.stride + self.stride, self.count)
+        lo = max(lo, block * self.stride)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.key_at(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def digests(self, start, end):
+        for pos in range(start, end):
+            yield self.digest_at(pos)
+
+    def close(self):
+        self.mm.close()
+        self.file.close()
+
+
+class FixedKeys:
+    """
+    bytearray中连续存放的定长key, 作为序列供bisect在C层二分
+    """
+    def __init__(self, width, data=None):
+        self.width = width
+        self.data = data if data is not None else bytearray()
+
+    def __len__(self):
+        return len(self.data) // self.width
+
+    def __getitem__(self, pos):
+        return bytes(self.data[pos * self.width:(pos + 1) * self.width])
+
+    def append(self, key):
+        self.data += key
+
+    @property
+    def nbytes(self):
+        return len(self.data)
+
+
+class DigestTable(SortedKeyTable):
+    """
+    内存中的紧凑摘要表, 记录布局与快照文件相同: int64 _id存放在array('q')中, ObjectId/字符串_id的定长key
+    连续存放在一个bytearray中, value在另一个bytearray中; int64 _id + 16字节摘要每条24字节, 不为每条记录创建Python对象
+    insert_many写入的每一批排序后暂存为一个有序run, 首次查找时与已有记录一次多路归并
+    """
+    def __init__(self, codec=None, value_width=DIGEST_SIZE, string_width=32):
+        self.codec = None
+        self.value_width = value_width
+        self.string_width = string_width
+        self.keys = None
+        self.values = bytearray()
+        self.size = 0
+        self.runs = []
+        if codec is not None:
+            self._init_keys(codec)
+
+    def _init_keys(self, codec):
+        self.codec = codec
+        self.keys = array.array('q') if codec.key_type == KEY_INT64 else FixedKeys(codec.width)
+
+    @classmethod
+    def build(cls, items, value_width=DIGEST_SIZE, string_width=32, codec=None):
+        """
+        一次写入全部记录, 只排序、归并一次
+        """
+        table = cls(codec, value_width, string_width)
+        table.insert_many(items)
+        table.compact()
+        return table
+
+    @property
+    def count(self):
+        if self.runs:
+            self.compact()
+        return self.size
+
+    @property
+    def nbytes(self):
+        self.compact()
+        if self.keys is None:
+            return 0
+        keys = self.keys.itemsize * len(self.keys) if self.codec.key_type == KEY_INT64 else self.keys.nbytes
+        return keys + len(self.values)
+
+    def _probe(self, key):
+        # int64表中直接按_id数值比较
+        return self.codec.decode(key) if self.codec.key_type == KEY_INT64 else bytes(key)
+
+    def key_at(self, pos):
+        return self.codec.encode(self.keys[pos]) if self.codec.key_type == KEY_INT64 else self.keys[pos]
+
+    def id_at(self, pos):
+        return self.keys[pos] if self.codec.key_type == KEY_INT64 else self.codec.decode(self.keys[pos])
+
+    def value_at(self, pos):
+        return bytes(self.values[pos * self.value_width:(pos + 1) * self.value_width])
+
+    def bisect_key(self, key, lo=0):
+        self.compact()
+        if self.codec is None:
+            return 0
+        return bisect.bisect_left(self.keys, self._probe(key), lo)
+
+    def search(self, ids):
+        self.compact()
+        if self.codec is None:
+            return [-1] * len(ids)
+        return super().search(ids)
+
+    def insert_many(self, items):
+        """
+        批量写入(id, value): 本批记录按key排序后暂存为一个run, 不重建整张表; 同一_id保留最后写入的value
+        codec为None时按第一个_id的类型确定, 类型不一致的_id抛出ValueError
+        """
+        keys = []
+        values = bytearray()
+        for doc_id, value in items:
+            if self.codec is None:
+                self._init_keys(KeyCodec.for_id(doc_id, self.string_width))
+            if len(value) != self.value_width:
+                raise ValueError("digest table expects {} bytes value, got {}".format(self.value_width, len(value)))
+            keys.append(self.codec.encode(doc_id))
+            values += value
+        if not keys:
+            return
+        # 稳定排序, 相同key保持写入顺序
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        self.runs.append(([keys[i] for i in order], values, order))
+
+    def _run_records(self, run, rank):
+        keys, values, order = run
+        width = self.value_width
+        for key, i in zip(keys, order):
+            yield key, rank, values[i * width:(i + 1) * width]
+
+    def _table_records(self, keys, values, count, rank):
+        width = self.value_width
+        for pos in range(count):
+            key = self.codec.encode(keys[pos]) if self.codec.key_type == KEY_INT64 else keys[pos]
+            yield key, rank, values[pos * width:(pos + 1) * width]
+
+    def compact(self):
+        """
+        已有记录与暂存的run多路归并为一张表, 相同key只保留最后写入的value
+        """
+        if not self.runs:
+            return
+        runs, self.runs = self.runs, []
+        # rank越小越新: 相同key时heapq.merge先输出较新的记录, 同一run内相同key的最后一条最新
+        sources = [self._table_records(self.keys, self.values, self.size, len(runs))]
+        for age, run in enumerate(reversed(runs)):
+            sources.append(self._run_records(run, age))
+        self._init_keys(self.codec)
+        values = bytearray()
+        last = None
+        pending = None
+        for key, rank, value in heapq.merge(*sources, key=lambda record: (record[0], record[1])):
+            if key != last:
+                if pending is not None:
+                    values += pending
+                last = key
+                self.keys.append(self._probe(key))
+                pending = value
+                best = rank
+            elif rank == best:
+                # 同一run内重复的key, 后写入的覆盖
+                pending = value
+        if pending is not None:
+            values += pending
+        self.values, self.size = values, len(self.keys)
@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+
+"""
+Module Description: 测试公共设置, 模块位于仓库根目录, 加入sys.path后直接import
+Date: 2026/10/18
+Author: HuYuanCheng
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+
+"""
+Module Description: 测试公共的模拟对象, 记录日志事件的LogSink替身与只含连接的cluster
+Date: 2026/10/18
+Author: HuYuanCheng
+"""
+import benchmark
+
+
+class RecordingSink:
+    """
+    与LogSink接口相同, 日志字段连同级别保存在events中, 不写文件
+    """
+    def __init__(self):
+        self.events = []
+
+    def log(self, level, message, **fields):
+        self.events.append(dict(fields, level=level, msg=message))
+
+    def debug(self, message, **fields):
+        self.log("debug", message, **fields)
+
+    def info(self, message, **fields):
+        self.log("info", message, **fields)
+
+    def error(self, message, **fields):
+        self.log("error", message, **fields)
+
+    def incr(self, name, value=1):
+        pass
+
+    def observe(self, name, seconds):
+        pass
+
+    def of(self, event):
+        return [fields for fields in self.events if fields.get("event") == event]
+
+
+class Cluster:
+    def __init__(self, coll):
+        self.conn = {benchmark.BENCH_DB: {benchmark.BENCH_COLL: coll}}
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+"""
+Module Description: 进度日志与--resume续跑测试, 数据使用benchmark的进程内模拟collection
+Date: 2026/10/18
+Author: HuYuanCheng
+"""
+import asyncio
+import collections
+
+from bson import ObjectId, json_util
+
+import benchmark
+import comparison
+from checkpoint import ProgressJournal, RESUME, UNIT_COLLECTION
+
+
+def test_resume_loads_records(tmp_path):
+    path = str(tmp_path / "journal.txt")
+    journal = ProgressJournal(path)
+    bound = ObjectId()
+    journal.save_ranges("db.coll", [(None, bound), (bound, None)])
+    journal.mark("db.coll", "r:0", ok=False, docs=10)
+    journal.mark("db.coll", "r:0", ok=True, docs=12)
+    journal.close()
+
+    journal = ProgressJournal(path, resume=True)
+    assert journal.ranges("db.coll") == [(None, bound), (bound, None)]
+    # 同一单元以最后一条记录为准
+    assert journal.get("db.coll", "r:0") == {"scope": "db.coll", "unit": "r:0", "ok": True, "docs": 12}
+    assert not journal.is_done("db.coll", "r:1")
+    journal.close()
+    assert len(ProgressJournal(path)) == 0
+
+
+def test_partial_line_after_crash(tmp_path):
+    path = str(tmp_path / "journal.txt")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(json_util.dumps({"scope": "db.coll", "unit": "b:0", "ok": True, "docs": 20}) + "\n")
+        f.write('{"scope": "db.coll", "unit": "b:20", "o')
+    journal = ProgressJournal(path, resume=True)
+    assert len(journal) == 1 and not journal.is_done("db.coll", "b:20")
+    journal.mark("db.coll", "b:20", docs=20)
+    journal.close()
+    # 不完整的行之后另起一行, 新记录仍可加载
+    assert ProgressJournal(path, resume=True).is_done("db.coll", "b:20")
+
+
+def test_resume_compares_unfinished_ranges(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(comparison, "_base_dir", str(tmp_path))
+    src = [{"_id": i, "v": i} for i in range(1000)]
+    dst = [dict(doc, v=-1) if doc["_id"] == 10 else doc for doc in src]
+    cfg = {"compare_dbs": [benchmark.BENCH_DB], "compare_colls": [benchmark.BENCH_COLL],
+           "src_url": "mongodb://src", "dst_url": "mongodb://dst", "query_batch": 50, "sample_start_idx": 0,
+           "sample_count": 0, "task_count": 4, "comparison_mode": "full", "diff_limit": 0}
+    path = comparison.AsyncDbCompare(cfg).journal_file_path
+    with benchmark.fake_cluster(src, dst, 0):
+        assert asyncio.run(comparison.compare(cfg)) == {"result": False, "process_count": len(src)}
+        # 模拟中断: 去掉collection完成记录与最后两个区间
+        records = [json_util.loads(line) for line in open(path, encoding="utf-8")]
+        ranges = sorted(record["unit"] for record in records if record["unit"].startswith("r:"))
+        lost = set(ranges[-2:]) | {UNIT_COLLECTION}
+        with open(path, "w", encoding="utf-8") as f:
+            f.writelines(json_util.dumps(record) + "\n" for record in records if record["unit"] not in lost)
+        # 续跑只比对未完成的区间, 已完成区间的差异结果沿用
+        assert asyncio.run(comparison.compare(dict(cfg, **{RESUME: True}))) == \
+            {"result": False, "process_count": len(src)}
+    units = collections.Counter(json_util.loads(line)["unit"] for line in open(path, encoding="utf-8"))
+    assert all(units[unit] == 1 for unit in ranges)
+    assert units[UNIT_COLLECTION] == 1
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+"""
+Module Description: 自适应并发与多collection共享并发预算测试
+Date: 2026/10/18
+Author: HuYuanCheng
+"""
+import asyncio
+
+from concurrency import AdaptiveLimiter, ConcurrencyBudget, LATENCY_TARGET, TASK_COUNT_AUTO, TASK_COUNT_MAX
+
+
+def test_from_configure():
+    assert AdaptiveLimiter.from_configure({"task_count": 8}) is None
+    limiter = AdaptiveLimiter.from_configure({"task_count": TASK_COUNT_AUTO, TASK_COUNT_MAX: 16, LATENCY_TARGET: 50})
+    assert (limiter.active, limiter.maximum, limiter.target) == (4, 16, 0.05)
+
+
+def test_additive_increase_multiplicative_decrease():
+    changes = []
+    limiter = AdaptiveLimiter(4, 6, 0.1, on_change=changes.append)
+    # 不足一个窗口(当前并发数个批次)时不调整
+    for _ in range(3):
+        limiter.observe(0.01)
+    assert limiter.active == 4
+    limiter.observe(0.01)
+    assert limiter.active == 5
+    for _ in range(5 + 6):
+        limiter.observe(0.01)
+    assert limiter.active == 6
+    # 窗口中位数超过目标时乘以0.75
+    for _ in range(6):
+        limiter.observe(0.5)
+    assert limiter.active == 4
+    # 中位数判断, 少数慢批次不触发减小
+    for latency in (0.5, 0.01, 0.01, 0.01):
+        limiter.observe(latency)
+    assert limiter.active == 5
+    for _ in range(50):
+        limiter.observe(0.5)
+    assert limiter.active == 1
+    assert changes[0] == "CONCURRENCY => 4 -> 5, median latency: 0.010s"
+    assert len(changes) == 8
+
+
+def test_paused_workers_resume():
+    async def run():
+        limiter = AdaptiveLimiter(2, 4, 0.1)
+        resumed = []
+
+        async def worker(index):
+            await limiter.wait(index)
+            resumed.append(index)
+
+        tasks = [asyncio.create_task(worker(index)) for index in range(4)]
+        await asyncio.sleep(0)
+        assert sorted(resumed) == [0, 1]
+        limiter.observe(0.01)
+        limiter.observe(0.01)
+        await asyncio.sleep(0)
+        assert sorted(resumed) == [0, 1, 2]
+        # 没有待处理单元时唤醒暂停的协程退出
+        limiter.close()
+        await asyncio.gather(*tasks)
+        assert sorted(resumed) == [0, 1, 2, 3]
+
+    asyncio.run(run())
+
+
+def test_budget_shared_by_collections():
+    async def run(budget):
+        running = []
+        peak = []
+
+        async def unit():
+            async with budget:
+                running.append(1)
+                peak.append(len(running))
+                await asyncio.sleep(0.01)
+                running.pop()
+
+        await asyncio.gather(*[unit() for _ in range(12)])
+        return max(peak)
+
+    assert asyncio.run(run(ConcurrencyBudget(3))) == 3
+    limiter = AdaptiveLimiter(2, 8, 0.1)
+    budget = ConcurrencyBudget.from_configure({"task_count": TASK_COUNT_AUTO, TASK_COUNT_MAX: 8}, limiter)
+    assert (budget.capacity, budget.maximum) == (2, 8)
+    assert asyncio.run(run(budget)) == 2
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+
+"""
+Module Description: 差异明细测试, 数据使用benchmark的进程内模拟collection
+Date: 2026/10/18
+Author: HuYuanCheng
+"""
+import asyncio
+
+from bson import json_util
+
+import benchmark
+from diffreport import DIFF_RESOLVED, DiffReport
+from ranges import DIFF_CHANGED, DIFF_MISSING_DST
+
+
+def test_document_ids(tmp_path):
+    src = benchmark.FakeCollection([{"_id": {"a": 1, "b": 2}, "v": 1}, {"_id": {"a": 2}, "v": 1},
+                                {"_id": {"a": 3}, "v": 1}])
+    dst = benchmark.FakeCollection([{"_id": {"a": 1, "b": 2}, "v": 2}, {"_id": {"a": 3}, "v": 1}])
+    report = DiffReport(str(tmp_path / "diff.jsonl"))
+    for kind, doc_id in ((DIFF_CHANGED, {"a": 1, "b": 2}), (DIFF_MISSING_DST, {"a": 2}), (DIFF_CHANGED, {"a": 3})):
+        report.add("db.coll", kind, doc_id)
+    assert asyncio.run(report.run("db.coll", src, dst)) == (3, 0)
+    report.close()
+    records = [json_util.loads(line) for line in open(tmp_path / "diff.jsonl", encoding="utf-8")]
+    assert [record["kind"] for record in records] == [DIFF_CHANGED, DIFF_MISSING_DST, DIFF_RESOLVED]
+    assert records[0]["fields"] == [{"path": "v", "kind": DIFF_CHANGED, "src": 1, "dst": 2}]
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+
+"""
+Module Description: 分布式比对测试, 本机coordinator与worker线程, 数据使用benchmark的进程内模拟collection
+Date: 2026/10/18
+Author: HuYuanCheng
+"""
+import asyncio
+import os
+import socket
+import threading
+
+import pytest
+
+import benchmark
+import comparison
+import distributed
+from digest import DIGEST_SIZE, DigestEngine
+from snapshot import SnapshotWriter
+from workers import WORKER_CHUNK
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def configure(mode, port):
+    return {"compare_dbs": [benchmark.BENCH_DB], "compare_colls": [benchmark.BENCH_COLL],
+            "src_url": "mongodb://src", "dst_url": "mongodb://dst", "query_batch": 100,
+            "sample_start_idx": 0, "sample_count": 0, "task_count": 1, "comparison_mode": mode, "diff_limit": 0,
+            distributed.COORDINATOR: "127.0.0.1:{}".format(port), distributed.LEASE_SECONDS: 1}
+
+
+def resolve_runner(job):
+    if job["mode"] == 1:
+        return comparison.compare
+    return comparison.write if job["period"] == 1 else comparison.load_and_compare
+
+
+def coordinate(cfg, mode, period, before_workers=None):
+    """
+    后台线程运行coordinator, before_workers在worker加入前执行, 返回(结果, ParallelRunner)
+    """
+    runner = comparison.ParallelRunner(cfg, mode, period)
+    outcome = {}
+
+    def serve():
+        try:
+            outcome["result"] = runner.run()
+        finally:
+            runner.quit()
+
+    thread = threading.Thread(target=serve)
+    thread.start()
+    url = "http://{}".format(cfg[distributed.COORDINATOR])
+    if before_workers is not None:
+        before_workers(url)
+    workers = [threading.Thread(target=distributed.join_coordinator, args=(url, None, resolve_runner, "w{}".format(i),
+                                                                         lambda message: None))
+               for i in range(2)]
+    for worker in workers:
+        worker.start()
+    for worker in workers + [thread]:
+        worker.join(60)
+    return outcome.get("result"), runner
+
+
+def runner_path(cfg):
+    return comparison.ParallelRunner(cfg, 2, 1).snapshot_path(benchmark.BENCH_COLL)
+
+
+@pytest.fixture()
+def dataset(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(comparison, "_base_dir", str(tmp_path))
+    src, dst, diffs = benchmark.make_docs(2000, 64, 0.01, seed=1)
+    with benchmark.fake_cluster(src, dst, 0):
+        yield src, dst, diffs
+
+
+def test_compare_over_coordinator(dataset):
+    src, dst, _ = dataset
+    result, runner = coordinate(configure("full", free_port()), 1, -1)
+    # 模拟数据中有差异, 各分片均由worker完成并记入coordinator的进度日志
+    assert result is False
+    assert runner.process_count >= len(src)
+    assert all(runner.journal.get(runner.scope, name) is not None for name in runner.chunk_parts)
+
+
+def test_expired_lease_runs_are_not_merged(dataset):
+    src, _, _ = dataset
+    cfg = configure("full", free_port())
+    stale = {}
+
+    def lease_and_vanish(url):
+        # 领取一个分片后用错误的摘要写入run且不提交结果, 模拟失联但仍在写入的worker
+        lease = distributed._call(url, "/lease", {"worker": "stale"}, None, lambda message: None)
+        stale["part"] = lease["configure"][WORKER_CHUNK]
+        path = runner_path(cfg)
+        writer = SnapshotWriter(path, DigestEngine.from_configure(cfg).tag, part=stale["part"])
+        writer.add((doc["_id"], b"\x00" * DIGEST_SIZE) for doc in src)
+        writer.flush_run()
+
+    result, runner = coordinate(cfg, 2, 1, lease_and_vanish)
+    assert result is True
+    parts = [runner.journal.get(runner.scope, name)["part"] for name in runner.chunk_parts]
+    assert stale["part"] not in parts
+
+    # 快照中不应包含失联worker写入的摘要, 以src作为dst比对一致
+    load_cfg = dict(cfg, dst_url="mongodb://src", **{distributed.COORDINATOR: ""})
+    assert asyncio.run(comparison.load_and_compare(load_cfg))["result"]
+
+
+def test_missing_runs_fail_collection(dataset, monkeypatch):
+    cfg = configure("full", free_port())
+    on_result = comparison.ParallelRunner.on_result
+
+    def on_result_elsewhere(runner, name, pid, report):
+        # 模拟worker写入的write_export不是coordinator可见的共享目录
+        on_result(runner, name, pid, report)
+        run_dir = runner_path(cfg) + ".runs"
+        for file_name in os.listdir(run_dir):
+            if file_name.startswith("{}_run_".format(report["part"])):
+                os.remove(os.path.join(run_dir, file_name))
+
+    monkeypatch.setattr(comparison.ParallelRunner, "on_result", on_result_elsewhere)
+    result, runner = coordinate(cfg, 2, 1)
+    assert result is False
+    assert sorted(runner.failed) == sorted(runner.chunk_parts)
+    scope = "{}.{}".format(benchmark.BENCH_DB, benchmark.BENCH_COLL)
+    assert not runner.journal.is_done(scope, comparison.UNIT_COLLECTION)
+    assert not os.path.exists(runner_path(cfg))
+
+
+def test_token_required_off_loopback():
+    with pytest.raises(ValueError):
+        distributed.serve_chunks([("r:0", {})], "0.0.0.0:0", {}, 1, "", None, print, print)
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+"""
+Module Description: mongodump文件数据源测试
+Date: 2026/10/18
+Author: HuYuanCheng
+"""
+import asyncio
+import random
+
+import bson
+import pytest
+
+from dumpsource import DumpClient, project
+from ranges import split_id_ranges
+from sampling import hash_ids, random_ids, stratified_ids
+
+DOC_COUNT = 1000
+
+
+@pytest.fixture()
+def dump(tmp_path):
+    docs = [{"_id": i, "v": "x" * (i % 7)} for i in range(DOC_COUNT)]
+    # mongodump按自然顺序导出, 不保证_id有序
+    random.Random(3).shuffle(docs)
+    with open(tmp_path / "coll.bson", "wb") as f:
+        for doc in docs:
+            f.write(bson.encode(doc))
+    client = DumpClient(str(tmp_path))
+    yield client["db"]["coll"]
+    client.close()
+
+
+def test_sample_is_random(dump):
+    first = asyncio.run(random_ids(dump, 5))
+    assert first == sorted(first) and len(set(first)) == 5
+    # 等距取点时每次结果相同
+    assert any(asyncio.run(random_ids(dump, 5)) != first for _ in range(5))
+
+
+def test_split_ranges_are_even(dump):
+    ranges = asyncio.run(split_id_ranges(dump, 4))
+    assert ranges == [(None, 250), (250, 500), (500, 750), (750, None)]
+
+
+def test_stratified_sample(dump):
+    ids = asyncio.run(stratified_ids(dump, 40, 4))
+    assert len(ids) == len(set(ids)) == 40
+    # 每个区间各抽取10个
+    assert [sum(lower <= i < upper for i in ids) for lower, upper in ((0, 250), (250, 500), (500, 750), (750, 1000))] \
+        == [10, 10, 10, 10]
+
+
+def test_hash_sample_local(dump):
+    ids = asyncio.run(hash_ids(dump, 0.2))
+    assert ids == sorted(set(ids)) and 120 < len(ids) < 280
+    assert asyncio.run(hash_ids(dump, 0.2)) == ids
+
+
+def test_dotted_projection():
+    doc = {"_id": 1, "a": {"b": 1, "c": 2}, "d": [{"b": 1, "c": 2}, 3, [{"b": 4}]], "e": 5, "f": {"c": 1}}
+    # 与mongodb投影结果相同
+    assert project(doc, {"a.b": 1, "d.b": 1, "e.b": 1, "f.b": 1}) == \
+        {"_id": 1, "a": {"b": 1}, "d": [{"b": 1}, [{"b": 4}]], "f": {}}
+    assert project(doc, {"a.b": 1, "a": 1}) == {"_id": 1, "a": {"b": 1, "c": 2}}
+    assert project(doc, {"a.b": 0, "d.c": 0, "e.b": 0, "f": 0}) == \
+        {"_id": 1, "a": {"c": 2}, "d": [{"b": 1}, 3, [{"b": 4}]], "e": 5}
+
+
+def test_projected_find(dump):
+    doc = asyncio.run(dump.find({"_id": {"$in": [5]}}, {"v": 0}).to_list(1))[0]
+    assert doc == {"_id": 5}
+
+
+def test_server_digest_pipeline_rejected(dump):
+    with pytest.raises(ValueError, match="digest_location client"):
+        dump.aggregate([{"$match": {}}, {"$group": {"_id": None}}])
+
+
+def test_missing_collection_fails_alone(tmp_path):
+    with open(tmp_path / "present.bson", "wb") as f:
+        f.write(bson.encode({"_id": 1}))
+    client = DumpClient(str(tmp_path))
+    assert asyncio.run(client["db"]["present"].estimated_document_count()) == 1
+    missing = client["db"]["missing"]
+    with pytest.raises(FileNotFoundError):
+        asyncio.run(missing.estimated_document_count())
+    client.close()
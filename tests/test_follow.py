@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+"""
+Module Description: 持续校验测试, 进程内模拟的change stream, 数据使用benchmark的进程内模拟collection
+Date: 2026/10/18
+Author: HuYuanCheng
+"""
+import asyncio
+
+import benchmark
+import comparison
+from fakes import Cluster, RecordingSink
+from follow import ChangeQueue, FOLLOW, FOLLOW_DEBOUNCE, FOLLOW_DURATION, FOLLOW_REPORT_INTERVAL
+from hashing import DigestExecutor
+from ranges import DIFF_CHANGED
+
+START_TIME = "t0"
+
+
+class ChangeLog:
+    """
+    一端collection的变化事件[(resume token, _id)], fail_after为产生该token的事件后断开一次
+    """
+    def __init__(self, ids, fail_after=None):
+        self.events = [(token, doc_id) for token, doc_id in enumerate(ids, 1)]
+        self.fail_after = fail_after
+        self.watches = []
+
+
+class ChangeStream:
+    def __init__(self, log, events):
+        self.log = log
+        self.events = events
+        self.resume_token = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def __aiter__(self):
+        for token, doc_id in self.events:
+            self.resume_token = token
+            yield {"operationType": "update", "documentKey": {"_id": doc_id}}
+            if self.log.fail_after == token:
+                self.log.fail_after = None
+                raise ConnectionError("stream closed")
+        # 没有新事件时保持订阅
+        await asyncio.Event().wait()
+
+
+class WatchedCollection(benchmark.FakeCollection):
+    full_name = "{}.{}".format(benchmark.BENCH_DB, benchmark.BENCH_COLL)
+
+    def __init__(self, docs, changes, raw=False, _data=None):
+        super().__init__(docs, raw=raw, _data=_data)
+        self.changes = changes
+
+    def with_options(self, codec_options=None):
+        return WatchedCollection(None, self.changes, raw=True, _data=(self.keys, self.ids, self.data))
+
+    def watch(self, pipeline, resume_after=None, start_at_operation_time=None):
+        self.changes.watches.append(resume_after or start_at_operation_time)
+        events = self.changes.events
+        if resume_after is not None:
+            events = [event for event in events if event[0] > resume_after]
+        return ChangeStream(self.changes, events)
+
+
+class BrokenCollection(WatchedCollection):
+    def with_options(self, codec_options=None):
+        return BrokenCollection(None, self.changes, raw=True, _data=(self.keys, self.ids, self.data))
+
+    def find(self, query=None, projection=None):
+        raise ConnectionError("connection reset")
+
+
+class Connection(dict):
+    @property
+    def admin(self):
+        return self
+
+    async def command(self, name):
+        return {"ok": 1, "operationTime": START_TIME}
+
+
+class FollowCluster(benchmark.FakeCluster):
+    def connect(self):
+        super().connect()
+        self.conn = Connection(self.conn)
+
+
+def test_change_queue_debounce():
+    queue = ChangeQueue(2)
+    queue.add(1, now=0)
+    queue.add(2, now=1)
+    queue.add(1, now=1.5)
+    assert len(queue) == 2
+    assert queue.pop_ready(10, now=2.5) == []
+    assert queue.wait_time(now=2.5) == 0.5
+    # 最后一次变化后静默期才结束, 期间多次变化只复核一次
+    assert queue.pop_ready(10, now=3) == [2]
+    assert queue.pop_ready(10, now=3.5) == [1]
+    assert len(queue) == 0
+
+
+def test_follow_rechecks_changed_ids():
+    src = [{"_id": i, "v": i} for i in range(100)]
+    dst = [dict(doc, v=-1) if doc["_id"] == 9 else doc for doc in src]
+    # src上7连续变化两次, 静默期内只复核一次; 之后断开, 从resume token继续时不重放已处理的事件
+    src_changes = ChangeLog([7, 7, 5], fail_after=2)
+    dst_changes = ChangeLog([9])
+    cfg = {"compare_dbs": [benchmark.BENCH_DB], "compare_colls": [benchmark.BENCH_COLL], "query_batch": 20,
+           "sample_start_idx": 0, "sample_count": 0, "task_count": 1,
+           FOLLOW_DEBOUNCE: 0.2, FOLLOW_DURATION: 2, FOLLOW_REPORT_INTERVAL: 60}
+    runner = comparison.AsyncDbCompare(cfg)
+    runner.src = Cluster(WatchedCollection(src, src_changes))
+    runner.dst = Cluster(WatchedCollection(dst, dst_changes))
+    runner.log = RecordingSink()
+    runner.hasher = DigestExecutor.from_configure(cfg)
+    # 初次比对发现的差异_id, 两端现已一致
+    runner.follow_seeds = {WatchedCollection.full_name: [50]}
+    try:
+        result = asyncio.run(runner.follow((START_TIME, START_TIME)))
+    finally:
+        runner.hasher.close()
+
+    assert result is False
+    assert src_changes.watches == [START_TIME, 2]
+    assert dst_changes.watches == [START_TIME]
+    events = runner.log.events
+    assert [(event["id"], event["kind"]) for event in events if event.get("event") == "follow_diff"] == \
+           [(9, DIFF_CHANGED)]
+    summary = [event for event in events if event.get("event") == "follow"][-1]
+    # 4个变化事件, 复核50、7、5、9各一次
+    assert (summary["changes"], summary["verified"], summary["pending"], summary["divergent"]) == (4, 4, 0, 1)
+
+
+def test_follow_keeps_initial_failure(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(comparison, "_base_dir", str(tmp_path))
+    monkeypatch.setattr(comparison, "AsyncMongoCluster", FollowCluster)
+    docs = [{"_id": i, "v": i} for i in range(100)]
+    # 初次比对时src读取出错, 持续校验期间没有变化, 不应因此变为通过
+    datasets = {"src": {benchmark.BENCH_COLL: BrokenCollection(docs, ChangeLog([]))},
+                "dst": {benchmark.BENCH_COLL: WatchedCollection(docs, ChangeLog([]))}}
+    monkeypatch.setattr(FollowCluster, "datasets", datasets)
+    cfg = {"compare_dbs": [benchmark.BENCH_DB], "compare_colls": [benchmark.BENCH_COLL], "query_batch": 20,
+           "src_url": "mongodb://src", "dst_url": "mongodb://dst", "sample_start_idx": 0, "sample_count": 0,
+           "task_count": 1, "comparison_mode": "full", "diff_limit": 0,
+           FOLLOW: True, FOLLOW_DEBOUNCE: 0.1, FOLLOW_DURATION: 0.5, FOLLOW_REPORT_INTERVAL: 60}
+    assert asyncio.run(comparison.compare(cfg))["result"] is False
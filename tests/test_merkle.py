@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+
+"""
+Module Description: 分层区间指纹校验测试, 数据使用benchmark的进程内模拟collection
+Date: 2026/10/18
+Author: HuYuanCheng
+"""
+import asyncio
+
+import benchmark
+from digest import DigestEngine
+from merkle import CollectionDigestSource, MerkleVerifier
+from ranges import DIFF_CHANGED, DIFF_MISSING_DST
+
+
+class CountingCollection(benchmark.FakeCollection):
+    finds = 0
+
+    def with_options(self, codec_options=None):
+        return CountingCollection(None, self.latency, raw=True, _data=(self.keys, self.ids, self.data))
+
+    def find(self, query=None, projection=None):
+        CountingCollection.finds += 1
+        return super().find(query, projection)
+
+
+def test_client_mode_reads_each_range_once():
+    src = [{"_id": i, "v": i} for i in range(5000)]
+    dst = [dict(doc, v=-1) if doc["_id"] == 1234 else doc for doc in src if doc["_id"] != 4321]
+    engine = DigestEngine()
+    verifier = MerkleVerifier(CollectionDigestSource(engine.collection(CountingCollection(src)), engine, 500),
+                              CollectionDigestSource(engine.collection(CountingCollection(dst)), engine, 500),
+                              fanout=4, leaf_size=100)
+    diffs = []
+    CountingCollection.finds = 0
+    doc_count = asyncio.run(verifier.verify(None, None, lambda kind, doc_id: diffs.append((kind, doc_id))))
+    assert doc_count == 5000
+    assert diffs == [(DIFF_CHANGED, 1234), (DIFF_MISSING_DST, 4321)]
+    # 本地摘要模式下计算指纹时已拉取全部摘要, 指纹不一致时直接合并比对, 不逐层重复拉取
+    assert CountingCollection.finds == 2
+    assert verifier.bucket_count == 1 and verifier.leaf_count == 1
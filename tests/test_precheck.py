@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+"""
+Module Description: 区间数量预检查测试, 数据使用benchmark的进程内模拟collection
+Date: 2026/10/18
+Author: HuYuanCheng
+"""
+import asyncio
+
+import pytest
+
+import benchmark
+import comparison
+from fakes import RecordingSink
+
+
+class CountSource:
+    def __init__(self, ids):
+        self.ids = ids
+
+    async def count(self, lower, upper):
+        return len([doc_id for doc_id in self.ids if lower <= doc_id < upper])
+
+
+class Journal:
+    def __init__(self, done=()):
+        self.done = set(done)
+
+    def get(self, scope, unit):
+        return {"ok": True} if unit in self.done else None
+
+
+class Runner:
+    def __init__(self, precheck, journal=None):
+        self.configure = {comparison.PRECHECK: precheck, "task_count": 2}
+        self.journal = journal or Journal()
+        self.scope = "db.coll"
+        self.log = RecordingSink()
+        self.log_info = self.log.info
+        self.log_error = self.log.error
+        self.process_document_res = True
+
+
+RANGES = [(0, 10), (10, 20), (20, 30), (30, 40)]
+SRC = CountSource(list(range(40)))
+DST = CountSource([doc_id for doc_id in range(40) if doc_id not in (15, 35)])
+
+
+def test_mismatched_ranges_first():
+    runner = Runner(comparison.PRECHECK_ON)
+    assert asyncio.run(comparison.precheck_order(runner, SRC, DST, RANGES)) == [1, 3, 0, 2]
+    assert [(event["unit"], event["src"], event["dst"]) for event in runner.log.of("precheck")] == \
+           [(1, 10, 9), (3, 10, 9)]
+    assert runner.process_document_res is True
+
+
+def test_only_skips_finished_ranges():
+    runner = Runner(comparison.PRECHECK_ONLY, Journal(["r:1"]))
+    assert asyncio.run(comparison.precheck_order(runner, SRC, DST, RANGES)) == []
+    assert [event["unit"] for event in runner.log.of("precheck")] == [3]
+    assert runner.process_document_res is False
+
+
+def test_off():
+    runner = Runner(comparison.PRECHECK_OFF)
+    assert asyncio.run(comparison.precheck_order(runner, SRC, DST, RANGES)) == [0, 1, 2, 3]
+    assert runner.log.events == []
+
+
+@pytest.mark.parametrize("mode", [comparison.MODE_FULL, comparison.MODE_SAMPLE])
+def test_precheck_only_fails_collection(tmp_path, monkeypatch, mode):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(comparison, "_base_dir", str(tmp_path))
+    src = [{"_id": i, "v": i} for i in range(500)]
+    cfg = {"compare_dbs": [benchmark.BENCH_DB], "compare_colls": [benchmark.BENCH_COLL],
+           "src_url": "mongodb://src", "dst_url": "mongodb://dst", "query_batch": 100, "sample_start_idx": 0,
+           "sample_count": 100, "task_count": 1, "comparison_mode": mode, "diff_limit": 0,
+           comparison.PRECHECK: comparison.PRECHECK_ONLY}
+    with benchmark.fake_cluster(src, src, 0):
+        assert asyncio.run(comparison.compare(cfg)) == {"result": True, "process_count": 0}
+    with benchmark.fake_cluster(src, src[:-1], 0):
+        assert asyncio.run(comparison.compare(cfg)) == {"result": False, "process_count": 0}
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+"""
+Module Description: _id排序键与有序合并比对测试
+Date: 2026/10/18
+Author: HuYuanCheng
+"""
+import asyncio
+import datetime
+import uuid
+
+import pytest
+from bson import Binary, Int64, ObjectId
+from bson.decimal128 import Decimal128
+from bson.max_key import MaxKey
+from bson.min_key import MinKey
+from bson.regex import Regex
+from bson.timestamp import Timestamp
+
+import benchmark
+import comparison
+from ranges import DIFF_CHANGED, DIFF_MISSING_DST, DIFF_MISSING_SRC, id_sort_key, merge_digests
+
+
+def test_type_order():
+    # mongodb的类型比较顺序
+    ordered = [MinKey(), None, float('nan'), -1.5, 1, Decimal128("1.5"), Int64(2), "a", {"a": 1}, [1],
+               b"x", Binary(b"\x00" * 16, 4), ObjectId("0" * 24), False, True,
+               datetime.datetime(2020, 1, 1), Timestamp(1, 1), Regex("a"), MaxKey()]
+    positions = list(reversed(range(len(ordered))))
+    assert sorted(positions, key=lambda i: id_sort_key(ordered[i])) == list(range(len(ordered)))
+
+
+def test_numbers_compare_by_value():
+    assert id_sort_key(Decimal128("9.5")) < id_sort_key(10) < id_sort_key(Decimal128("10.5")) < id_sort_key(11.0)
+    assert id_sort_key(Int64(3)) == id_sort_key(3.0)
+    assert id_sort_key(Decimal128("NaN")) < id_sort_key(-1e300)
+
+
+def test_embedded_documents():
+    assert id_sort_key({"a": 9}) < id_sort_key({"a": 10})
+    assert id_sort_key({"a": 1}) < id_sort_key({"a": 1, "b": 0})
+    # 先比较字段值的类型, 再比较字段名
+    assert id_sort_key({"b": 1}) < id_sort_key({"a": "x"})
+    assert id_sort_key({"a": 1, "b": 2}) < id_sort_key({"b": 1})
+    assert id_sort_key({"x": {"y": 2}}) < id_sort_key({"x": {"y": 10}})
+
+
+def test_binary_and_dates():
+    # BinData先比较长度再比较subtype
+    assert id_sort_key(b"zz") < id_sort_key(Binary(b"aaa", 0))
+    assert id_sort_key(Binary(b"ab", 0)) < id_sort_key(Binary(b"aa", 5))
+    assert id_sort_key(uuid.UUID(int=1)) == id_sort_key(Binary(uuid.UUID(int=1).bytes, 4))
+    aware = datetime.datetime(2020, 1, 1, 8, tzinfo=datetime.timezone(datetime.timedelta(hours=8)))
+    assert id_sort_key(aware) == id_sort_key(datetime.datetime(2020, 1, 1))
+
+
+def test_unsupported_type():
+    with pytest.raises(TypeError):
+        id_sort_key(object())
+
+
+def test_merge_digests_with_document_ids():
+    src = [({"a": 9}, b"1"), ({"a": 10}, b"2"), ({"a": 11}, b"3")]
+    dst = [({"a": 9}, b"1"), ({"a": 10}, b"x"), ({"a": 12}, b"4")]
+    assert list(merge_digests(src, dst)) == [(DIFF_CHANGED, {"a": 10}), (DIFF_MISSING_DST, {"a": 11}),
+                                             (DIFF_MISSING_SRC, {"a": 12})]
+
+
+def test_full_mode_range_merge(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(comparison, "_base_dir", str(tmp_path))
+    src = [{"_id": i, "v": i} for i in range(0, 300, 2)]
+    dst = [dict(doc, v=-1) if doc["_id"] == 100 else doc for doc in src if doc["_id"] != 200] + [{"_id": 201}]
+    cfg = {"compare_dbs": [benchmark.BENCH_DB], "compare_colls": [benchmark.BENCH_COLL],
+           "src_url": "mongodb://src", "dst_url": "mongodb://dst", "query_batch": 7, "sample_start_idx": 0,
+           "sample_count": 0, "task_count": 2, "comparison_mode": "full", "diff_limit": 0}
+    with benchmark.fake_cluster(src, dst, 0):
+        assert asyncio.run(comparison.compare(cfg)) == {"result": False, "process_count": len(src) + 1}
+    diffs = sorted(line.split("DIFF => ")[1].strip() for line in capsys.readouterr().out.splitlines()
+                   if "DIFF => _id" in line)
+    assert diffs == ["_id: 100", "_id: 200 {}".format(DIFF_MISSING_DST), "_id: 201 {}".format(DIFF_MISSING_SRC)]
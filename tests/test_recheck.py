@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+"""
+Module Description: 疑似差异复核测试, 数据使用benchmark的进程内模拟collection
+Date: 2026/10/18
+Author: HuYuanCheng
+"""
+import asyncio
+
+import benchmark
+import comparison
+from fakes import RecordingSink
+from hashing import DigestExecutor
+from ranges import DIFF_CHANGED
+from recheck import RecheckQueue, RECHECK_INTERVALS
+
+
+def configure(**extra):
+    return dict({"compare_dbs": [benchmark.BENCH_DB], "compare_colls": [benchmark.BENCH_COLL],
+                 "src_url": "mongodb://src", "dst_url": "mongodb://dst", "query_batch": 100,
+                 "sample_start_idx": 0, "sample_count": 0, "task_count": 1, "comparison_mode": "full",
+                 "diff_limit": 0}, **extra)
+
+
+def test_queue_intervals():
+    queue = RecheckQueue([1, 5])
+    queue.add(1, DIFF_CHANGED, now=0)
+    assert queue.pop_due(10, now=0.5) == []
+    assert queue.wait_time(now=0.5) == 0.5
+    suspect, = queue.pop_due(10, now=1)
+    # 第二次复核在上一次之后5秒
+    assert queue.retry(suspect, DIFF_CHANGED, now=1) is True
+    assert queue.pop_due(10, now=5) == []
+    suspect, = queue.pop_due(10, now=6)
+    assert queue.retry(suspect, DIFF_CHANGED, now=6) is False
+    assert (queue.suspects, queue.resolved, queue.confirmed, len(queue)) == (1, 0, 1, 0)
+
+
+def test_recheck_batch_document_ids():
+    src = [{"_id": {"a": i}, "v": i} for i in range(5)]
+    stale = [dict(doc, v=-1) if doc["_id"]["a"] in (1, 2) else doc for doc in src]
+    # 第二次复核前dst已同步{"a": 2}, {"a": 1}仍不一致
+    synced = [dict(doc, v=-1) if doc["_id"]["a"] == 1 else doc for doc in src]
+    runner = comparison.AsyncDbCompare(configure(**{RECHECK_INTERVALS: [0, 0]}))
+    runner.log = RecordingSink()
+    runner.hasher = DigestExecutor.from_configure(runner.configure)
+    for doc_id in ({"a": 1}, {"a": 2}):
+        runner.rechecks.add(doc_id, DIFF_CHANGED)
+    engine = runner.digest_engine
+    src_coll = engine.collection(benchmark.FakeCollection(src))
+    try:
+        for dst in (stale, synced):
+            due = runner.rechecks.pop_due(10)
+            assert len(due) == 2
+            asyncio.run(runner.recheck_batch(src_coll, engine.collection(benchmark.FakeCollection(dst)), due))
+    finally:
+        runner.hasher.close()
+    assert (runner.rechecks.resolved, runner.rechecks.confirmed, len(runner.rechecks)) == (1, 1, 0)
+    assert [event["id"] for event in runner.log.of("recheck_resolved")] == [{"a": 2}]
+    assert [(event["id"], event["kind"]) for event in runner.log.of("diff")] == [({"a": 1}, DIFF_CHANGED)]
+    assert runner.process_document_res is False
+
+
+def test_compare_document_ids_with_recheck(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(comparison, "_base_dir", str(tmp_path))
+    src = [{"_id": {"a": i}, "v": i} for i in range(50)]
+    dst = [dict(doc, v=-1) if doc["_id"]["a"] == 3 else doc for doc in src]
+    with benchmark.fake_cluster(src, dst, 0):
+        report = asyncio.run(comparison.compare(configure(**{RECHECK_INTERVALS: [0]})))
+    assert report["result"] is False
+    assert report["process_count"] == len(src)
+    output = capsys.readouterr().out
+    assert "DIFF => _id: {'a': 3}" in output
+    assert "collection [{}.{}] failed".format(benchmark.BENCH_DB, benchmark.BENCH_COLL) not in output
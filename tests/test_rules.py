@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+
+"""
+Module Description: collection字段规则测试
+Date: 2026/10/18
+Author: HuYuanCheng
+"""
+import bson
+from bson.decimal128 import Decimal128
+from bson.int64 import Int64
+
+from rules import CollectionRule
+
+
+def normalize(value):
+    doc = CollectionRule(numeric=True).normalize({"_id": 1, "a": value})
+    # 规范化后的文档需能重新编码为BSON
+    bson.encode(doc)
+    return doc["a"]
+
+
+def test_numeric_equal_values():
+    assert normalize(5) == normalize(Int64(5)) == normalize(5.0) == normalize(Decimal128("5"))
+    assert normalize(2.5) == normalize(Decimal128("2.5"))
+    assert isinstance(normalize(5.0), int)
+
+
+def test_numeric_outside_int64_stays_float():
+    for value in (1e20, -1e30, Decimal128("1E+20"), 2.0 ** 63):
+        assert isinstance(normalize(value), float)
+    assert normalize(1e20) == normalize(Decimal128("1E+20"))
+    assert normalize(-2.0 ** 63) == -(1 << 63)
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+"""
+Module Description: 抽样_id二进制索引测试
+Date: 2026/10/18
+Author: HuYuanCheng
+"""
+import os
+
+import pytest
+from bson import ObjectId
+
+import samples
+from samples import SampleSource, SAMPLE_INDEX_SUFFIX, write_sample_index
+from snapshot import KEY_INT64, KEY_OBJECTID, KEY_STRING
+
+
+def write_ids(path, ids):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(str(doc_id) for doc_id in ids) + "\n\n")
+
+
+def test_batches_seek(tmp_path):
+    path = str(tmp_path / "ids.txt")
+    write_ids(path, range(-5, 20))
+    source = SampleSource.open(path)
+    assert (len(source), source.key_type) == (25, KEY_INT64)
+    # 从第10个_id起读取, 下标相对起始位置
+    assert list(source.batches(10, 7, 3)) == [(0, [5, 6, 7]), (3, [8, 9, 10]), (6, [11])]
+    assert list(source.batches(23, 10, 5)) == [(0, [18, 19])]
+    source.close()
+
+
+def test_detected_types(tmp_path):
+    oids = [ObjectId() for _ in range(3)]
+    path = str(tmp_path / "oids.txt")
+    write_ids(path, oids)
+    source = SampleSource.open(path)
+    assert source.key_type == KEY_OBJECTID and list(source.batches(0, 3, 10)) == [(0, oids)]
+    source.close()
+
+    path = str(tmp_path / "names.txt")
+    write_ids(path, ["a", "bcd", "玩家"])
+    source = SampleSource.open(path)
+    assert (source.key_type, source.width) == (KEY_STRING, 6)
+    assert list(source.batches(0, 3, 10)) == [(0, ["a", "bcd", "玩家"])]
+    source.close()
+
+
+def test_rebuild_when_id_type_changes(tmp_path, monkeypatch):
+    path = str(tmp_path / "ids.txt")
+    write_ids(path, [1, 2, 3])
+    built = []
+    build = samples.build_sample_index
+    monkeypatch.setattr(samples, "build_sample_index", lambda *args: built.append(args[2]) or build(*args))
+
+    SampleSource.open(path).close()
+    SampleSource.open(path).close()
+    assert built == ["auto"]
+    source = SampleSource.open(path, "string")
+    assert list(source.batches(0, 3, 10)) == [(0, ["1", "2", "3"])]
+    source.close()
+    SampleSource.open(path, "string").close()
+    assert built == ["auto", "string"]
+
+    # 文本文件更新后重新生成
+    os.utime(path + SAMPLE_INDEX_SUFFIX, (0, 0))
+    SampleSource.open(path, "string").close()
+    assert built == ["auto", "string", "string"]
+
+
+def test_write_sample_index(tmp_path):
+    path = str(tmp_path / "sampled.idx")
+    assert write_sample_index([3, 1, 2], path) == 3
+    source = SampleSource.open(path)
+    assert list(source.batches(1, 2, 10)) == [(0, [1, 2])]
+    source.close()
+    with pytest.raises(ValueError):
+        write_sample_index([1, "a"], path)
+
+
+def test_invalid_index(tmp_path):
+    path = tmp_path / "bad.idx"
+    path.write_bytes(b"\x00" * 64)
+    with pytest.raises(ValueError):
+        SampleSource(str(path))
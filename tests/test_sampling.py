@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+
+"""
+Module Description: 抽样策略与差异率置信区间测试, 数据使用benchmark的进程内模拟collection
+Date: 2026/10/18
+Author: HuYuanCheng
+"""
+import asyncio
+
+import pytest
+
+import benchmark
+from sampling import divergence_interval, hash_ids, sample_ids, SAMPLE_FRACTION, SAMPLE_STRATEGY, STRATEGY_HASH
+
+
+def test_wilson_interval():
+    lower, upper = divergence_interval(10, 100)
+    assert lower == pytest.approx(0.0552, abs=1e-4)
+    assert upper == pytest.approx(0.1744, abs=1e-4)
+    # 没有差异时上界约为z^2 / (n + z^2)
+    assert divergence_interval(0, 100) == (0.0, pytest.approx(3.8415 / 103.8415, abs=1e-5))
+    assert divergence_interval(0, 0) == (0.0, 1.0)
+    narrow = divergence_interval(10, 100, 0.8)
+    assert lower < narrow[0] < narrow[1] < upper
+
+
+def test_hash_ids_selected_on_server():
+    src = benchmark.FakeCollection([{"_id": i} for i in range(5000)])
+    dst = benchmark.FakeCollection([{"_id": i} for i in range(2500, 7500)])
+    ids = asyncio.run(hash_ids(src, 0.1))
+    assert 400 < len(ids) < 600
+    assert asyncio.run(hash_ids(src, 0.1)) == ids
+    # 两端相同的_id入选结果一致
+    assert [doc_id for doc_id in ids if doc_id >= 2500] == \
+           [doc_id for doc_id in asyncio.run(hash_ids(dst, 0.1)) if doc_id < 5000]
+    assert asyncio.run(hash_ids(src, 0)) == []
+    assert len(asyncio.run(hash_ids(src, 1))) == 5000
+
+
+def test_hash_strategy_includes_dst_extras():
+    src = benchmark.FakeCollection([{"_id": i} for i in range(3000)])
+    dst = benchmark.FakeCollection([{"_id": i} for i in range(3000, 6000)])
+    ids = asyncio.run(sample_ids({SAMPLE_STRATEGY: STRATEGY_HASH, SAMPLE_FRACTION: 0.2}, src, dst, 3000, 4))
+    assert ids == sorted(ids)
+    assert any(doc_id < 3000 for doc_id in ids) and any(doc_id >= 3000 for doc_id in ids)
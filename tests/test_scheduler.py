@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+"""
+Module Description: 多collection调度测试
+Date: 2026/10/18
+Author: HuYuanCheng
+"""
+import asyncio
+
+from scheduler import CollectionField, CollectionState, count_collection, estimate_count, result_table, \
+    run_collections
+
+
+class Runner:
+    value = CollectionField()
+
+    def __init__(self):
+        self.value = "runner"
+        self.started = []
+        self.running = 0
+        self.peak = 0
+
+    async def handler(self, state):
+        self.started.append(state.coll)
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        # 各collection读写自己的状态
+        self.value = state.coll
+        await asyncio.sleep(0.01)
+        count_collection(docs=state.size, diffs=1 if state.coll == "b" else 0)
+        self.running -= 1
+        if state.coll == "bad":
+            raise RuntimeError("read failed")
+        state.ok = self.value == state.coll and state.diffs == 0
+
+
+def states(sizes):
+    return [CollectionState("db", coll, size, value=None) for coll, size in sizes]
+
+
+def test_largest_first():
+    runner = Runner()
+    targets = states([("a", 10), ("b", 300), ("c", 50)])
+    asyncio.run(run_collections(targets, runner.handler, 1, print))
+    assert runner.started == ["b", "c", "a"]
+    assert runner.peak == 1
+    assert [(state.ok, state.docs, state.diffs, state.value) for state in targets] == \
+        [(True, 10, 0, "a"), (False, 300, 1, "b"), (True, 50, 0, "c")]
+    # 不在collection任务中时为runner自身的属性
+    assert runner.value == "runner"
+
+
+def test_errors_fail_only_their_collection():
+    runner = Runner()
+    errors = []
+    targets = states([("a", 1), ("bad", 2), ("c", 3), ("d", 4)])
+    targets[3].error = "no bson dump for db.d"
+
+    def log_error(message, **fields):
+        errors.append(fields)
+
+    asyncio.run(run_collections(targets, runner.handler, 2, log_error))
+    assert runner.peak == 2
+    assert sorted(runner.started) == ["a", "bad", "c"]
+    assert [state.ok for state in targets] == [True, False, True, False]
+    assert targets[1].error == "read failed"
+    assert sorted(fields["ns"] for fields in errors) == ["db.bad", "db.d"]
+    lines = result_table(targets)
+    assert lines[1].split()[:2] == ["db.a", "pass"]
+    assert lines[2].split()[:2] == ["db.bad", "error"]
+
+
+def test_estimate_count():
+    class Coll:
+        def __init__(self, error=None):
+            self.error = error
+
+        async def estimated_document_count(self):
+            if self.error:
+                raise self.error
+            return 42
+
+    assert asyncio.run(estimate_count(Coll())) == (42, "")
+    assert asyncio.run(estimate_count(Coll(FileNotFoundError("missing")))) == (0, "missing")
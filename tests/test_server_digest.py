@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+"""
+Module Description: 服务端摘要测试, 需要本地mongod(MONGO_TEST_URL, 默认mongodb://127.0.0.1:27017), 不可用时跳过
+Date: 2026/10/18
+Author: HuYuanCheng
+"""
+import os
+
+import bson
+import pytest
+from bson import Int64
+from bson.raw_bson import RawBSONDocument
+
+from digest import ALGO_BLAKE2B, LOCATION_CLIENT, LOCATION_SERVER, DigestEngine
+
+pymongo = pytest.importorskip("pymongo")
+
+MONGO_TEST_URL = os.environ.get("MONGO_TEST_URL", "mongodb://127.0.0.1:27017")
+
+
+@pytest.fixture(scope="module")
+def coll():
+    client = pymongo.MongoClient(MONGO_TEST_URL, serverSelectionTimeoutMS=1000)
+    try:
+        client.admin.command("ping")
+    except pymongo.errors.PyMongoError as e:
+        pytest.skip("local mongod not available: {}".format(e))
+    coll = client["compare_test"]["server_digest"]
+    coll.drop()
+    yield coll
+    coll.drop()
+    client.close()
+
+
+def server_digests(coll, docs):
+    coll.delete_many({})
+    coll.insert_many(docs)
+    engine = DigestEngine(location=LOCATION_SERVER)
+    return {doc['_id']: engine.digest(doc) for doc in engine.find(coll, {}, sort=True)}
+
+
+def server_digest(coll, doc):
+    """
+    摘要包含_id, 比较的两个版本使用同一_id分别写入后计算
+    """
+    return server_digests(coll, [dict(doc, _id=1)])[1]
+
+
+def client_digest(doc):
+    return DigestEngine(ALGO_BLAKE2B, location=LOCATION_CLIENT).digest(RawBSONDocument(bson.encode(dict(doc, _id=1))))
+
+
+def test_server_digest_detects_edits(coll):
+    base = server_digest(coll, {"name": "a", "n": 1})
+    assert server_digest(coll, {"name": "a", "n": 1}) == base
+    # 字符串、整数值、增加字段、int32改为int64(BSON长度变化)都能检出
+    for changed in ({"name": "b", "n": 1}, {"name": "a", "n": 2}, {"name": "a", "n": 1, "extra": True},
+                    {"name": "a", "n": Int64(1)}):
+        assert server_digest(coll, changed) != base
+
+
+def test_server_fingerprint_matches_fold(coll):
+    docs = [{"_id": i, "v": "x" * i, "f": i / 3} for i in range(50)]
+    digests = server_digests(coll, docs)
+    engine = DigestEngine(location=LOCATION_SERVER)
+    fingerprint = engine.fingerprint_from_server(next(coll.aggregate(engine.fingerprint_pipeline({}))))
+    assert fingerprint == engine.fold(digests.values())
+
+
+def test_server_digest_is_lossy(coll):
+    # 已知限制(见SERVER_DIGEST_WARNING): double小数部分与long/double互换不改变服务端摘要, 本地摘要可以检出
+    for left, right in (({"v": 2.3}, {"v": 2.9}), ({"v": Int64(5)}, {"v": 5.0})):
+        assert server_digest(coll, left) == server_digest(coll, right)
+        assert client_digest(left) != client_digest(right)
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+
+"""
+Module Description: 内存摘要表测试, 多次insert_many暂存为有序run, 查找前一次归并
+Date: 2026/10/18
+Author: HuYuanCheng
+"""
+from bson import ObjectId
+
+from snapshot import DigestTable
+
+
+def value(n):
+    return n.to_bytes(16, 'little')
+
+
+def test_insert_many_batches_merge_once():
+    table = DigestTable()
+    table.insert_many([(i, value(i)) for i in range(0, 100, 3)])
+    table.insert_many([(i, value(i)) for i in range(0, 100, 2)])
+    # 后写入的批次与同一批内靠后的记录覆盖先前的value
+    table.insert_many([(6, value(1000)), (7, value(1001)), (6, value(1002))])
+    assert len(table.runs) == 3
+    expected = {i: value(i) for i in range(100) if i % 2 == 0 or i % 3 == 0}
+    expected.update({6: value(1002), 7: value(1001)})
+    ids = list(expected) + [1, 101, -5]
+    assert table.lookup(ids) == list(expected.values()) + [None, None, None]
+    assert table.runs == []
+    assert len(table) == len(expected)
+    assert [table.id_at(pos) for pos in range(len(table))] == sorted(expected)
+
+    table.insert_many([(1, value(1)), (98, value(2000))])
+    assert table.get(1) == value(1) and table.get(98) == value(2000)
+    assert len(table) == len(expected) + 1
+
+
+def test_build_objectid_keys():
+    ids = [ObjectId() for _ in range(50)]
+    table = DigestTable.build([(doc_id, value(n)) for n, doc_id in enumerate(reversed(ids))])
+    assert table.runs == []
+    assert table.lookup(ids[:3] + [ObjectId()]) == [value(49), value(48), value(47), None]
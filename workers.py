@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+"""
+Module Description: 多进程比对, 每个worker进程独立事件循环, 从共享队列动态领取分片执行
+Date: 2026/10/18
+Author: HuYuanCheng
+"""
+import asyncio
+import multiprocessing
+import os
+import queue
+
+WORKERS = "workers"
+WORKER_CHUNK = "worker_chunk"
+WORKER_CHUNK_SIZE = "worker_chunk_size"
+
+
+def _worker_main(runner, task_queue, result_queue):
+    asyncio.run(_worker_loop(runner, task_queue, result_queue))
+
+
+async def _worker_loop(runner, task_queue, result_queue):
+    """
+    领取分片(name, configure)并执行runner(configure), 结果(name, pid, report)放入结果队列, 收到None时退出
+    """
+    while True:
+        chunk = task_queue.get()
+        if chunk is None:
+            break
+        name, configure = chunk
+        try:
+            report = await runner(configure)
+        except Exception as e:
+            report = {"result": False, "process_count": 0, "error": str(e)}
+        result_queue.put((name, os.getpid(), report))
+
+
+def run_workers(runner, chunks, workers, on_result):
+    """
+    启动workers个进程执行chunks, 每完成一个分片回调on_result(name, pid, report)
+    runner需为模块级协程函数, 返回未完成的分片名(worker进程异常退出时)
+    """
+    if not chunks:
+        return set()
+    # motor客户端不能跨fork使用, 统一使用spawn, 与windows行为一致
+    ctx = multiprocessing.get_context('spawn')
+    task_queue = ctx.Queue()
+    result_queue = ctx.Queue()
+    for chunk in chunks:
+        task_queue.put(chunk)
+
+    workers = max(1, min(workers, len(chunks)))
+    for _ in range(workers):
+        task_queue.put(None)
+    processes = [ctx.Process(target=_worker_main, args=(runner, task_queue, result_queue), daemon=True)
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+
+    pending = set(name for name, _ in chunks)
+    try:
+        while pending:
+            try:
+                name, pid, report = result_queue.get(timeout=1)
+            except queue.Empty:
+                if not any(process.is_alive() for process in processes):
+                    break
+                continue
+            pending.discard(name)
+            on_result(name, pid, report)
+    finally:
+        for process in processes:
+            if pending:
+                process.terminate()
+            process.join()
+    return pending